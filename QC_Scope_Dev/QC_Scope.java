@@ -18,6 +18,8 @@ public class QC_Scope implements PlugIn {
             Uniformity(); return;
         } else if (arg.equals("Ch_Alignment")) {
             Alignment(); return;
+        } else if (arg.equals("Ch_Registration")) {
+            Registration(); return;
         } else if (arg.equals("QCScope_Autostart")) {
             Autostart(); return;
         } else if (arg.equals("QCScope_Toolbar")) {
@@ -39,6 +41,13 @@ public class QC_Scope implements PlugIn {
         }
     }
 
+    public void Registration() {
+        String Script_Path = Path_in_Jar + "Ch_Registration.py";
+        if (!Script_Path.isEmpty()) {
+            Run_Python_Script(Script_Path);
+        }
+    }
+
     public void Autostart() {
         String Script_Path = Path_in_Jar + "Autostart.py";
         if (!Script_Path.isEmpty()) {
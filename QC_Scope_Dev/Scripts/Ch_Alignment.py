@@ -4,24 +4,31 @@
 import os
 import sys
 import csv
-from math import sqrt, floor, asin, cos, fabs
-from ij import IJ, ImagePlus, Prefs, WindowManager
-from ij.process import ImageProcessor, FloatProcessor, ByteProcessor, ImageStatistics, ImageConverter
+import json
+from array import array
+from math import sqrt, floor, ceil, asin, cos, exp, log
+from ij import IJ, ImagePlus, ImageStack, CompositeImage, Prefs, WindowManager
+from ij.io import TiffDecoder, FileInfo
+from ij.process import ImageProcessor, FloatProcessor, ByteProcessor, ShortProcessor, ImageStatistics, ImageConverter, Blitter
 from ij.gui import Overlay, TextRoi
-from ij.plugin import Duplicator, Zoom
-from ij.measure import Measurements, ResultsTable
+from ij.plugin import Duplicator, Zoom, Binner
+from ij.measure import Measurements, ResultsTable, CurveFitter
 from ij.plugin.frame import RoiManager
-from ij.plugin.filter import GaussianBlur
-from loci.plugins import BF
-from loci.plugins.in import ImporterOptions
+from ij.plugin.filter import GaussianBlur, MaximumFinder, RankFilters
+from loci.plugins.in import ImporterOptions, ImportProcess, ImagePlusReader
 from loci.formats import MetadataTools, ImageReader
-from java.io import File
+from ome.units import UNITS
+from java.io import File, RandomAccessFile
+from java.nio import ByteOrder
+from java.nio.channels import FileChannel
+from jarray import zeros
 from java.awt import Font, Color, GridLayout, GridBagLayout, GridBagConstraints, Insets, Frame, Panel, Button, Label, Toolkit
 from javax.swing import JOptionPane, JFileChooser, JTextField, JLabel, JSeparator, JRadioButton, ButtonGroup, JSlider,JButton, JCheckBox, JPanel, JFrame, SwingUtilities, JDialog
 from java.awt.event import ActionListener
 from javax.swing.event import ChangeListener, DocumentListener
-import java.lang.System
+from java.util.concurrent import Callable, Executors
 from fiji.plugin.trackmate import Model, Settings, TrackMate, SelectionModel, Logger
+from fiji.plugin.trackmate import Spot as TrackmateSpot
 from fiji.plugin.trackmate.detection import DogDetectorFactory, LogDetectorFactory
 from fiji.plugin.trackmate.tracking.jaqaman import SparseLAPTrackerFactory
 from fiji.plugin.trackmate.features import FeatureFilter
@@ -36,8 +43,19 @@ Unicode_Micron_Symbol = "u" #chr(0xB5)
 Reset_Preferences = False 
 User_Desktop_Path = os.path.join(os.path.expanduser("~"), "Desktop") 
 Output_Dir = os.path.join(User_Desktop_Path, "Output")
+Bioformats_Sessions = {} # imp ID -> {"Reader": Reader kept open for virtual stacks or None, "Metadata": OME Metadata}
+Resource_Scope = {"Images": [], "Memory_Start": 0} # Temporary images of the image being processed. Released by Close_Resource_Scope
+Metadata_Index_Path = os.path.join(Output_Dir, "{}_Metadata-Index.jsonl".format(Plugin_Name)) # Metadata of the input files shared by the QC Scope scripts
+Folder_Index_Path = os.path.join(Output_Dir, "{}_Folder-Index.json".format(Plugin_Name)) # Directory listings of the scanned folders shared by the QC Scope scripts
+Metadata_Index = None # File Path -> Index entry. Loaded by Get_Metadata_Index
+Resolution_Levels = {} # File Path -> Resolution levels of each series. Filled by Get_Resolution_Levels
 
 Image_Valid_Extensions = (".tif", ".tiff", ".jpg", ".jpeg", ".png", ".czi", ".nd2", ".lif", ".lsm", ".ome.tif", ".ome.tiff")
+Image_Container_Extensions = (".czi", ".nd2", ".lif", ".ome.tif", ".ome.tiff") # Files that can store several series
+Prefetch_Heap_Factor = 3.0 # An image is prefetched if the free memory holds this many times its file size
+Image_Valid_Extension_Set = frozenset([Extension for Extension in Image_Valid_Extensions if Extension.count(".") == 1]) # .ome.tif files end with .tif
+Scan_Threads = 8 # Directories listed in parallel by Scan_Folder
+Image_Tiff_Extensions = (".tif", ".tiff") # Files tried with Open_Image_Tiff before Bioformats
 Space_Unit_Conversion_Dictionary = {
     "micron": Unicode_Micron_Symbol + "m", "microns": Unicode_Micron_Symbol + "m", Unicode_Micron_Symbol + "m": Unicode_Micron_Symbol + "m",
     "um": Unicode_Micron_Symbol + "m", "u": Unicode_Micron_Symbol + "m", u"\u00B5m": Unicode_Micron_Symbol + "m", "nm": "nm", "nanometer": "nm", 
@@ -45,6 +63,55 @@ Space_Unit_Conversion_Dictionary = {
     "meter": "m", "meters": "m", "inch": "in", "inches": "in", "in": "in", "pixel": "pixels", "pixels": "pixels", "": "pixels", " ": "pixels"
 }
 
+# Conversion factors from nm to the Standard Space Unit. Used to express the Emission Wavelengths in the image space unit
+Conversion_Factors = {
+	"{}m".format(Unicode_Micron_Symbol): 1000,	# 1 nm = 0.001 um
+	"nm": 1,		# 1 nm = 1 nm
+	"mm": 1000000,	 # 1 nm = 0.000001 mm
+	"cm": 10000000,	 # 1 nm = 0.0000001 cm
+	"m": 1000000000,	 # 1 nm = 0.000000001 m
+	"in": 2540000, # 1 nm = 0.0000000393701 in (approx.)
+	"pixels": 1,	# Assuming pixels is the default unit and conversion factor for pixels is 1 (since no physical measurement)
+	}
+
+# Coarse to Fine detection parameters
+Coarse_To_Fine_Prominence_Ratio = 0.25 # Prominence of the candidates relative to the (Max - Median) of the downsampled projection
+Coarse_To_Fine_Max_Candidates = 10 # Above this number of candidates the image is not a bead image and the full field is used
+Coarse_To_Fine_Crop_Factor = 1.0 # Lateral half size of the crops in Spot Diameter
+
+# Batch detection around the last accepted spot
+Last_Spot_Crop_Factor = 3.0 # Lateral half size of the crop around the last accepted spot in Spot Diameter
+Last_Spot_Positions = {} # Channel -> (X, Y, Z) of the last accepted spot in the image space unit. Filled by Remember_Spot_Positions
+
+# Per Channel threshold tuning
+Threshold_Tuning_Max_Ratio = 0.5 # The second best spot quality must be below this fraction of the best one to tune the threshold
+
+# Candidate spots shown in the dialog
+Candidate_Threshold_Ratio = 0.1 # Candidates are detected once at this fraction of the threshold and filtered when the threshold changes
+Candidate_Display_Count = 3 # Nb of best candidate qualities displayed per Channel
+Candidate_Qualities_Cache = {} # (Image Name, Channel, Detection Settings) -> (Candidate Threshold, Qualities sorted from the best)
+
+# Batch pre-screen run before the detection. Files failing it are skipped or sent to the processing dialog
+Prescreen_Max_Saturated_Fraction = 0.001 # Fraction of saturated pixels in the Max projection of a Channel
+Prescreen_Min_SNR = 5.0 # (Max - Median) / Standard Deviation of the Max projection of a Channel
+Prescreen_Log_Path = None # CSV log of the pre-screen. Created with the first pre-screened file
+Prescreen_Skip_Reasons = ["Saturated", "No Peak"] # Files failing the pre-screen for these reasons are skipped. Other failures are sent to the processing dialog
+
+# Detection context shared by all the detections of the run. Filled by Get_Detection_Context
+Detection_Context = {}
+
+# FWHM measurement parameters
+FWHM_Profile_Factor = 2.0 # Half length of the line profiles in Spot Diameter. The axial profile is twice longer
+
+# Time Series mode parameters
+Drift_Linking_Factor = 5.0 # Maximum displacement of a bead between frames in Spot Diameter
+
+# Shift model parameters
+Shift_Map_Grid_Size = 32 # Number of points per axis of the shift map image
+
+# Gaussian Fit detection parameters
+Gaussian_Fit_Min_Fraction = 0.05 # Pixels below this fraction of the peak (above background) are not used for the fit
+
 Settings_Template= {
 	Function_Name+".Trackmate.Detection_Method": "Dog Detector",
 	Function_Name+".Trackmate.DogDetector.Threshold_Value": 20.0,
@@ -55,8 +122,20 @@ Settings_Template= {
 	Function_Name+".Trackmate.LogDetector.Median_Filtering": False,
 	Function_Name+".Trackmate.LogDetector.Spot_Diameter": 4.0,
 	Function_Name+".Trackmate.LogDetector.Subpixel_Localization": True,
+	Function_Name+".Trackmate.GaussianFit.Threshold_Value": 100.0,
+	Function_Name+".Trackmate.GaussianFit.Median_Filtering": False,
+	Function_Name+".Trackmate.GaussianFit.Spot_Diameter": 4.0,
+	Function_Name+".Trackmate.GaussianFit.Subpixel_Localization": True,
+	Function_Name+".Trackmate.Coarse_To_Fine": False,
+	Function_Name+".Measure_FWHM": False,
+	Function_Name+".Time_Series_Mode": False,
+	Function_Name+".Low_Memory_Import": False,
+	Function_Name+".Prefetch_Depth": 1,
+	Function_Name+".Shift_Model_Order": 1,
 	Function_Name+".Batch_Mode": True,
+	Function_Name+".Batch_Prescreen": True,
 	Function_Name+".Save_Individual_Files": False,
+	Function_Name+".Output_Format": "Long",
 	Function_Name+".Prolix_Mode": False,
 	Function_Name+".Objective_Mag": "5x",
 	Function_Name+".Objective_NA": 1.0,
@@ -131,13 +210,9 @@ def Get_Images():
 		while not Image_List:
 			Input_Dir_Path = Select_Folder(Default_Path = User_Desktop_Path)
 			Prolix_Message("Selected Folder {}.".format(Input_Dir_Path))
-			for Root, Dirs, Files in os.walk(Input_Dir_Path): # Get Files Recursively
-			# Files = os.listdir(Input_Dir_Path): # Comment the line above and uncomment this line if you don"t want to get files recurcively
-				for File in Files:
-					if File.lower().endswith(tuple(Image_Valid_Extensions)): # Select only files ending with a Image_Valid_extensions
-						Image_List.append(str(os.path.join(Root, File)))
-						Prolix_Message("Success adding {}.".format(os.path.join(Root, File)))
-			Image_List.sort()
+			Image_List = Scan_Folder(Input_Dir_Path) # Get Files Recursively
+			Prolix_Message("Success adding {} files.".format(len(Image_List)))
+			Image_List = Expand_Series(Image_List)
 			if not Image_List:
 				Message = "Failed No valid image files found in the selected folder."
 				Advice = "Valid image file extensions are: " + ", ".join(Image_Valid_Extensions)
@@ -163,23 +238,410 @@ def Select_Folder(Default_Path):
 		sys.exit(Message)
 	return InputDir_Path
 
-# Open an image using Bioformat
-def Open_Image_Bioformats(File_Path):
+# Return the sorted list of the image files in Input_Dir_Path and its subdirectories
+# Directories are listed in parallel one depth at a time. Listings are kept in the Folder Index and a directory is only listed again when its mtime changed
+def Scan_Folder(Input_Dir_Path):
+	Folder_Index = Read_Folder_Index()
+	Scanned_Index = {}
+	Image_List = []
+	Executor = Executors.newFixedThreadPool(Scan_Threads)
+	try:
+		Directories = [Input_Dir_Path]
+		while Directories:
+			Futures = [Executor.submit(Directory_Lister(Directory, Folder_Index.get(Directory))) for Directory in Directories]
+			Directories = []
+			for Future in Futures:
+				Listing = Future.get()
+				if Listing is None:
+					continue
+				Scanned_Index[Listing["Path"]] = Listing
+				Image_List.extend([str(os.path.join(Listing["Path"], Name)) for Name in Listing["Files"]])
+				Directories.extend([os.path.join(Listing["Path"], Directory) for Directory in Listing["Dirs"]])
+	finally:
+		Executor.shutdown()
+	# Directories removed from the scanned folder are dropped from the Folder Index
+	for Directory in Folder_Index.keys():
+		if (Directory == Input_Dir_Path or Directory.startswith(os.path.join(Input_Dir_Path, ""))) and Directory not in Scanned_Index:
+			del Folder_Index[Directory]
+	Folder_Index.update(Scanned_Index)
+	Write_Folder_Index(Folder_Index)
+	Image_List.sort()
+	return Image_List
+
+# List a Directory on the Scan_Folder threads
+class Directory_Lister(Callable):
+	def __init__(self, Directory, Cached_Listing):
+		self.Directory = Directory
+		self.Cached_Listing = Cached_Listing
+	def call(self):
+		return List_Directory(self.Directory, self.Cached_Listing)
+
+# Return the Listing {"Path", "Mtime", "Files", "Dirs"} of the image files and subdirectories of Directory. None if it cannot be read
+# The Cached_Listing is returned if the Directory did not change. Only entries without an image extension are checked for being a directory
+def List_Directory(Directory, Cached_Listing):
+	try:
+		Mtime = os.path.getmtime(Directory)
+		if Cached_Listing is not None and Cached_Listing["Mtime"] == Mtime:
+			return Cached_Listing
+		Files = []
+		Dirs = []
+		for Name in os.listdir(Directory):
+			if os.path.splitext(Name)[1].lower() in Image_Valid_Extension_Set:
+				Files.append(Name)
+			else:
+				Path = os.path.join(Directory, Name)
+				if os.path.isdir(Path) and not os.path.islink(Path): # Links are not followed
+					Dirs.append(Name)
+		return {"Path": Directory, "Mtime": Mtime, "Files": Files, "Dirs": Dirs}
+	except Exception, Error:
+		IJ.log("Failed listing {}: {}".format(Directory, Error))
+		return None
+
+# Return the Folder Index a dictionnary Directory -> Listing (see List_Directory)
+def Read_Folder_Index():
+	if not os.path.exists(Folder_Index_Path):
+		return {}
+	Index_File = open(Folder_Index_Path, "r")
+	try:
+		return json.load(Index_File)
+	except ValueError: # File partially written by an interrupted run
+		return {}
+	finally:
+		Index_File.close()
+
+def Write_Folder_Index(Folder_Index):
+	if not os.path.exists(Output_Dir):
+		os.makedirs(Output_Dir)
+	Index_File = open(Folder_Index_Path, "w")
+	json.dump(Folder_Index, Index_File)
+	Index_File.close()
+	return
+
+# Return the Image_List where each container file with several series is replaced by one File_Path#Series per series
+# Series are counted from the metadata of the file. No pixels are read. Resolution levels of a series are not counted as series
+def Expand_Series(Image_List):
+	Series_List = []
+	for File_Path in Image_List:
+		Nb_Series = 1
+		if File_Path.lower().endswith(Image_Container_Extensions):
+			Nb_Series = len(Get_Resolution_Levels(File_Path))
+		if Nb_Series == 1:
+			Series_List.append(File_Path)
+		else:
+			Prolix_Message("Found {} series in {}.".format(Nb_Series, File_Path))
+			for Series in range(Nb_Series):
+				Series_List.append(Join_Series_Path(File_Path, Series))
+	return Series_List
+
+# Return the resolution levels of each series of File_Path as a list of {"Levels", "Pixel_Width", "Pixel_Height"}
+# Levels are {"Index", "Width", "Height"} from the full resolution to the smallest. Index is the series index of the level for the importer
+# Pyramidal files store downsampled levels that the importer lists as series of their own. Pixel sizes are the ones of the full resolution in micron
+# Levels of unchanged files are read from the Metadata Index without parsing the file
+def Get_Resolution_Levels(File_Path):
+	if File_Path not in Resolution_Levels:
+		File_Size = os.path.getsize(File_Path)
+		File_Mtime = os.path.getmtime(File_Path)
+		Index_Entry = Get_Metadata_Index().get(File_Path)
+		if Index_Entry is not None and Index_Entry["Size"] == File_Size and Index_Entry["Mtime"] == File_Mtime and "Resolution_Levels" in Index_Entry:
+			Resolution_Levels[File_Path] = Index_Entry["Resolution_Levels"]
+			return Resolution_Levels[File_Path]
+		Series_Levels = []
+		Metadata = MetadataTools.createOMEXMLMetadata()
+		Reader = ImageReader()
+		Reader.setFlattenedResolutions(False)
+		Reader.setMetadataStore(Metadata)
+		try:
+			Reader.setId(File_Path)
+			for Series in range(Reader.getSeriesCount()):
+				Reader.setSeries(Series)
+				Levels = []
+				for Resolution in range(Reader.getResolutionCount()):
+					Reader.setResolution(Resolution)
+					Levels.append({"Index": Reader.getCoreIndex(), "Width": Reader.getSizeX(), "Height": Reader.getSizeY()})
+				Pixel_Width = Metadata.getPixelsPhysicalSizeX(Series)
+				Pixel_Height = Metadata.getPixelsPhysicalSizeY(Series)
+				Series_Levels.append({
+					"Levels": Levels,
+					"Pixel_Width": float(Pixel_Width.value(UNITS.MICROMETER)) if Pixel_Width is not None else None,
+					"Pixel_Height": float(Pixel_Height.value(UNITS.MICROMETER)) if Pixel_Height is not None else None,
+					})
+		except Exception, Error:
+			IJ.log("Failed reading the series of {}: {}. Proceeding with the first series only.".format(File_Path, Error))
+			Series_Levels = []
+		finally:
+			Reader.close()
+		if Series_Levels:
+			Add_Metadata_Index_Entry({"Path": File_Path, "Size": File_Size, "Mtime": File_Mtime, "Resolution_Levels": Series_Levels})
+		else:
+			Series_Levels = [{"Levels": [{"Index": 0, "Width": None, "Height": None}], "Pixel_Width": None, "Pixel_Height": None}]
+		Resolution_Levels[File_Path] = Series_Levels
+	return Resolution_Levels[File_Path]
+
+# Series are numbered from 1 in the File_Path#Series names and from 0 in Bioformats
+def Join_Series_Path(File_Path, Series):
+	return "{}#{}".format(File_Path, Series + 1)
+
+# Return File_Path and Series (0 based) of File_Path#Series. Series is None for a plain File_Path
+def Split_Series_Path(Image_File):
+	if "#" in Image_File:
+		File_Path, Series_Label = Image_File.rsplit("#", 1)
+		if Series_Label.isdigit() and os.path.isfile(File_Path):
+			return File_Path, int(Series_Label) - 1
+	return Image_File, None
+
+# Open an image using Bioformat. Series (0 based) selects one series of a container file. Otherwise the first series is opened
+def Open_Image_Bioformats(File_Path, Virtual = False, Series = None):
 	Prolix_Message("Importing {} with Bioformats...".format(File_Path))
 	Bioformat_Options = ImporterOptions()
 	Bioformat_Options.setId(File_Path)
+	Image_Index = 0
+	if Series is not None: # Only the pixels of the full resolution of this series are read
+		Image_Index = Get_Resolution_Levels(File_Path)[Series]["Levels"][0]["Index"]
+		Bioformat_Options.clearSeries()
+		Bioformat_Options.setSeriesOn(Image_Index, True)
+	Bioformat_Options.setVirtual(Virtual) # Planes are read on demand
 	try:
-		imps = BF.openImagePlus(Bioformat_Options)
+		# The file is parsed once. The session keeps its OME metadata for Get_Image_Metadata
+		Import_Process = ImportProcess(Bioformat_Options)
+		if not Import_Process.execute():
+			IJ.log("Failed importation with Bioformats: Import canceled for {}".format(File_Path))
+			return
+		imps = ImagePlusReader(Import_Process).openImagePlus()
+		Reader = Import_Process.getReader()
+		if not Virtual: # Virtual stacks read their planes from the Reader until the image is closed
+			Reader.close()
+			Reader = None
 		if imps and len(imps) > 0:
+			Bioformats_Sessions[imps[0].getID()] = {"Reader": Reader, "Metadata": Import_Process.getOMEMetadata(), "Series": Series, "Image_Index": Image_Index}
 			Prolix_Message("Success Importing {} with Bioformats.".format(File_Path))
 			return imps[0]
 		else:
+			if Reader is not None:
+				Reader.close()
 			IJ.log("Failed importation with Bioformats: No Images found in {}".format(File_Path))
 			return
 	except Exception, Error:
 		IJ.log("Failed Importation with Bioformats: Error opening {}".format(Error))
 		return
 
+# Open an uncompressed 16-bit TIFF written by ImageJ or the camera software by mapping its planes in memory
+# Each plane is copied once from the mapped file into its ShortProcessor. Return None if the file must be read with Bioformats
+def Open_Image_Tiff(File_Path):
+	if ".ome." in os.path.basename(File_Path).lower(): # The OME-XML sets the dimensions of OME-TIFF files
+		return None
+	try:
+		File_Infos = TiffDecoder(os.path.dirname(File_Path), os.path.basename(File_Path)).getTiffInfo()
+	except Exception, Error:
+		Prolix_Message("Failed reading the TIFF header of {}: {}".format(File_Path, Error))
+		return None
+	if not File_Infos:
+		return None
+	First_Info = File_Infos[0]
+	for File_Info in File_Infos:
+		if File_Info.compression != FileInfo.COMPRESSION_NONE or File_Info.fileType != FileInfo.GRAY16_UNSIGNED:
+			return None
+		if File_Info.width != First_Info.width or File_Info.height != First_Info.height or not Is_Contiguous_Plane(File_Info):
+			return None
+	Width = First_Info.width
+	Height = First_Info.height
+	Plane_Size = Width * Height * 2
+	# ImageJ stacks have one header followed by all the planes. Other files have one header per plane
+	if len(File_Infos) == 1:
+		Plane_Offsets = [First_Info.getOffset() + Plane_Index * (Plane_Size + First_Info.gapBetweenImages) for Plane_Index in range(max(1, First_Info.nImages))]
+	else:
+		Plane_Offsets = [File_Info.getOffset() for File_Info in File_Infos]
+	Description = Parse_Tiff_Description(First_Info.description)
+	Nb_Channels = int(Description.get("channels", 1))
+	Nb_Slices = int(Description.get("slices", 1))
+	Nb_Frames = int(Description.get("frames", 1))
+	if Nb_Channels * Nb_Slices * Nb_Frames != len(Plane_Offsets):
+		if "channels" in Description or "slices" in Description or "frames" in Description:
+			return None
+		Nb_Slices = len(Plane_Offsets)
+	Prolix_Message("Mapping {} planes of {}...".format(len(Plane_Offsets), File_Path))
+	Stack = ImageStack(Width, Height)
+	Access_File = RandomAccessFile(File_Path, "r")
+	try:
+		File_Channel = Access_File.getChannel()
+		if Plane_Offsets[-1] + Plane_Size > File_Channel.size():
+			return None
+		for Plane_Offset in Plane_Offsets:
+			Buffer = File_Channel.map(FileChannel.MapMode.READ_ONLY, Plane_Offset, Plane_Size)
+			Buffer.order(ByteOrder.LITTLE_ENDIAN if First_Info.intelByteOrder else ByteOrder.BIG_ENDIAN)
+			Pixels = zeros(Width * Height, "h")
+			Buffer.asShortBuffer().get(Pixels)
+			Stack.addSlice(ShortProcessor(Width, Height, Pixels, None))
+	except Exception, Error:
+		IJ.log("Failed mapping {}: {}. Proceeding with Bioformats.".format(File_Path, Error))
+		return None
+	finally:
+		Access_File.close()
+	imp = ImagePlus(os.path.basename(File_Path), Stack)
+	imp.setDimensions(Nb_Channels, Nb_Slices, Nb_Frames)
+	imp.setOpenAsHyperStack(True)
+	if Nb_Channels > 1:
+		imp = CompositeImage(imp, IJ.COLOR)
+	Calibration = imp.getCalibration()
+	if First_Info.unit:
+		Calibration.setUnit(First_Info.unit)
+		Calibration.pixelWidth = First_Info.pixelWidth
+		Calibration.pixelHeight = First_Info.pixelHeight
+	if "unit" in Description:
+		Calibration.setUnit(Description["unit"].replace("\\u00B5", u"\u00B5"))
+	if "spacing" in Description:
+		Calibration.pixelDepth = float(Description["spacing"])
+	if "finterval" in Description:
+		Calibration.frameInterval = float(Description["finterval"])
+	imp.setFileInfo(First_Info) # Get_Image_Info gets the path of the file from it
+	Prolix_Message("Success opening {} from the mapped file.".format(File_Path))
+	return imp
+
+# Return True if the strips of the plane follow each other in the file
+def Is_Contiguous_Plane(File_Info):
+	if File_Info.stripOffsets is None or len(File_Info.stripOffsets) < 2:
+		return True
+	for Strip in range(1, len(File_Info.stripOffsets)):
+		if File_Info.stripOffsets[Strip] != File_Info.stripOffsets[Strip - 1] + File_Info.stripLengths[Strip - 1]:
+			return False
+	return True
+
+# Return the key=value pairs of the description ImageJ writes in its TIFF files
+def Parse_Tiff_Description(Description):
+	Properties = {}
+	if Description and Description.startswith("ImageJ"):
+		for Line in Description.split("\n"):
+			if "=" in Line:
+				Key, Value = Line.split("=", 1)
+				Properties[Key.strip()] = Value.strip()
+	return Properties
+
+# Return the OME metadata of the image. Imported images reuse their session. Other images are parsed once and cached
+def Get_OME_Metadata(imp, File_Path):
+	Session = Bioformats_Sessions.get(imp.getID())
+	if Session is None:
+		Metadata = MetadataTools.createOMEXMLMetadata()
+		Reader = ImageReader()
+		Reader.setMetadataStore(Metadata)
+		try:
+			Reader.setId(File_Path)
+		finally:
+			Reader.close()
+		Session = {"Reader": None, "Metadata": Metadata, "Series": None, "Image_Index": 0}
+		Bioformats_Sessions[imp.getID()] = Session
+	return Session["Metadata"]
+
+# Close the Bio-Formats session of the image once it is done
+def Close_Bioformats_Session(imp):
+	Session = Bioformats_Sessions.pop(imp.getID(), None)
+	if Session is not None and Session["Reader"] is not None:
+		Session["Reader"].close()
+	return
+
+# Open Image_File (File_Path or File_Path#Series) with Bioformats and the import settings
+def Open_Image_File(Image_File):
+	Settings_Stored = Read_Preferences(Settings_Template)
+	File_Path, Series = Split_Series_Path(Image_File) # Each series of a container file is opened on its own
+	# Time series are read one frame at a time. Low Memory Import keeps one Channel resident at a time
+	Virtual = Settings_Stored[Function_Name+".Time_Series_Mode"] or Settings_Stored[Function_Name+".Low_Memory_Import"]
+	if Series is None and not Virtual and File_Path.lower().endswith(Image_Tiff_Extensions):
+		imp = Open_Image_Tiff(File_Path)
+		if imp is not None:
+			return imp
+	return Open_Image_Bioformats(File_Path, Virtual = Virtual, Series = Series)
+
+# Open an Image_File on the Prefetch thread
+class Image_Loader(Callable):
+	def __init__(self, Image_File):
+		self.Image_File = Image_File
+	def call(self):
+		return Open_Image_File(self.Image_File)
+
+# Open the images following Image in the background while Image is processed
+# Up to Prefetch_Depth images are opened ahead and only if the free memory can hold them
+def Prefetch_Images(Prefetch, Image_List, Image):
+	Prefetch_Depth = int(Read_Preferences(Settings_Template)[Function_Name+".Prefetch_Depth"])
+	Reserved_Memory = sum([Prefetched["Size"] for Prefetched in Prefetch["Images"].values() if not Prefetched["Future"].isDone()])
+	for Next_Image in range(Image + 1, min(Image + 1 + Prefetch_Depth, len(Image_List))):
+		if Next_Image in Prefetch["Images"]:
+			continue
+		Image_File = Image_List[Next_Image]
+		File_Path, Series = Split_Series_Path(Image_File)
+		if not os.path.isfile(File_Path): # Opened images are not prefetched
+			return
+		Size = os.path.getsize(File_Path) * Prefetch_Heap_Factor
+		if Reserved_Memory + Size > IJ.maxMemory() - IJ.currentMemory():
+			Prolix_Message("Not enough free memory to prefetch {}. It is opened when processed.".format(Image_File))
+			return
+		if Prefetch["Executor"] is None:
+			Prefetch["Executor"] = Executors.newSingleThreadExecutor()
+		Prolix_Message("Prefetching {}...".format(Image_File))
+		Prefetch["Images"][Next_Image] = {"Future": Prefetch["Executor"].submit(Image_Loader(Image_File)), "Size": Size}
+		Reserved_Memory += Size
+	return
+
+# Return the image Image. Wait for it if it is prefetched. Otherwise open it now
+def Get_Prefetched_Image(Prefetch, Image, Image_File):
+	Prefetched = Prefetch["Images"].pop(Image, None)
+	if Prefetched is None:
+		return Open_Image_File(Image_File)
+	Prolix_Message("Getting prefetched {}...".format(Image_File))
+	return Prefetched["Future"].get()
+
+# Stop the Prefetch thread and close the images opened ahead that were not processed
+def Stop_Prefetch(Prefetch):
+	for Prefetched in Prefetch["Images"].values():
+		if Prefetched["Future"].cancel(False):
+			continue
+		try:
+			imp = Prefetched["Future"].get()
+		except Exception, Error:
+			IJ.log("Failed prefetching an image: {}".format(Error))
+			continue
+		if imp is not None:
+			imp.close()
+			Close_Bioformats_Session(imp)
+	Prefetch["Images"].clear()
+	if Prefetch["Executor"] is not None:
+		Prefetch["Executor"].shutdown()
+		Prefetch["Executor"] = None
+	return
+
+# Start tracking the temporary images created while processing imp
+def Open_Resource_Scope(imp):
+	Resource_Scope["Images"] = []
+	Resource_Scope["Memory_Start"] = IJ.currentMemory()
+	return
+
+# Register a temporary image so it is released at the end of the image being processed. Return the image
+def Track_Image(Temporary_imp):
+	Resource_Scope["Images"].append(Temporary_imp)
+	return Temporary_imp
+
+# Close a temporary image as soon as it is not needed and stop tracking it
+def Release_Image(Temporary_imp):
+	Temporary_imp.changes = False
+	Temporary_imp.close()
+	Temporary_imp.flush() # Release the pixels even if the image is still referenced
+	if Temporary_imp in Resource_Scope["Images"]:
+		Resource_Scope["Images"].remove(Temporary_imp)
+	return
+
+# Release the temporary images left and the Bio-Formats session of imp. Close imp if it was opened from a folder
+# Log the memory used before and after the image so a leak shows up at the image that causes it
+def Close_Resource_Scope(imp, Close_Image):
+	Image_Name = imp.getTitle()
+	Nb_Images = len(Resource_Scope["Images"])
+	for Temporary_imp in list(Resource_Scope["Images"]):
+		Release_Image(Temporary_imp)
+	if Close_Image:
+		Prolix_Message("Closing {}".format(Image_Name))
+		imp.changes = False
+		imp.close()
+		imp.flush()
+	Close_Bioformats_Session(imp)
+	IJ.log("Memory for {}: {} MB before, {} MB after. {} temporary images were left open.".format(Image_Name, Resource_Scope["Memory_Start"] / 1048576, IJ.currentMemory() / 1048576, Nb_Images))
+	return
+
 # Generate a Unique filepath Directory\Basename_Suffix-001.Extension
 def Generate_Unique_Filepath(Directory, Basename, Suffix, Extension):
 	Prolix_Message("Generating Unique Filepath {}...".format(Basename))
@@ -228,6 +690,13 @@ def Get_Image_Info(imp):
 			Input_File_Path = os.path.join(Input_Dir, Filename)
 			Prolix_Message("Filename: {}, Input Dir: {}, Path: {}".format(Filename, Input_Dir, Input_File_Path))
 	Basename, Extension = os.path.splitext(Filename)
+	# Series of container files are named File#Series
+	Session = Bioformats_Sessions.get(imp.getID())
+	Series = Session.get("Series") if Session is not None else None
+	Image_Index = Session.get("Image_Index", 0) if Session is not None else 0 # Index of the series in the file metadata
+	if Series is not None:
+		Filename = Join_Series_Path(Filename, Series)
+		Basename = Join_Series_Path(Basename, Series)
 	Width = imp.getWidth()
 	Height = imp.getHeight()
 	Nb_Channels = imp.getNChannels()
@@ -251,6 +720,8 @@ def Get_Image_Info(imp):
 	# Dictionnary storing all image information
 	Image_Info = {
 		"Input_File_Path": str(Input_File_Path),
+		"Series": Series,
+		"Image_Index": Image_Index,
 		"Input_Dir": str(Input_Dir),
 		"Filename": str(Filename),
 		"Basename": str(Basename),
@@ -288,27 +759,36 @@ def Get_Image_Metadata(imp):
 	if Image_Info["Input_File_Path"] == "N/A":
 		IJ.log("{} {} can only get metadata from images written on the disk. {} is virtual. Proceeding with information from Preferences...". format(Plugin_Name, Function_Name, Image_Name))
 		return None
-	Bioformat_Options = ImporterOptions()
-	Bioformat_Options.setId(Image_Info["Input_File_Path"])
-	Metadata = MetadataTools.createOMEXMLMetadata()
-	Reader = ImageReader()
-	Reader.setMetadataStore(Metadata)
-	Reader.setId(Image_Info["Input_File_Path"])
-	if Metadata.getImageCount() == 0:
+	# Unchanged files are read from the Metadata Index without parsing the file
+	File_Path = Image_Info["Input_File_Path"]
+	File_Size = os.path.getsize(File_Path)
+	File_Mtime = os.path.getmtime(File_Path)
+	Image_Index = Image_Info["Image_Index"]
+	Index_Path = File_Path if Image_Info["Series"] is None else Join_Series_Path(File_Path, Image_Info["Series"])
+	Index_Entry = Get_Metadata_Index().get(Index_Path)
+	if Index_Entry is not None and Index_Entry["Size"] == File_Size and Index_Entry["Mtime"] == File_Mtime and "Image_Metadata" in Index_Entry:
+		Prolix_Message("Metadata for {} found in the Metadata Index.".format(Image_Name))
+		Image_Metadata = Load_Indexed_Metadata(Index_Entry["Image_Metadata"])
+		if Image_Metadata is None:
+			IJ.log("{} does not contain metadata. Proceeding with information from Preferences...".format(Image_Name))
+		return Image_Metadata
+	Metadata = Get_OME_Metadata(imp, File_Path)
+	if Metadata.getImageCount() <= Image_Index:
 		IJ.log("{} does not contain metadata. Proceeding with information from Preferences...".format(Image_Name))
+		Add_Metadata_Index_Entry({"Path": Index_Path, "Size": File_Size, "Mtime": File_Mtime, "Image_Metadata": None})
 		return None
 	else:
 		Channel_Names_Metadata = []
-		for i in range(Metadata.getChannelCount(0)):
-			Channel_Name = Metadata.getChannelName(0, i) # Channel_Name are Unicode
+		for i in range(Metadata.getChannelCount(Image_Index)):
+			Channel_Name = Metadata.getChannelName(Image_Index, i) # Channel_Name are Unicode
 			if Channel_Name is not None:
 				Channel_Name = str(Channel_Name) # Convert Unicode to regular string
 			Channel_Names_Metadata.append(Channel_Name)
 		if any(Channel_Name is None for Channel_Name in Channel_Names_Metadata):
 			Channel_Names_Metadata = None
 		Channel_WavelengthsEM_Metadata = []
-		for i in range(Metadata.getChannelCount(0)):
-			WavelengthEM = Metadata.getChannelEmissionWavelength(0, i)
+		for i in range(Metadata.getChannelCount(Image_Index)):
+			WavelengthEM = Metadata.getChannelEmissionWavelength(Image_Index, i)
 			if WavelengthEM is not None:
 				# Extract numeric value from the wavelength metadata
 				Value_Str = str(WavelengthEM)
@@ -325,10 +805,12 @@ def Get_Image_Metadata(imp):
 			Channel_WavelengthsEM_Metadata = None
 
 		# Check if metadata contains objective and instrument information
-		if Metadata.getInstrumentCount() > 0 and Metadata.getObjectiveCount(0) > 0:
-			Objective_Mag_Metadata = str(int(Metadata.getObjectiveNominalMagnification(0,0)))+"x"
-			Objective_NA_Metadata = float(Metadata.getObjectiveLensNA(0, 0))
-			Objective_Immersion_Metadata = str(Metadata.getObjectiveImmersion(0, 0))
+		Objective_Indices = Get_Objective_Indices(Metadata, Image_Index)
+		if Objective_Indices is not None:
+			Instrument_Index, Objective_Index = Objective_Indices
+			Objective_Mag_Metadata = str(int(Metadata.getObjectiveNominalMagnification(Instrument_Index, Objective_Index)))+"x"
+			Objective_NA_Metadata = float(Metadata.getObjectiveLensNA(Instrument_Index, Objective_Index))
+			Objective_Immersion_Metadata = str(Metadata.getObjectiveImmersion(Instrument_Index, Objective_Index))
 		else:
 			Objective_Mag_Metadata = None
 			Objective_NA_Metadata = None
@@ -344,6 +826,83 @@ def Get_Image_Metadata(imp):
 		Image_Metadata["Objective_Immersion_Metadata"] = Objective_Immersion_Metadata
 		Image_Metadata["Channel_Names_Metadata"] = Channel_Names_Metadata
 		Image_Metadata["Channel_WavelengthsEM_Metadata"] = Channel_WavelengthsEM_Metadata
+		Add_Metadata_Index_Entry({"Path": Index_Path, "Size": File_Size, "Mtime": File_Mtime, "Image_Metadata": Image_Metadata})
+	return Image_Metadata
+
+# Return the Instrument_Index and Objective_Index of the objective used to acquire Image_Index. None if the metadata has no objective
+# Each series of a container file can reference its own instrument and objective. The first ones are used when the image has no reference
+def Get_Objective_Indices(Metadata, Image_Index):
+	if Metadata.getInstrumentCount() == 0:
+		return None
+	Instrument_Index = 0
+	Instrument_Ref = Metadata.getImageInstrumentRef(Image_Index)
+	if Instrument_Ref is not None:
+		for i in range(Metadata.getInstrumentCount()):
+			if Metadata.getInstrumentID(i) == Instrument_Ref:
+				Instrument_Index = i
+				break
+	if Metadata.getObjectiveCount(Instrument_Index) == 0:
+		return None
+	Objective_Index = 0
+	Objective_ID = Metadata.getObjectiveSettingsID(Image_Index)
+	if Objective_ID is not None:
+		for i in range(Metadata.getObjectiveCount(Instrument_Index)):
+			if Metadata.getObjectiveID(Instrument_Index, i) == Objective_ID:
+				Objective_Index = i
+				break
+	return Instrument_Index, Objective_Index
+
+# Return the Metadata Index a dictionnary File Path -> {"Path", "Size", "Mtime", "Image_Metadata", "Resolution_Levels"}
+# The index is a JSON lines file. Lines are appended when a file is parsed so later lines replace earlier lines of the same path
+def Get_Metadata_Index():
+	global Metadata_Index
+	if Metadata_Index is None:
+		Metadata_Index = {}
+		Nb_Index_Lines = 0
+		if os.path.exists(Metadata_Index_Path):
+			Index_File = open(Metadata_Index_Path, "r")
+			for Index_Line in Index_File:
+				try:
+					Index_Entry = json.loads(Index_Line)
+				except ValueError: # Line partially written by an interrupted run
+					continue
+				Metadata_Index[Index_Entry["Path"]] = Index_Entry
+				Nb_Index_Lines += 1
+			Index_File.close()
+		# Compact the index when most lines are outdated
+		if Nb_Index_Lines > 2 * len(Metadata_Index):
+			Index_File = open(Metadata_Index_Path, "w")
+			for Index_Entry in Metadata_Index.values():
+				Index_File.write(json.dumps(Index_Entry) + "\n")
+			Index_File.close()
+	return Metadata_Index
+
+# Fields of an unchanged file written by another function are kept in the new entry
+def Add_Metadata_Index_Entry(Index_Entry):
+	Indexed_Entry = Get_Metadata_Index().get(Index_Entry["Path"])
+	if Indexed_Entry is not None and Indexed_Entry["Size"] == Index_Entry["Size"] and Indexed_Entry["Mtime"] == Index_Entry["Mtime"]:
+		Merged_Entry = dict(Indexed_Entry)
+		Merged_Entry.update(Index_Entry)
+		Index_Entry = Merged_Entry
+	Index_Line = json.dumps(Index_Entry)
+	Get_Metadata_Index()[Index_Entry["Path"]] = json.loads(Index_Line) # Stored as written so the caller can modify its Image_Metadata
+	if not os.path.exists(Output_Dir):
+		os.makedirs(Output_Dir)
+	Index_File = open(Metadata_Index_Path, "a")
+	Index_File.write(Index_Line + "\n")
+	Index_File.close()
+	return
+
+# Return a copy of the Image_Metadata of an index entry with the strings converted from unicode
+def Load_Indexed_Metadata(Indexed_Metadata):
+	if Indexed_Metadata is None:
+		return None
+	Image_Metadata = {}
+	for Key in ["Objective_Mag_Metadata", "Objective_Immersion_Metadata"]:
+		Image_Metadata[Key] = str(Indexed_Metadata[Key]) if Indexed_Metadata[Key] is not None else None
+	Image_Metadata["Objective_NA_Metadata"] = Indexed_Metadata["Objective_NA_Metadata"]
+	Image_Metadata["Channel_Names_Metadata"] = [str(Channel_Name) for Channel_Name in Indexed_Metadata["Channel_Names_Metadata"]] if Indexed_Metadata["Channel_Names_Metadata"] is not None else None
+	Image_Metadata["Channel_WavelengthsEM_Metadata"] = list(Indexed_Metadata["Channel_WavelengthsEM_Metadata"]) if Indexed_Metadata["Channel_WavelengthsEM_Metadata"] is not None else None
 	return Image_Metadata
 
 def Get_Refractive_Index(Objective_Immersion): # Get the refractive Index (float) from the Immersion media (String). Return Refracive_Index
@@ -366,41 +925,50 @@ def Process_Image_List(Image_List):
 	Data_Processed_All_Files = []
 	global Image
 
-	for Image, Image_File in enumerate(Image_List):
-		# Checking Image_File is an Opened Image
-		if isinstance(Image_File, str) and not ("/" in Image_File or "\\" in Image_File):
-			imp = WindowManager.getImage(Image_File)
-			Image_Window = WindowManager.getFrame(imp.getTitle())
-			Image_Window.toFront()
-			File_Source = "Opened"
-		else: # Image_File is a path, import it with Bioformat
-			imp = Open_Image_Bioformats(Image_File)
-			File_Source = "Folder"
-		#Zoom.set(imp, 0.5);
-		imp.show()
-		Image_Name = imp.getTitle()
-		Prolix_Message("Success opening {} from {}.".format(Image_Name, File_Source))
-		# Process the first image with Process_Image function showing a Dialog
-		if Image == 0:
-			Prolix_Message("Processing initial Image {}.".format(Image_Name))
-			Data_All_Files, Data_Processed_All_Files, Processed_Image_List = Process_Image(imp, Data_All_Files, Data_Processed_All_Files, Processed_Image_List, Batch_Message = "")
-		# For subsequent images, check if batch mode is enabled
-		else:
-			Settings_Stored = Read_Preferences(Settings_Template)
-			if Settings_Stored[Function_Name+".Batch_Mode"]:
-				Prolix_Message("Processing in batch {}.".format(Image_Name))
-				Data_All_Files, Data_Processed_All_Files, Processed_Image_List = Process_Image_Batch(imp, Data_All_Files, Data_Processed_All_Files, Processed_Image_List)
-			else:
-			 	IJ.log("Failed Batch processing {}. Falling back to dialog processing.".format(Image_Name))
-			 	Data_All_Files, Data_Processed_All_Files, Processed_Image_List = Process_Image(imp, Data_All_Files,Data_Processed_All_Files, Processed_Image_List, Batch_Message = "")
-		if File_Source == "Folder":
-			Prolix_Message("Closing {}".format(Image_Name))
-			imp.close()
+	Prefetch = {"Executor": None, "Images": {}} # Image index -> {"Future", "Size"} of the images opened ahead
+	try:
+		for Image, Image_File in enumerate(Image_List):
+			# Checking Image_File is an Opened Image
+			if isinstance(Image_File, str) and not ("/" in Image_File or "\\" in Image_File):
+				imp = WindowManager.getImage(Image_File)
+				Image_Window = WindowManager.getFrame(imp.getTitle())
+				Image_Window.toFront()
+				File_Source = "Opened"
+			else: # Image_File is a path, import it with Bioformat
+				imp = Get_Prefetched_Image(Prefetch, Image, Image_File)
+				File_Source = "Folder"
+			Open_Resource_Scope(imp)
+			try:
+				#Zoom.set(imp, 0.5);
+				imp.show()
+				Image_Name = imp.getTitle()
+				Prolix_Message("Success opening {} from {}.".format(Image_Name, File_Source))
+				# Process the first image with Process_Image function showing a Dialog
+				if Image == 0:
+					Prolix_Message("Processing initial Image {}.".format(Image_Name))
+					Data_All_Files, Data_Processed_All_Files, Processed_Image_List = Process_Image(imp, Data_All_Files, Data_Processed_All_Files, Processed_Image_List, Batch_Message = "")
+					Prefetch_Images(Prefetch, Image_List, Image) # The import settings are set by the first dialog
+				# For subsequent images, check if batch mode is enabled
+				else:
+					Prefetch_Images(Prefetch, Image_List, Image) # The next images are opened while this one is processed
+					Settings_Stored = Read_Preferences(Settings_Template)
+					if Settings_Stored[Function_Name+".Batch_Mode"]:
+						Prolix_Message("Processing in batch {}.".format(Image_Name))
+						Data_All_Files, Data_Processed_All_Files, Processed_Image_List = Process_Image_Batch(imp, Data_All_Files, Data_Processed_All_Files, Processed_Image_List)
+					else:
+					 	IJ.log("Failed Batch processing {}. Falling back to dialog processing.".format(Image_Name))
+					 	Data_All_Files, Data_Processed_All_Files, Processed_Image_List = Process_Image(imp, Data_All_Files,Data_Processed_All_Files, Processed_Image_List, Batch_Message = "")
+			finally: # The image and its resources are released even if the processing stops
+				Close_Resource_Scope(imp, Close_Image = File_Source == "Folder")
+	finally:
+		Stop_Prefetch(Prefetch)
 	return Data_All_Files, Data_Processed_All_Files, Processed_Image_List
 
 def Process_Image(imp, Data_All_Files, Data_Processed_All_Files, Processed_Image_List, Batch_Message):
 	Image_Name = imp.getTitle()
 	Prolix_Message("Processing {}...".format(Image_Name))
+	# The dialog detection always scans the full field so every candidate is shown to the user
+	Last_Spot_Positions.clear()
 	Dialog_Counter = 0
 	User_Click = None
 	Test_Processing = False
@@ -445,10 +1013,14 @@ def Process_Image(imp, Data_All_Files, Data_Processed_All_Files, Processed_Image
 			JOptionPane.showMessageDialog(None, Message, "{} {}".format(Plugin_Name, Function_Name), JOptionPane.INFORMATION_MESSAGE)
 			sys.exit(Message)
 	# Once we break the loop
+	Candidate_Qualities_Cache.clear()
 	Data_File, _, _ = Run_Trackmate_All_Channel(imp, Save_File = True)
 	Data_All_Files.append(Data_File)
+	Remember_Spot_Positions(Data_File)
 	Data_Processed_File = Channel_Alignment_Data_Processing(imp, Data_File)
 	Data_Processed_All_Files.append(Data_Processed_File)
+	if Read_Preferences(Settings_Template)[Function_Name+".Time_Series_Mode"] and imp.getNFrames() > 1:
+		Measure_Drift(imp)
 	Processed_Image_List.append(Image_Name)
 	IJ.log("Success processing {}.".format(Image_Name))
 	return Data_All_Files, Data_Processed_All_Files, Processed_Image_List
@@ -501,13 +1073,27 @@ def Process_Image_Batch(imp, Data_All_Files, Data_Processed_All_Files, Processed
 			Batch_Processing = "Pass"
 		else:
 			Batch_Processing = "Fail"
+	if Batch_Processing == "Pass" and Settings_Stored[Function_Name+".Batch_Prescreen"]:
+		Prescreen_Reasons, Prescreen_Action = Prescreen_Image(imp)
+		if Prescreen_Action == "Skipped":
+			IJ.log("Batch processing skipped {}. Pre-screen failed: {}.".format(Image_Name, "; ".join(Prescreen_Reasons)))
+			return Data_All_Files, Data_Processed_All_Files, Processed_Image_List
+		elif Prescreen_Action == "Sent to dialog":
+			Batch_Message = "Pre-screen failed: {}.".format("; ".join(Prescreen_Reasons))
+			IJ.log("Batch processing failed for {}. {}".format(Image_Name, Batch_Message))
+			return Process_Image(imp, Data_All_Files, Data_Processed_All_Files, Processed_Image_List, Batch_Message)
 	if Batch_Processing == "Pass":
 		Data_File, Nb_Detected_Spot_File, Max_Quality_File = Run_Trackmate_All_Channel(imp, Save_File = True) # Might need to Save File here to avoid running it twice ICIT
+		if not all(Nb_Detected_Spot == 1 for Nb_Detected_Spot in Nb_Detected_Spot_File):
+			Data_File, Nb_Detected_Spot_File = Tune_Channel_Thresholds(imp, Data_File, Nb_Detected_Spot_File)
 		if all(Nb_Detected_Spot == 1 for Nb_Detected_Spot in Nb_Detected_Spot_File):
 			#Data_File, _, _ = Run_Trackmate_All_Channel(imp, Save_File = True)
 			Data_All_Files.append(Data_File)
+			Remember_Spot_Positions(Data_File)
 			Data_Processed_File = Channel_Alignment_Data_Processing(imp, Data_File)
 			Data_Processed_All_Files.append(Data_Processed_File)
+			if Settings_Stored[Function_Name+".Time_Series_Mode"] and imp.getNFrames() > 1:
+				Measure_Drift(imp)
 			Processed_Image_List.append(Image_Name)
 			IJ.log("Success batch processing {}.".format(Image_Name))
 		else:
@@ -518,6 +1104,13 @@ def Process_Image_Batch(imp, Data_All_Files, Data_Processed_All_Files, Processed
 		Data_All_Files, Data_Processed_All_Files, Processed_Image_List = Process_Image(imp, Data_All_Files,Data_Processed_All_Files, Processed_Image_List, Batch_Message)
 	return Data_All_Files, Data_Processed_All_Files, Processed_Image_List
 
+# Store the position of the accepted spot of each Channel. The next batch image is detected first in a crop around it
+def Remember_Spot_Positions(Data_File):
+	for Data_Ch in Data_File:
+		if Get_Nb_Spots(Data_Ch) == 1:
+			Last_Spot_Positions[int(Data_Ch["Constants"]["Channel_Nb"])] = (Data_Ch["Spot_Pos_X"][0], Data_Ch["Spot_Pos_Y"][0], Data_Ch["Spot_Pos_Z"][0])
+	return
+
 def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Message):
 	Image_Name = imp.getTitle()
 	Image_Info = Get_Image_Info(imp)
@@ -562,8 +1155,21 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 		Missing_Channel_WavelengthsEM = Settings_Template[Function_Name + ".Channel_WavelengthsEM"][len(Channel_WavelengthsEM):Nb_Channels]
 		Channel_WavelengthsEM.extend(Missing_Channel_WavelengthsEM)
 
-	# Preprocessing the file before displaying the dialog
-	_, Nb_Detected_Spot_File, Max_Quality_File = Run_Trackmate_All_Channel(imp, Save_File = False)
+	# Preprocessing the file before displaying the dialog. The candidates are filtered with the threshold of each Channel
+	Candidate_Threshold_File = []
+	Candidate_Qualities_File = []
+	Channel_Threshold_File = []
+	Nb_Detected_Spot_File = []
+	Max_Quality_File = []
+	for Channel in range(1, Nb_Channels + 1):
+		Candidate_Threshold, Qualities = Get_Candidate_Qualities(imp, Channel, Settings_Stored)
+		Channel_Threshold = Get_Channel_Threshold(Settings_Stored, Channel)
+		Candidate_Threshold_File.append(Candidate_Threshold)
+		Candidate_Qualities_File.append(Qualities)
+		Channel_Threshold_File.append(Channel_Threshold)
+		Nb_Detected_Spot_File.append(Count_Candidates(Qualities, Channel_Threshold))
+		Max_Quality_File.append(int(Qualities[0]) if Qualities else 10)
+	Prolix_Message("Nb detected Spots for {} = {}".format(Image_Name, Nb_Detected_Spot_File))
 
 	# PreProcessing the Current Channel for display purposes
 	_, _, _ = Run_Trackmate_Single_Channel(imp, Current_Channel, Save_File = False, Display = True)
@@ -613,6 +1219,15 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 			Message = Message + "Increase the detection threshold."
 		elif (sum(Nb_Detected_Spot_File) < Image_Info["Nb_Channels"]):
 			Message = Message + "Decrease the detection threshold."
+		# Suggest a threshold from the candidate qualities of the failing Channels
+		Suggested_Thresholds = []
+		for Channel in range(1, Nb_Channels + 1):
+			if Nb_Detected_Spot_File[Channel - 1] != 1:
+				Suggested_Threshold = Get_Tuned_Threshold(Candidate_Qualities_File[Channel - 1])
+				if Suggested_Threshold is not None:
+					Suggested_Thresholds.append("Ch{} {}".format(Channel, int(Suggested_Threshold)))
+		if Suggested_Thresholds:
+			Message = Message + " Suggested: {}.".format(", ".join(Suggested_Thresholds))
 		IJ.log(Message)
 		Constraints.gridx = Pos_X
 		Constraints.gridy = Pos_Y
@@ -1031,7 +1646,7 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 
 	# Detection Method Radio
 	Detection_Group = ButtonGroup()
-	Detection_Method_List = ["Log Detector", "Dog Detector"]
+	Detection_Method_List = ["Log Detector", "Dog Detector", "Gaussian Fit"]
 	X_Start = Pos_X + 1
 	Y_Start = Pos_Y
 	for i, Method in enumerate(Detection_Method_List):
@@ -1055,7 +1670,7 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 	Constraints.gridy = Pos_Y
 	Constraints.gridwidth = 1
 	Constraints.gridheight = 1
-	Constraints.anchor = GridBagConstraints.WEST
+	Constraints.anchor = GridBagConstraints.NORTHWEST
 	Constraints.insets = Insets(2, 2, 2, 2)
 	Label = "Batch Mode"
 	Batch_Mode_User = JCheckBox(Label)
@@ -1063,6 +1678,66 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 	Batch_Mode_User.setSelected(Settings_Stored[Function_Name+".Batch_Mode"])
 	Processing_Panel.add(Batch_Mode_User, Constraints)
 
+	# Time Series Mode
+	Constraints.gridx = Pos_X + 4
+	Constraints.gridy = Pos_Y
+	Constraints.gridwidth = 1
+	Constraints.gridheight = 1
+	Constraints.anchor = GridBagConstraints.SOUTHWEST
+	Constraints.insets = Insets(2, 2, 2, 2)
+	Label = "Drift Over Time"
+	Time_Series_Mode_User = JCheckBox(Label)
+	Time_Series_Mode_User.setFont(Font("Arial", Font.PLAIN, 12))
+	Time_Series_Mode_User.setSelected(Settings_Stored[Function_Name+".Time_Series_Mode"])
+	Processing_Panel.add(Time_Series_Mode_User, Constraints)
+
+	Pos_Y += 1
+
+	# Output Format Label
+	Constraints.gridx = Pos_X
+	Constraints.gridy = Pos_Y
+	Constraints.gridwidth = 1
+	Constraints.gridheight = 1
+	Constraints.anchor = GridBagConstraints.CENTER
+	Constraints.insets = Insets(2, 2, 2, 2)
+	Label = "Output Format"
+	J_Label = JLabel(Label)
+	J_Label.setFont(Font("Arial", Font.BOLD, 12))
+	Processing_Panel.add(J_Label, Constraints)
+
+	# Output Format Radio. Long has one row per pair of Channels, Matrix one Channel x Channel table per image
+	Output_Format_Group = ButtonGroup()
+	Output_Format_List = ["Long", "Matrix", "Both"]
+	X_Start = Pos_X + 1
+	Y_Start = Pos_Y
+	for i, Output_Format in enumerate(Output_Format_List):
+		Constraints.gridx = X_Start + i
+		Constraints.gridy = Y_Start
+		Constraints.gridwidth = 1
+		Constraints.gridheight = 1
+		Constraints.anchor = GridBagConstraints.CENTER
+		Constraints.insets = Insets(5, 5, 5, 5)
+		Output_Format_Button = JRadioButton(Output_Format)
+		Output_Format_Button.setFont(Font("Arial", Font.PLAIN, 12))
+		Processing_Panel.add(Output_Format_Button, Constraints)
+		Output_Format_Group.add(Output_Format_Button)
+		if Output_Format == Settings_Stored[Function_Name+".Output_Format"]:
+			Output_Format_Button.setSelected(True)
+
+	# Low Memory Import
+	Constraints.gridx = Pos_X + 4
+	Constraints.gridy = Pos_Y
+	Constraints.gridwidth = 1
+	Constraints.gridheight = 1
+	Constraints.anchor = GridBagConstraints.WEST
+	Constraints.insets = Insets(2, 2, 2, 2)
+	Label = "Low Memory Import"
+	Low_Memory_Import_User = JCheckBox(Label)
+	Low_Memory_Import_User.setFont(Font("Arial", Font.PLAIN, 12))
+	Low_Memory_Import_User.setToolTipText("Import the next images as virtual stacks. Only the channel being detected is kept in memory.")
+	Low_Memory_Import_User.setSelected(Settings_Stored[Function_Name+".Low_Memory_Import"])
+	Processing_Panel.add(Low_Memory_Import_User, Constraints)
+
 	Pos_Y += 1
 
 	global DetectionMethod
@@ -1083,8 +1758,11 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 	Quality_Scale = len(str(Quality_Limit))
 	Major_Tick = int(10**(Quality_Scale-1))
 	Threshold_Slider_Stored_Value = int(Settings_Stored[Function_Name+".Trackmate.{}.Threshold_Value".format(DetectionMethod)])
-	Threshold_Slider_Default_Value = int(min(Threshold_Slider_Stored_Value, Quality_Limit))
-	Threshold_Slider = JSlider(0, Quality_Limit, Threshold_Slider_Default_Value)
+	# Below the Candidate Threshold the cached candidates would miss spots
+	Threshold_Slider_Min = int(ceil(max(Candidate_Threshold_File)))
+	Quality_Limit = max(Quality_Limit, Threshold_Slider_Min)
+	Threshold_Slider_Default_Value = max(Threshold_Slider_Min, int(min(Threshold_Slider_Stored_Value, Quality_Limit)))
+	Threshold_Slider = JSlider(Threshold_Slider_Min, Quality_Limit, Threshold_Slider_Default_Value)
 	Threshold_Slider.setMajorTickSpacing(Major_Tick)
 	if int(Major_Tick/10) > 1:
 		Minor_Tick = int(Major_Tick/10)
@@ -1094,11 +1772,18 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 	Threshold_Slider.setPaintTicks(True)
 	Threshold_Slider.setPaintLabels(True)
 
-	# Add a listener to display the current slider value in the label
+	# Add a listener to display the current slider value in the label and filter the cached candidates with it
+	# A new threshold replaces the tuned thresholds of the Channels
 	class Threshold_Slider_Listener(ChangeListener):
 		def stateChanged(self, event):
 			Value = Threshold_Slider.getValue()
 			Label_Threshold_Value.setText("Threshold {}".format(Value))
+			if Value == Threshold_Slider_Stored_Value:
+				Thresholds = Channel_Threshold_File
+			else:
+				Thresholds = [Value] * Nb_Channels
+			Nb_Detected_Spot_Live = [Count_Candidates(Qualities, Threshold) for Qualities, Threshold in zip(Candidate_Qualities_File, Thresholds)]
+			Nb_Detected_Spot_Label.setText(str(" " * 13).join(map(str, Nb_Detected_Spot_Live)))
 
 	Threshold_Slider.addChangeListener(Threshold_Slider_Listener())
 
@@ -1172,6 +1857,32 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 	Spot_Diameter_User.setHorizontalAlignment(JTextField.CENTER)
 	Processing_Panel.add(Spot_Diameter_User, Constraints)
 
+	# Coarse to Fine
+	Constraints.gridx = Pos_X + 3
+	Constraints.gridy = Pos_Y
+	Constraints.gridwidth = 1
+	Constraints.gridheight = 1
+	Constraints.anchor = GridBagConstraints.NORTHWEST
+	Constraints.insets = Insets(2, 2, 2, 2)
+	Label = "Coarse to Fine"
+	Coarse_To_Fine_User = JCheckBox(Label)
+	Coarse_To_Fine_User.setFont(Font("Arial", Font.PLAIN, 12))
+	Coarse_To_Fine_User.setSelected(Settings_Stored[Function_Name+".Trackmate.Coarse_To_Fine"])
+	Processing_Panel.add(Coarse_To_Fine_User, Constraints)
+
+	# Measure FWHM
+	Constraints.gridx = Pos_X + 3
+	Constraints.gridy = Pos_Y
+	Constraints.gridwidth = 1
+	Constraints.gridheight = 1
+	Constraints.anchor = GridBagConstraints.SOUTHWEST
+	Constraints.insets = Insets(2, 2, 2, 2)
+	Label = "Measure FWHM"
+	Measure_FWHM_User = JCheckBox(Label)
+	Measure_FWHM_User.setFont(Font("Arial", Font.PLAIN, 12))
+	Measure_FWHM_User.setSelected(Settings_Stored[Function_Name+".Measure_FWHM"])
+	Processing_Panel.add(Measure_FWHM_User, Constraints)
+
 	# Subpixel Localization
 	Constraints.gridx = Pos_X + 4
 	Constraints.gridy = Pos_Y + 1
@@ -1268,9 +1979,9 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 	Constraints.anchor = GridBagConstraints.CENTER
 	Constraints.insets = Insets(2, 2, 2, 2)
 	Label = "{}".format(Nb_Detected_Spot_File_String)
-	J_Label = JLabel(Label)
-	J_Label.setFont(Font("Arial", Font.BOLD, 12))
-	Processing_Panel.add(J_Label, Constraints)
+	Nb_Detected_Spot_Label = JLabel(Label)
+	Nb_Detected_Spot_Label.setFont(Font("Arial", Font.BOLD, 12))
+	Processing_Panel.add(Nb_Detected_Spot_Label, Constraints)
 
 	# Cancel Button
 	Cancel_Button = JButton("Cancel")
@@ -1330,6 +2041,28 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 	Processing_Panel.add(OK_Button, Constraints)
 	Processing_Dialog.getRootPane().setDefaultButton(OK_Button) # Preselect OK button
 
+	Pos_Y += 1
+
+	# Best candidate qualities per Channel to guide the threshold
+	Constraints.gridx = Pos_X
+	Constraints.gridy = Pos_Y
+	Constraints.gridwidth = 1
+	Constraints.gridheight = 1
+	Constraints.anchor = GridBagConstraints.EAST
+	Constraints.insets = Insets(2, 2, 2, 2)
+	Label = "Best Qualities"
+	J_Label = JLabel(Label)
+	J_Label.setFont(Font("Arial", Font.BOLD, 12))
+	Processing_Panel.add(J_Label, Constraints)
+	Best_Qualities_File_String = "    ".join(["Ch{}: {}".format(Channel, " > ".join([str(int(Quality)) for Quality in Channel_Qualities[:Candidate_Display_Count]]) or "-") for Channel, Channel_Qualities in enumerate(Candidate_Qualities_File, 1)])
+	Constraints.gridx = Pos_X + 1
+	Constraints.gridwidth = 4
+	Constraints.anchor = GridBagConstraints.CENTER
+	Label = "{}".format(Best_Qualities_File_String)
+	J_Label = JLabel(Label)
+	J_Label.setFont(Font("Arial", Font.PLAIN, 12))
+	Processing_Panel.add(J_Label, Constraints)
+
 	# Add one DocumentListener for all text fields
 	Text_Fields = [Objective_NA_User, Pixel_Width_User, Pixel_Height_User, Pixel_Depth_User, Spot_Diameter_User]
 	Text_Fields.extend(Channel_WavelengthsEm_List_User)
@@ -1376,6 +2109,11 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 			global DetectionMethod
 			DetectionMethod = Detection_Method_User.replace(" ", "")
 			break
+	Output_Format_User = Settings_Stored[Function_Name+".Output_Format"]
+	for Button in Output_Format_Group.getElements():
+		if Button.isSelected():
+			Output_Format_User = str(Button.getText())
+			break
 	Threshold_User = int(Threshold_Slider.getValue())
 	Spot_Diameter_User = float(Spot_Diameter_User.getText())
 	Test_Channel_User = int(Channel_Slider.getValue())
@@ -1384,6 +2122,10 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 	Prolix_Mode_User = Prolix_Mode_User.isSelected()
 	Subpixel_Localization_User = Subpixel_Localization_User.isSelected()
 	Median_Filtering_User = Median_Filtering_User.isSelected()
+	Coarse_To_Fine_User = Coarse_To_Fine_User.isSelected()
+	Measure_FWHM_User = Measure_FWHM_User.isSelected()
+	Time_Series_Mode_User = Time_Series_Mode_User.isSelected()
+	Low_Memory_Import_User = Low_Memory_Import_User.isSelected()
 	Test_Processing_User = Test_Processing_User.isSelected()
 
 	Settings_User = {}
@@ -1404,8 +2146,18 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 		Settings_User[Function_Name+".Trackmate.{}.Spot_Diameter".format(DetectionMethod)] = Spot_Diameter_User
 		Settings_User[Function_Name+".Trackmate.{}.Subpixel_Localization".format(DetectionMethod)] = Subpixel_Localization_User
 		Settings_User[Function_Name+".Trackmate.{}.Median_Filtering".format(DetectionMethod)] = Median_Filtering_User
+		Settings_User[Function_Name+".Trackmate.Coarse_To_Fine"] = Coarse_To_Fine_User
+		Settings_User[Function_Name+".Measure_FWHM"] = Measure_FWHM_User
+		Settings_User[Function_Name+".Time_Series_Mode"] = Time_Series_Mode_User
+		Settings_User[Function_Name+".Low_Memory_Import"] = Low_Memory_Import_User
 		Settings_User[Function_Name+".Batch_Mode"] = Batch_Mode_User
 		Settings_User[Function_Name+".Save_Individual_Files"] = Save_Individual_Files_User
+		Settings_User[Function_Name+".Output_Format"] = Output_Format_User
+		# A threshold set by the user replaces the tuned thresholds of the Channels
+		if Threshold_User != Settings_Stored[Function_Name+".Trackmate.{}.Threshold_Value".format(DetectionMethod)]:
+			Settings_Reset = dict(Settings_Stored)
+			Settings_Reset.update(Settings_User)
+			Save_Channel_Thresholds(Settings_Reset, {})
 		Settings_User[Function_Name+".Prolix_Mode"] = Prolix_Mode_User
 		Test_Processing = Test_Processing_User
 		Selected_Channel = Test_Channel_User
@@ -1453,7 +2205,7 @@ def Run_Trackmate_Single_Channel(imp, Channel, Save_File, Display):
 
 	Trackmate_Model = Model()
 	Trackmate_Model.setPhysicalUnits(Image_Info["Space_Unit_Std"], Image_Info["Time_Unit"])
-	Trackmate_Settings = Settings(imp)
+	Trackmate_Settings = Get_Trackmate_Settings(imp, With_Analyzers = True)
 
 	Detector_Method = Settings_Stored[Function_Name+".Trackmate.Detection_Method"]
 	Prolix_Message("Detector_Method: {}".format(Detector_Method))
@@ -1461,31 +2213,9 @@ def Run_Trackmate_Single_Channel(imp, Channel, Save_File, Display):
 	global DetectionMethod # This a Variable used in to define Detector specific keys in the settings
 	DetectionMethod = Detector_Method.replace(" ", "")
 
-	Threshold = Settings_Stored[Function_Name+".Trackmate.{}.Threshold_Value".format(DetectionMethod)]
-	Median_Filtering = Settings_Stored[Function_Name+".Trackmate.{}.Median_Filtering".format(DetectionMethod)]
 	Radius = Settings_Stored[Function_Name+".Trackmate.{}.Spot_Diameter".format(DetectionMethod)] / 2
-	Subpixel_Localization = Settings_Stored[Function_Name+".Trackmate.{}.Subpixel_Localization".format(DetectionMethod)]
-
-
-	if Detector_Method == "Dog Detector":
-		Trackmate_Settings.detectorFactory = DogDetectorFactory()
-	elif Detector_Method == "Log Detector":
-		Trackmate_Settings.detectorFactory = LogDetectorFactory()
-
-	Trackmate_Settings.detectorSettings = {
-		"TARGET_CHANNEL": Channel,
-		"THRESHOLD": Threshold,
-		"DO_MEDIAN_FILTERING": Median_Filtering,
-		"RADIUS": Radius,
-		"DO_SUBPIXEL_LOCALIZATION": Subpixel_Localization,
-		}
-	Trackmate_Settings.trackerFactory = SparseLAPTrackerFactory()
-	Trackmate_Settings.trackerSettings = Trackmate_Settings.trackerFactory.getDefaultSettings()
-	Trackmate_Settings.addAllAnalyzers()
 
-	Trackmate_Workflow = TrackMate(Trackmate_Model, Trackmate_Settings)
-	Trackmate_Input = Trackmate_Workflow.checkInput()
-	Trackmate_Result = Trackmate_Workflow.process()
+	Trackmate_Input, Trackmate_Result = Run_Detection(imp, Channel, Trackmate_Model, Trackmate_Settings, Settings_Stored, Detection_Only = False)
 
 	if not Trackmate_Input:
 		Message = "Trackmate invalid input for {} Channel = {}".format(Image_Name, Channel)
@@ -1497,7 +2227,6 @@ def Run_Trackmate_Single_Channel(imp, Channel, Save_File, Display):
 		Nb_Detected_Spot_Ch = 0
 		Max_Quality_Ch = 10
 	else:
-		Trackmate_Result = Trackmate_Workflow.process()
 		if not Trackmate_Result:
 			Message = "Trackmate detection failed for {} at Channel = {}.".format(Image_Name, Channel)
 			IJ.log(Message)
@@ -1505,16 +2234,10 @@ def Run_Trackmate_Single_Channel(imp, Channel, Save_File, Display):
 			Nb_Detected_Spot_Ch = 0
 			Max_Quality_Ch = 10
 		else:
-			Prolix_Message("Detection successful for {}. Rendering detection...".format(Image_Name))
-			Selection_Model = SelectionModel(Trackmate_Model)
-			Display_Settings = DisplaySettingsIO.readUserDefault()
-			Display_Settings.setSpotDisplayRadius(0.9)
-			Display_Settings.setSpotDisplayedAsRoi(True)
-			Display_Settings.setSpotShowName(True)
-			Display_Settings.setSpotTransparencyAlpha(0.7)
-			Display_Settings.setSpotFilled(True)
-			Displayer = HyperStackDisplayer(Trackmate_Model, Selection_Model, imp, Display_Settings)
 			if Display:
+				Prolix_Message("Detection successful for {}. Rendering detection...".format(Image_Name))
+				Selection_Model = SelectionModel(Trackmate_Model)
+				Displayer = HyperStackDisplayer(Trackmate_Model, Selection_Model, imp, Get_Display_Settings())
 				Displayer.render()
 				Displayer.refresh()
 			Nb_Detected_Spot_Ch = int(Trackmate_Model.getSpots().getNSpots(False)) # False to get all spots
@@ -1522,63 +2245,49 @@ def Run_Trackmate_Single_Channel(imp, Channel, Save_File, Display):
 			Max_Quality_Ch_All_Spots = []
 			for Spot in Trackmate_Model.getSpots().iterable(False):
 				Max_Quality_Ch_All_Spots.append(int(Spot.getFeature("QUALITY")))
-			Max_Quality_Ch = max(Max_Quality_Ch_All_Spots)
+			Max_Quality_Ch = max(Max_Quality_Ch_All_Spots) if Max_Quality_Ch_All_Spots else 10
 			Prolix_Message("Spot Quality: {} for {} at Channel {}".format(Max_Quality_Ch_All_Spots, Image_Name, Channel))
 
-			Data_Ch = {
-    "Filename": [], "Channel_Nb": [], "Objective_Mag": [], "Objective_NA": [], "Objective_Immersion": [],
-    "Refractive_Index": [], "Detection_Method": [], "Spot_Diameter": [], "Threshold_Value": [],
-    "Subpixel_Localization": [], "Median_Filtering": [], "Batch_Mode": [], "Save_Individual_Files": [],
-    "Prolix_Mode": [], "Width_Pix": [], "Height_Pix": [], "Bit_Depth": [], "Pixel_Width": [], "Pixel_Height": [],
-    "Pixel_Depth": [], "Space_Unit": [], "Space_Unit_Std": [], "Time_Unit": [], "Calibration_Status": [],
-    "Nb_Detected_Spots": [], "Spot_ID": [], "Spot_Quality": [], "Spot_Pos_X": [], "Spot_Pos_Y": [],
-    "Spot_Pos_Z": [], "Spot_Pos_T": [], "Spot_Frame": [], "Spot_Radius": [], "Spot_Visibility": [],
-    "Channel_Name": [], "Channel_Wavelength_EM": []
-}
 			if Nb_Detected_Spot_Ch > 0:
-			# Initialize an empty dictionary with keys that will hold lists as values
+				Prolix_Message("Detection successful for {}. Storing results...".format(Image_Name))
+				# Values that are the same for all spots are stored once in the Constants
+				Data_Ch_Constants = {
+					"Filename": Image_Info["Filename"],
+					"Channel_Nb": Channel,
+					"Objective_Mag": Settings_Stored[Function_Name + ".Objective_Mag"],
+					"Objective_NA": "%.1f" % Settings_Stored[Function_Name + ".Objective_NA"],
+					"Objective_Immersion": Settings_Stored[Function_Name + ".Objective_Immersion"],
+					"Refractive_Index": Get_Refractive_Index(Settings_Stored[Function_Name + ".Objective_Immersion"]),
+					"Detection_Method": Settings_Stored[Function_Name + ".Trackmate.Detection_Method"],
+					"Spot_Diameter": Settings_Stored[Function_Name + ".Trackmate." + str(DetectionMethod) + ".Spot_Diameter"],
+					"Threshold_Value": Get_Channel_Threshold(Settings_Stored, Channel),
+					"Subpixel_Localization": Settings_Stored[Function_Name + ".Trackmate." + str(DetectionMethod) + ".Subpixel_Localization"],
+					"Median_Filtering": Settings_Stored[Function_Name + ".Trackmate." + str(DetectionMethod) + ".Median_Filtering"],
+					"Batch_Mode": Settings_Stored[Function_Name + ".Batch_Mode"],
+					"Save_Individual_Files": Settings_Stored[Function_Name + ".Save_Individual_Files"],
+					"Prolix_Mode": Settings_Stored[Function_Name + ".Prolix_Mode"],
+					"Width_Pix": Image_Info["Width"],
+					"Height_Pix": Image_Info["Height"],
+					"Bit_Depth": Image_Info["Bit_Depth"],
+					"Pixel_Width": Image_Info["Pixel_Width"],
+					"Pixel_Height": Image_Info["Pixel_Height"],
+					"Pixel_Depth": Image_Info["Pixel_Depth"],
+					"Space_Unit": Image_Info["Space_Unit"],
+					"Space_Unit_Std": Image_Info["Space_Unit_Std"],
+					"Time_Unit": Image_Info["Time_Unit"],
+					"Calibration_Status": Image_Info["Calibration_Status"],
+					"Nb_Detected_Spots": int(Nb_Detected_Spot_Ch),
+					"Channel_Name": Settings_Stored[Function_Name+".Channel_Names"][Channel-1],
+					"Channel_Wavelength_EM": Settings_Stored[Function_Name+".Channel_WavelengthsEM"][Channel-1],
+					}
+				Data_Ch = Create_Spot_Table(Data_Ch_Constants)
 				for Spot in Trackmate_Model.getSpots().iterable(False):
-					Prolix_Message("Tracking successful for " + str(Image_Name) + ". Storing results...")
-					# Append the values to the respective lists
-					Data_Ch["Filename"].append(Image_Info["Filename"])
-					Data_Ch["Channel_Nb"].append(Channel)
-					Data_Ch["Objective_Mag"].append(Settings_Stored[Function_Name + ".Objective_Mag"])
-					Data_Ch["Objective_NA"].append("%.1f" % Settings_Stored[Function_Name + ".Objective_NA"])
-					Data_Ch["Objective_Immersion"].append(Settings_Stored[Function_Name + ".Objective_Immersion"])
-					Data_Ch["Refractive_Index"].append(Get_Refractive_Index(Settings_Stored[Function_Name + ".Objective_Immersion"]))
-					Data_Ch["Detection_Method"].append(Settings_Stored[Function_Name + ".Trackmate.Detection_Method"])
-					Data_Ch["Spot_Diameter"].append(Settings_Stored[Function_Name + ".Trackmate." + str(DetectionMethod) + ".Spot_Diameter"])
-					Data_Ch["Threshold_Value"].append(Settings_Stored[Function_Name + ".Trackmate." + str(DetectionMethod) + ".Threshold_Value"])
-					Data_Ch["Subpixel_Localization"].append(Settings_Stored[Function_Name + ".Trackmate." + str(DetectionMethod) + ".Subpixel_Localization"])
-					Data_Ch["Median_Filtering"].append(Settings_Stored[Function_Name + ".Trackmate." + str(DetectionMethod) + ".Median_Filtering"])
-					Data_Ch["Batch_Mode"].append(Settings_Stored[Function_Name + ".Batch_Mode"])
-					Data_Ch["Save_Individual_Files"].append(Settings_Stored[Function_Name + ".Save_Individual_Files"])
-					Data_Ch["Prolix_Mode"].append(Settings_Stored[Function_Name + ".Prolix_Mode"])
-					Data_Ch["Width_Pix"].append(Image_Info["Width"])
-					Data_Ch["Height_Pix"].append(Image_Info["Height"])
-					Data_Ch["Bit_Depth"].append(Image_Info["Bit_Depth"])
-					Data_Ch["Pixel_Width"].append(Image_Info["Pixel_Width"])
-					Data_Ch["Pixel_Height"].append(Image_Info["Pixel_Height"])
-					Data_Ch["Pixel_Depth"].append(Image_Info["Pixel_Depth"])
-					Data_Ch["Space_Unit"].append(Image_Info["Space_Unit"])
-					Data_Ch["Space_Unit_Std"].append(Image_Info["Space_Unit_Std"])
-					Data_Ch["Time_Unit"].append(Image_Info["Time_Unit"])
-					Data_Ch["Calibration_Status"].append(Image_Info["Calibration_Status"])
-					Data_Ch["Nb_Detected_Spots"].append(int(Nb_Detected_Spot_Ch))
-					Data_Ch["Spot_ID"].append(str(Spot.ID()))
-					Data_Ch["Spot_Quality"].append(int(Spot.getFeature("QUALITY")))
-					Data_Ch["Spot_Pos_X"].append(Spot.getFeature("POSITION_X"))
-					Data_Ch["Spot_Pos_Y"].append(Spot.getFeature("POSITION_Y"))
-					Data_Ch["Spot_Pos_Z"].append(Spot.getFeature("POSITION_Z"))
-					Data_Ch["Spot_Pos_T"].append(Spot.getFeature("POSITION_T"))
-					Data_Ch["Spot_Frame"].append(Spot.getFeature("FRAME"))
-					Data_Ch["Spot_Radius"].append(Spot.getFeature("RADIUS"))
-					Data_Ch["Spot_Visibility"].append(Spot.getFeature("VISIBILITY"))
-					if Save_File:
-						Data_Ch["Channel_Name"].append(Settings_Stored[Function_Name+".Channel_Names"][Channel-1])
-						Data_Ch["Channel_Wavelength_EM"].append(Settings_Stored[Function_Name+".Channel_WavelengthsEM"][Channel-1])
+					FWHM = None
+					if Settings_Stored[Function_Name+".Measure_FWHM"]:
+						FWHM = Measure_Spot_FWHM(imp, Channel, Spot, Radius * 2) # Reuse the loaded stack and the detected position
+					Add_Spot(Data_Ch, Spot, FWHM)
 				if Save_File and Settings_Stored[Function_Name+".Save_Individual_Files"] and Settings_Stored[Function_Name+".Prolix_Mode"]:
-					Spot_Table = AllSpotsTableView(Trackmate_Model, Selection_Model, Display_Settings, Image_Info["Filename"])
+					Spot_Table = AllSpotsTableView(Trackmate_Model, SelectionModel(Trackmate_Model), Get_Display_Settings(), Image_Info["Filename"])
 					Output_Trackmate_Spot_Data_Path = Generate_Unique_Filepath(Output_Dir, Image_Info["Basename"], "Trackmate_Spot-Data_Ch-0" + str(Channel), ".csv")
 					Spot_Table.exportToCsv(Output_Trackmate_Spot_Data_Path)
 			else:
@@ -1586,6 +2295,764 @@ def Run_Trackmate_Single_Channel(imp, Channel, Save_File, Display):
 				IJ.log("Trackmate detection failed for {} at Channel = {}. No spot detected.".format(Image_Name, Channel))
 	return Data_Ch, Nb_Detected_Spot_Ch, Max_Quality_Ch
 
+# Run the detection of the selected Detection Method on a Channel and store the spots in the Trackmate_Model
+# Detection_Only skips the tracking and the spot analyzers of the Trackmate workflow. Otherwise the Trackmate_Settings must come with the analyzers (see Get_Trackmate_Settings)
+# The Threshold defaults to the Channel threshold (see Get_Channel_Threshold)
+# Use_Last_Spot detects in the crop around the last accepted spot first. Passes that look at all the candidates of the Channel do not use it
+# Virtual images are detected on a copy of the Channel only (see Get_Channel_Image)
+# Return Trackmate_Input, Trackmate_Result
+def Run_Detection(imp, Channel, Trackmate_Model, Trackmate_Settings, Settings_Stored, Detection_Only, Threshold = None, Use_Last_Spot = True):
+	Channel_imp, Channel_Index = Get_Channel_Image(imp, Channel)
+	if Channel_imp is imp:
+		return Run_Detection_Channel(imp, Channel, Channel, Trackmate_Model, Trackmate_Settings, Settings_Stored, Detection_Only, Threshold, Use_Last_Spot)
+	try:
+		# The copy has a single Channel so the Trackmate Settings are built again on it
+		Channel_Settings = Get_Trackmate_Settings(Channel_imp, With_Analyzers = Trackmate_Settings.getSpotAnalyzerFactories().size() > 0)
+		return Run_Detection_Channel(Channel_imp, Channel_Index, Channel, Trackmate_Model, Channel_Settings, Settings_Stored, Detection_Only, Threshold, Use_Last_Spot)
+	finally:
+		Release_Image(Channel_imp)
+
+# Return the image to detect the Channel on and the index of the Channel in it
+# Virtual stacks read their planes from the file on each access. The planes of the Channel at the first frame are copied once so only one Channel is resident
+# The alignment is detected on the first frame (see Get_Trackmate_Settings). Measure_Drift copies the other frames one at a time
+def Get_Channel_Image(imp, Channel):
+	if not imp.getStack().isVirtual() or (imp.getNChannels() == 1 and imp.getNFrames() == 1):
+		return imp, Channel
+	Prolix_Message("Loading Channel {} of {}...".format(Channel, imp.getTitle()))
+	Channel_imp = Track_Image(Duplicator().run(imp, Channel, Channel, 1, imp.getNSlices(), 1, 1))
+	Channel_imp.setTitle("{}_Channel-0{}".format(imp.getTitle(), Channel))
+	return Channel_imp, 1
+
+# Run the detection on imp at Channel_Index. Channel is the Channel of the original image used for the tuned threshold and the last accepted spot
+def Run_Detection_Channel(imp, Channel_Index, Channel, Trackmate_Model, Trackmate_Settings, Settings_Stored, Detection_Only, Threshold, Use_Last_Spot):
+	Detector_Method = Settings_Stored[Function_Name+".Trackmate.Detection_Method"]
+	DetectionMethod = Detector_Method.replace(" ", "")
+	if Threshold is None:
+		Threshold = Get_Channel_Threshold(Settings_Stored, Channel)
+	Median_Filtering = Settings_Stored[Function_Name+".Trackmate.{}.Median_Filtering".format(DetectionMethod)]
+	Radius = Settings_Stored[Function_Name+".Trackmate.{}.Spot_Diameter".format(DetectionMethod)] / 2
+	Subpixel_Localization = Settings_Stored[Function_Name+".Trackmate.{}.Subpixel_Localization".format(DetectionMethod)]
+
+	Context = Get_Detection_Context()
+	if Detector_Method in Context["Detector_Factories"]:
+		Trackmate_Settings.detectorFactory = Context["Detector_Factories"][Detector_Method]
+
+	Trackmate_Workflow = None
+	if Detector_Method == "Gaussian Fit":
+		# The Gaussian Fit does not use the Trackmate workflow. The fitted spot is added to the Trackmate_Model
+		Trackmate_Input = True
+	else:
+		Trackmate_Settings.detectorSettings = {
+			"TARGET_CHANNEL": Channel_Index,
+			"THRESHOLD": Threshold,
+			"DO_MEDIAN_FILTERING": Median_Filtering,
+			"RADIUS": Radius,
+			"DO_SUBPIXEL_LOCALIZATION": Subpixel_Localization,
+			}
+		Trackmate_Settings.trackerFactory = Context["Tracker_Factory"]
+		Trackmate_Settings.trackerSettings = Context["Tracker_Factory"].getDefaultSettings()
+		Trackmate_Workflow = TrackMate(Trackmate_Model, Trackmate_Settings)
+		Trackmate_Input = Trackmate_Workflow.checkInput()
+
+	Trackmate_Result = False
+	if not Trackmate_Input:
+		return Trackmate_Input, Trackmate_Result
+	if Detector_Method == "Gaussian Fit":
+		Trackmate_Result = Run_Gaussian_Fit_Detection(imp, Channel_Index, Trackmate_Model, Radius * 2, Threshold, Median_Filtering, Subpixel_Localization)
+		return Trackmate_Input, Trackmate_Result
+
+	# In batch the bead sits close to the last accepted spot. Detect in a crop around it first
+	Last_Spot_Crop = Get_Last_Spot_Crop(imp, Channel, Radius * 2) if Use_Last_Spot else None
+	if Last_Spot_Crop is not None:
+		Trackmate_Result = Run_Trackmate_Detection_Crops(imp, Trackmate_Model, Trackmate_Settings, [Last_Spot_Crop])
+		if Trackmate_Result and Trackmate_Model.getSpots().getNSpots(False) > 0:
+			if not Detection_Only:
+				Trackmate_Result = Trackmate_Workflow.computeSpotFeatures(False)
+			return Trackmate_Input, Trackmate_Result
+		Prolix_Message("No spot found around the last accepted spot for {} at Channel {}. Using the full field.".format(imp.getTitle(), Channel))
+
+	# Coarse to Fine restricts the detection to crops around the candidate beads
+	Detection_Crops = None
+	if Settings_Stored[Function_Name+".Trackmate.Coarse_To_Fine"]:
+		Detection_Crops = Get_Detection_Crops(imp, Channel_Index, Radius * 2)
+	if Detection_Crops:
+		Trackmate_Result = Run_Trackmate_Detection_Crops(imp, Trackmate_Model, Trackmate_Settings, Detection_Crops)
+		if Trackmate_Result and not Detection_Only: # Crops only run the detection. The spot analyzers of the full workflow run on the gathered spots
+			Trackmate_Result = Trackmate_Workflow.computeSpotFeatures(False)
+	elif Detection_Only:
+		Trackmate_Result = Trackmate_Workflow.execDetection()
+		Trackmate_Model.getSpots().setVisible(True)
+	else:
+		Trackmate_Result = Trackmate_Workflow.process()
+	return Trackmate_Input, Trackmate_Result
+
+# Return the Detection_Context. The factories are built once per run and the display settings only when something is rendered
+def Get_Detection_Context():
+	if not Detection_Context:
+		Detection_Context["Detector_Factories"] = {"Log Detector": LogDetectorFactory(), "Dog Detector": DogDetectorFactory()}
+		Detection_Context["Tracker_Factory"] = SparseLAPTrackerFactory()
+		Detection_Context["Analyzer_Settings"] = {} # Image geometry -> Settings with all the analyzers
+		Detection_Context["Display_Settings"] = None
+	return Detection_Context
+
+# Return a Trackmate Settings for the image. The analyzers depend on the Nb of Channels and Slices
+# so one template with all analyzers is built per image geometry and copied on the image
+# The alignment is measured on the first frame. The other frames of a time series are detected by Measure_Drift
+def Get_Trackmate_Settings(imp, With_Analyzers):
+	if not With_Analyzers:
+		Trackmate_Settings = Settings(imp)
+	else:
+		Analyzer_Settings = Get_Detection_Context()["Analyzer_Settings"]
+		Geometry = (imp.getNChannels(), imp.getNSlices() > 1)
+		if Geometry not in Analyzer_Settings:
+			Template_Settings = Settings(imp)
+			Template_Settings.addAllAnalyzers()
+			Analyzer_Settings[Geometry] = Template_Settings
+		Trackmate_Settings = Analyzer_Settings[Geometry].copyOn(imp)
+	Trackmate_Settings.tstart = 0
+	Trackmate_Settings.tend = 0
+	return Trackmate_Settings
+
+def Get_Display_Settings():
+	Context = Get_Detection_Context()
+	if Context["Display_Settings"] is None:
+		Display_Settings = DisplaySettingsIO.readUserDefault()
+		Display_Settings.setSpotDisplayRadius(0.9)
+		Display_Settings.setSpotDisplayedAsRoi(True)
+		Display_Settings.setSpotShowName(True)
+		Display_Settings.setSpotTransparencyAlpha(0.7)
+		Display_Settings.setSpotFilled(True)
+		Context["Display_Settings"] = Display_Settings
+	return Context["Display_Settings"]
+
+# Per Channel thresholds are stored in the Prefs per Detection Method and per Objective as "Channel:Threshold,Channel:Threshold"
+def Get_Channel_Thresholds_Key(Settings_Stored):
+	DetectionMethod = Settings_Stored[Function_Name+".Trackmate.Detection_Method"].replace(" ", "")
+	return Function_Name+".Trackmate.{}.Channel_Thresholds.{}".format(DetectionMethod, Settings_Stored[Function_Name+".Objective_Mag"])
+
+# Return a dictionnary Channel -> Threshold of the tuned thresholds for the current Detection Method and Objective
+def Read_Channel_Thresholds(Settings_Stored):
+	Channel_Thresholds = {}
+	for Item in Prefs.get(Get_Channel_Thresholds_Key(Settings_Stored), "").split(","):
+		if ":" in Item:
+			Channel, Threshold = Item.split(":")
+			Channel_Thresholds[int(Channel)] = float(Threshold)
+	return Channel_Thresholds
+
+def Save_Channel_Thresholds(Settings_Stored, Channel_Thresholds):
+	Prefs.set(Get_Channel_Thresholds_Key(Settings_Stored), ",".join(["{}:{}".format(Channel, Channel_Thresholds[Channel]) for Channel in sorted(Channel_Thresholds)]))
+	Prefs.savePreferences()
+	return
+
+# Return the tuned threshold of the Channel or the threshold of the Detection Method if the Channel has not been tuned
+def Get_Channel_Threshold(Settings_Stored, Channel):
+	DetectionMethod = Settings_Stored[Function_Name+".Trackmate.Detection_Method"].replace(" ", "")
+	return Read_Channel_Thresholds(Settings_Stored).get(Channel, Settings_Stored[Function_Name+".Trackmate.{}.Threshold_Value".format(DetectionMethod)])
+
+# Tuning pass. Place the threshold between the best and the second best qualities of the candidates of the Channel (see Get_Candidate_Qualities)
+# Return the tuned threshold or None if the best spot does not clearly stand out
+def Tune_Channel_Threshold(imp, Channel, Settings_Stored):
+	_, Qualities = Get_Candidate_Qualities(imp, Channel, Settings_Stored)
+	Prolix_Message("Threshold tuning qualities for {} at Channel {}: {}".format(imp.getTitle(), Channel, Qualities[:10]))
+	return Get_Tuned_Threshold(Qualities)
+
+# Return the threshold between the best and the second best of the Qualities sorted from the best. None if the best does not stand out
+def Get_Tuned_Threshold(Qualities):
+	if not Qualities or Qualities[0] <= 0:
+		return None
+	if len(Qualities) == 1:
+		return round(Qualities[0] / 2, 1)
+	if Qualities[1] > Qualities[0] * Threshold_Tuning_Max_Ratio:
+		return None
+	return round((Qualities[0] + Qualities[1]) / 2, 1)
+
+# Return the Candidate Threshold and the qualities of the candidate spots of the Channel sorted from the best
+# The candidates are detected once below the threshold and cached so changing the threshold only filters them
+# The crop around the last accepted spot is not used so the candidates come from the whole Channel
+def Get_Candidate_Qualities(imp, Channel, Settings_Stored):
+	DetectionMethod = Settings_Stored[Function_Name+".Trackmate.Detection_Method"].replace(" ", "")
+	Candidate_Threshold = min(Get_Channel_Threshold(Settings_Stored, Channel), Settings_Stored[Function_Name+".Trackmate.{}.Threshold_Value".format(DetectionMethod)]) * Candidate_Threshold_Ratio
+	Image_Info = Get_Image_Info(imp)
+	Cache_Key = (
+		imp.getTitle(), Channel,
+		Image_Info["Pixel_Width"], Image_Info["Pixel_Height"], Image_Info["Pixel_Depth"],
+		Settings_Stored[Function_Name+".Trackmate.Detection_Method"],
+		Settings_Stored[Function_Name+".Trackmate.{}.Spot_Diameter".format(DetectionMethod)],
+		Settings_Stored[Function_Name+".Trackmate.{}.Median_Filtering".format(DetectionMethod)],
+		Settings_Stored[Function_Name+".Trackmate.{}.Subpixel_Localization".format(DetectionMethod)],
+		Settings_Stored[Function_Name+".Trackmate.Coarse_To_Fine"],
+		)
+	if Cache_Key in Candidate_Qualities_Cache and Candidate_Qualities_Cache[Cache_Key][0] <= Candidate_Threshold:
+		return Candidate_Qualities_Cache[Cache_Key]
+	Trackmate_Model = Model()
+	Trackmate_Model.setPhysicalUnits(Image_Info["Space_Unit_Std"], Image_Info["Time_Unit"])
+	Trackmate_Input, Trackmate_Result = Run_Detection(imp, Channel, Trackmate_Model, Get_Trackmate_Settings(imp, With_Analyzers = False), Settings_Stored, Detection_Only = True, Threshold = Candidate_Threshold, Use_Last_Spot = False)
+	Qualities = []
+	if Trackmate_Input and Trackmate_Result:
+		Qualities = sorted([float(Spot.getFeature("QUALITY")) for Spot in Trackmate_Model.getSpots().iterable(False)], reverse = True)
+	Prolix_Message("Candidate qualities for {} at Channel {}: {}".format(imp.getTitle(), Channel, Qualities[:10]))
+	Candidate_Qualities_Cache[Cache_Key] = (Candidate_Threshold, Qualities)
+	return Candidate_Threshold, Qualities
+
+def Count_Candidates(Qualities, Threshold):
+	return len([Quality for Quality in Qualities if Quality >= Threshold])
+
+# Tune the threshold of the Channels that did not detect exactly one spot and detect them again
+# The tuned thresholds are cached in the Prefs so the next images pass on the first detection
+def Tune_Channel_Thresholds(imp, Data_File, Nb_Detected_Spot_File):
+	Settings_Stored = Read_Preferences(Settings_Template)
+	Channel_Thresholds = Read_Channel_Thresholds(Settings_Stored)
+	Current_Channel = imp.getChannel()
+	for Channel in range(1, len(Nb_Detected_Spot_File) + 1):
+		if Nb_Detected_Spot_File[Channel - 1] == 1:
+			continue
+		Threshold = Tune_Channel_Threshold(imp, Channel, Settings_Stored)
+		if Threshold is None:
+			IJ.log("Threshold tuning failed for {} at Channel {}.".format(imp.getTitle(), Channel))
+			continue
+		Prolix_Message("Tuned threshold for {} at Channel {}: {}".format(imp.getTitle(), Channel, Threshold))
+		Previous_Threshold = Channel_Thresholds.get(Channel)
+		Channel_Thresholds[Channel] = Threshold
+		Save_Channel_Thresholds(Settings_Stored, Channel_Thresholds)
+		Data_Ch, Nb_Detected_Spot_Ch, _ = Run_Trackmate_Single_Channel(imp, Channel, Save_File = True, Display = False)
+		if Nb_Detected_Spot_Ch != 1: # Do not keep a threshold that does not work
+			if Previous_Threshold is None:
+				del Channel_Thresholds[Channel]
+			else:
+				Channel_Thresholds[Channel] = Previous_Threshold
+			Save_Channel_Thresholds(Settings_Stored, Channel_Thresholds)
+		Data_File[Channel - 1] = Data_Ch
+		Nb_Detected_Spot_File[Channel - 1] = Nb_Detected_Spot_Ch
+	imp.setC(Current_Channel)
+	imp.updateAndDraw()
+	return Data_File, Nb_Detected_Spot_File
+
+# Time Series mode. Measure the drift of the beads over time and the stability of the Channel shifts
+# Frames are duplicated and detected one at a time so only one frame is held in memory on top of the (virtual) image
+def Measure_Drift(imp):
+	Image_Info = Get_Image_Info(imp)
+	Image_Name = imp.getTitle()
+	Prolix_Message("Measuring drift over time for {}...".format(Image_Name))
+	Settings_Stored = Read_Preferences(Settings_Template)
+	Detection_Method = Settings_Stored[Function_Name+".Trackmate.Detection_Method"].replace(" ", "")
+	Spot_Diameter = Settings_Stored[Function_Name+".Trackmate.{}.Spot_Diameter".format(Detection_Method)]
+	Nb_Channels = Image_Info["Nb_Channels"]
+	Frame_Interval = Image_Info["Frame_Interval"]
+	if Frame_Interval == 0: # Not calibrated in time, use the Frame index
+		Frame_Interval = 1.0
+	Drift_Models = {} # One Trackmate Model per Channel gathering the spots of all frames
+	for Channel in range(1, Nb_Channels + 1):
+		Drift_Models[Channel] = Model()
+		Drift_Models[Channel].setPhysicalUnits(Image_Info["Space_Unit_Std"], Image_Info["Time_Unit"])
+	for Frame_Nb in range(1, Image_Info["Nb_Timepoints"] + 1):
+		Frame_imp = Track_Image(Duplicator().run(imp, 1, Nb_Channels, 1, Image_Info["Nb_Slices"], Frame_Nb, Frame_Nb))
+		for Channel in range(1, Nb_Channels + 1):
+			Frame_Model = Model()
+			Frame_Model.setPhysicalUnits(Image_Info["Space_Unit_Std"], Image_Info["Time_Unit"])
+			Trackmate_Input, Trackmate_Result = Run_Detection(Frame_imp, Channel, Frame_Model, Get_Trackmate_Settings(Frame_imp, With_Analyzers = False), Settings_Stored, Detection_Only = True)
+			if not Trackmate_Input or not Trackmate_Result:
+				continue
+			for Spot in Frame_Model.getSpots().iterable(False):
+				Spot.putFeature("POSITION_T", float((Frame_Nb - 1) * Frame_Interval))
+				Drift_Models[Channel].getSpots().add(Spot, Frame_Nb - 1)
+		Release_Image(Frame_imp)
+		Prolix_Message("Drift detection for {} Frame {}/{} done.".format(Image_Name, Frame_Nb, Image_Info["Nb_Timepoints"]))
+	Drift_Positions = {}
+	for Channel in range(1, Nb_Channels + 1):
+		Drift_Positions[Channel] = Link_Drift_Spots(imp, Drift_Models[Channel], Spot_Diameter)
+	Write_Drift_Results(imp, Drift_Positions, Frame_Interval)
+	Prolix_Message("Measuring drift over time for {}. Done.".format(Image_Name))
+	return Drift_Positions
+
+# Link the spots of a Channel over time with the LAP tracker and keep the longest track as the bead
+# Return a dictionnary Frame (0 based) -> (X, Y, Z). Without track the best quality spot of each frame is used
+def Link_Drift_Spots(imp, Drift_Model, Spot_Diameter):
+	Spot_Collection = Drift_Model.getSpots()
+	Spot_Collection.setVisible(True)
+	Positions = {}
+	if Spot_Collection.getNSpots(False) == 0:
+		return Positions
+	Tracking_Settings = Settings(imp)
+	Tracking_Settings.trackerFactory = Get_Detection_Context()["Tracker_Factory"]
+	Tracking_Settings.trackerSettings = Tracking_Settings.trackerFactory.getDefaultSettings()
+	Tracking_Settings.trackerSettings["LINKING_MAX_DISTANCE"] = float(Spot_Diameter * Drift_Linking_Factor)
+	Tracking_Settings.trackerSettings["GAP_CLOSING_MAX_DISTANCE"] = float(Spot_Diameter * Drift_Linking_Factor)
+	Tracking_Workflow = TrackMate(Drift_Model, Tracking_Settings)
+	Track_Model = Drift_Model.getTrackModel()
+	if Tracking_Workflow.execTracking() and Track_Model.nTracks(False) > 0:
+		Track_ID = max(Track_Model.trackIDs(False), key = lambda ID: Track_Model.trackSpots(ID).size())
+		Spots = Track_Model.trackSpots(Track_ID)
+	else:
+		Prolix_Message("No track found for the drift. Using the best spot of each frame.")
+		Spots = []
+		for Frame_Nb in Spot_Collection.keySet():
+			Spots.append(max(Spot_Collection.iterable(Frame_Nb, False), key = lambda Spot: Spot.getFeature("QUALITY")))
+	for Spot in Spots:
+		Positions[int(Spot.getFeature("FRAME"))] = (Spot.getFeature("POSITION_X"), Spot.getFeature("POSITION_Y"), Spot.getFeature("POSITION_Z"))
+	return Positions
+
+# Return the slope of the least squares line Values = Slope * Times + Intercept
+def Linear_Slope(Times, Values):
+	if len(Times) < 2:
+		return float("nan")
+	Mean_Time = sum(Times) / len(Times)
+	Mean_Value = sum(Values) / len(Values)
+	Covariance = sum([(Time - Mean_Time) * (Value - Mean_Value) for Time, Value in zip(Times, Values)])
+	Variance = sum([(Time - Mean_Time) ** 2 for Time in Times])
+	if Variance == 0:
+		return float("nan")
+	return Covariance / Variance
+
+# Write the per frame positions, drifts and Channel shifts and the drift rates of each Channel
+def Write_Drift_Results(imp, Drift_Positions, Frame_Interval):
+	Image_Info = Get_Image_Info(imp)
+	Settings_Stored = Read_Preferences(Settings_Template)
+	Channel_Names = Settings_Stored[Function_Name+".Channel_Names"]
+	Space_Unit_Std = Image_Info["Space_Unit_Std"]
+	Time_Unit = Image_Info["Time_Unit"] if Image_Info["Frame_Interval"] != 0 else "frame"
+	Channels = sorted([Channel for Channel, Positions in Drift_Positions.items() if Positions])
+	if not Channels:
+		IJ.log("No bead found over time for {}. Drift not measured.".format(Image_Info["Filename"]))
+		return
+	Reference_Channel = Channels[0] # The Channel shifts are measured relative to the first Channel with a bead
+	Drift_Output_Path = Generate_Unique_Filepath(Output_Dir, Image_Info["Basename"], "Channel-Alignment_Drift", ".csv")
+	CSV_File = open(Drift_Output_Path, "w")
+	CSV_Writer = csv.writer(CSV_File, delimiter = ",", lineterminator = "\n")
+	CSV_Writer.writerow([
+		"Filename", "Channel", "Channel Name", "Frame", "Time ({})".format(Time_Unit),
+		"X ({})".format(Space_Unit_Std), "Y ({})".format(Space_Unit_Std), "Z ({})".format(Space_Unit_Std),
+		"X Drift ({})".format(Space_Unit_Std), "Y Drift ({})".format(Space_Unit_Std), "Z Drift ({})".format(Space_Unit_Std), "Drift 3D ({})".format(Space_Unit_Std),
+		"Reference Channel", "X Shift ({})".format(Space_Unit_Std), "Y Shift ({})".format(Space_Unit_Std), "Z Shift ({})".format(Space_Unit_Std),
+		])
+	Drift_Rates = []
+	for Channel in Channels:
+		Positions = Drift_Positions[Channel]
+		Frames = sorted(Positions.keys())
+		X_First, Y_First, Z_First = Positions[Frames[0]] # Drift relative to the first frame with a bead
+		for Frame_Nb in Frames:
+			X, Y, Z = Positions[Frame_Nb]
+			Distance_Lateral, Distance_Axial, Distance_3D = Euclidean_Distance(X_First, Y_First, Z_First, X, Y, Z)
+			Shift = ["", "", ""]
+			if Frame_Nb in Drift_Positions[Reference_Channel]:
+				X_Reference, Y_Reference, Z_Reference = Drift_Positions[Reference_Channel][Frame_Nb]
+				Shift = [round(X - X_Reference, 3), round(Y - Y_Reference, 3), round(Z - Z_Reference, 3)]
+			CSV_Writer.writerow([
+				Image_Info["Filename"], Channel, Channel_Names[Channel - 1], Frame_Nb + 1, round(Frame_Nb * Frame_Interval, 3),
+				round(X, 3), round(Y, 3), round(Z, 3),
+				round(X - X_First, 3), round(Y - Y_First, 3), round(Z - Z_First, 3), round(Distance_3D, 3),
+				Reference_Channel] + Shift)
+		Times = [Frame_Nb * Frame_Interval for Frame_Nb in Frames]
+		Drift_Rate_X = Linear_Slope(Times, [Positions[Frame_Nb][0] for Frame_Nb in Frames])
+		Drift_Rate_Y = Linear_Slope(Times, [Positions[Frame_Nb][1] for Frame_Nb in Frames])
+		Drift_Rate_Z = Linear_Slope(Times, [Positions[Frame_Nb][2] for Frame_Nb in Frames])
+		Drift_Rates.append([
+			Image_Info["Filename"], Channel, Channel_Names[Channel - 1], len(Frames),
+			round(Drift_Rate_X, 5), round(Drift_Rate_Y, 5), round(Drift_Rate_Z, 5),
+			round(sqrt(Drift_Rate_X ** 2 + Drift_Rate_Y ** 2 + Drift_Rate_Z ** 2), 5),
+			])
+	CSV_File.close()
+	Drift_Rates_Output_Path = Generate_Unique_Filepath(Output_Dir, Image_Info["Basename"], "Channel-Alignment_Drift-Rates", ".csv")
+	CSV_File = open(Drift_Rates_Output_Path, "w")
+	CSV_Writer = csv.writer(CSV_File, delimiter = ",", lineterminator = "\n")
+	CSV_Writer.writerow([
+		"Filename", "Channel", "Channel Name", "Nb Frames with Bead",
+		"X Drift Rate ({}/{})".format(Space_Unit_Std, Time_Unit), "Y Drift Rate ({}/{})".format(Space_Unit_Std, Time_Unit), "Z Drift Rate ({}/{})".format(Space_Unit_Std, Time_Unit), "Drift Rate 3D ({}/{})".format(Space_Unit_Std, Time_Unit),
+		])
+	for Row in Drift_Rates:
+		CSV_Writer.writerow(Row)
+	CSV_File.close()
+	return
+
+# Return a FloatProcessor with the Max projection of the Channel at the first frame
+def Get_Channel_Projection(imp, Channel):
+	Stack = imp.getStack()
+	Projection = Stack.getProcessor(imp.getStackIndex(Channel, 1, 1)).convertToFloat().duplicate()
+	for Slice in range(2, imp.getNSlices() + 1):
+		Projection.copyBits(Stack.getProcessor(imp.getStackIndex(Channel, Slice, 1)), 0, 0, Blitter.MAX)
+	return Projection
+
+# Return the index (0 based) of the brightest slice along the column at X, Y
+def Get_Peak_Slice(imp, Channel, X, Y):
+	Stack = imp.getStack()
+	Peak_Slice = 0
+	Max_Value = None
+	for Slice in range(1, imp.getNSlices() + 1):
+		Value = Stack.getProcessor(imp.getStackIndex(Channel, Slice, 1)).getf(X, Y)
+		if Max_Value is None or Value > Max_Value:
+			Max_Value = Value
+			Peak_Slice = Slice - 1
+	return Peak_Slice
+
+# Return the maxima (a Polygon, None for a flat projection) of the Max Projection downsampled so a bead spans about 2 pixels and the Bin_Factor
+def Get_Coarse_Maxima(Projection, Spot_Diameter_Pix):
+	Bin_Factor = max(1, int(Spot_Diameter_Pix / 2))
+	Projection_Binned = Binner().shrink(Projection, Bin_Factor, Bin_Factor, Binner.AVERAGE)
+	Statistics = ImageStatistics.getStatistics(Projection_Binned, Measurements.MEDIAN | Measurements.MIN_MAX, None)
+	Prominence = (Statistics.max - Statistics.median) * Coarse_To_Fine_Prominence_Ratio
+	if Prominence <= 0:
+		return None, Bin_Factor
+	return MaximumFinder().getMaxima(Projection_Binned, Prominence, True), Bin_Factor
+
+# Pre-screen the image from the Max projection of each Channel: saturated fraction, SNR and Nb of peaks at a coarse scale
+# Each Channel is written to the pre-screen log with the action taken for the file
+# Return the list of reasons the image cannot pass (empty if it can) and the action: "Processed", "Skipped" for the Prescreen_Skip_Reasons or "Sent to dialog"
+def Prescreen_Image(imp):
+	Image_Info = Get_Image_Info(imp)
+	Settings_Stored = Read_Preferences(Settings_Template)
+	Detection_Method = Settings_Stored[Function_Name+".Trackmate.Detection_Method"].replace(" ", "")
+	Spot_Diameter_Pix = Settings_Stored[Function_Name+".Trackmate.{}.Spot_Diameter".format(Detection_Method)] / Image_Info["Pixel_Width"]
+	Saturation_Level = 2 ** Image_Info["Bit_Depth"] - 1 if Image_Info["Bit_Depth"] in [8, 16] else None
+	Prescreen_Reasons = []
+	Prescreen_Rows = []
+	Prescreen_Action = "Processed"
+	for Channel in range(1, Image_Info["Nb_Channels"] + 1):
+		Projection = Get_Channel_Projection(imp, Channel)
+		Statistics = ImageStatistics.getStatistics(Projection, Measurements.MEDIAN | Measurements.MIN_MAX | Measurements.STD_DEV, None)
+		Saturated_Fraction = 0.0
+		if Saturation_Level is not None and Statistics.max >= Saturation_Level:
+			Projection.setThreshold(Saturation_Level, Statistics.max, ImageProcessor.NO_LUT_UPDATE)
+			Saturated_Statistics = ImageStatistics.getStatistics(Projection, Measurements.AREA | Measurements.LIMIT, None)
+			Saturated_Fraction = float(Saturated_Statistics.pixelCount) / (Image_Info["Width"] * Image_Info["Height"])
+			Projection.resetThreshold()
+		SNR = (Statistics.max - Statistics.median) / Statistics.stdDev if Statistics.stdDev > 0 else 0.0
+		Maxima, _ = Get_Coarse_Maxima(Projection, Spot_Diameter_Pix)
+		Nb_Peaks = Maxima.npoints if Maxima is not None else 0
+		Channel_Reasons = []
+		if Saturated_Fraction > Prescreen_Max_Saturated_Fraction:
+			Channel_Reasons.append("Saturated")
+		if SNR < Prescreen_Min_SNR:
+			Channel_Reasons.append("Low SNR")
+		if Nb_Peaks == 0:
+			Channel_Reasons.append("No Peak")
+		elif Nb_Peaks > Coarse_To_Fine_Max_Candidates:
+			Channel_Reasons.append("Too Many Peaks")
+		Prolix_Message("Pre-screen {} Channel {}: Saturated Fraction {:.5f}, SNR {:.1f}, Nb Peaks {}.".format(imp.getTitle(), Channel, Saturated_Fraction, SNR, Nb_Peaks))
+		Prescreen_Rows.append([Image_Info["Filename"], Channel, "%.5f" % Saturated_Fraction, "%.1f" % SNR, Nb_Peaks, "Fail" if Channel_Reasons else "Pass", " ".join(Channel_Reasons)])
+		Prescreen_Reasons.extend(["Channel {} {}".format(Channel, Reason) for Reason in Channel_Reasons])
+		if any(Reason in Prescreen_Skip_Reasons for Reason in Channel_Reasons):
+			Prescreen_Action = "Skipped"
+		elif Channel_Reasons and Prescreen_Action == "Processed":
+			Prescreen_Action = "Sent to dialog"
+	for Prescreen_Row in Prescreen_Rows:
+		Prescreen_Row.append(Prescreen_Action)
+	Write_Prescreen_Log(Prescreen_Rows)
+	return Prescreen_Reasons, Prescreen_Action
+
+# Append the rows to the pre-screen log. The log is created with its header for the first pre-screened file
+def Write_Prescreen_Log(Prescreen_Rows):
+	global Prescreen_Log_Path
+	if Prescreen_Log_Path is None:
+		Prescreen_Log_Path = Generate_Unique_Filepath(Output_Dir, "{}_Prescreen".format(Function_Name), "Log", ".csv")
+		CSV_File = open(Prescreen_Log_Path, "w")
+		CSV_Writer = csv.writer(CSV_File, delimiter = ",", lineterminator = "\n")
+		CSV_Writer.writerow(["Filename", "Channel", "Saturated Fraction", "SNR", "Nb Coarse Peaks", "Pre-screen", "Reason", "Action"])
+	else:
+		CSV_File = open(Prescreen_Log_Path, "a")
+		CSV_Writer = csv.writer(CSV_File, delimiter = ",", lineterminator = "\n")
+	for Row in Prescreen_Rows:
+		CSV_Writer.writerow(Row)
+	CSV_File.close()
+	return
+
+# Coarse to Fine detection. Candidate beads are found on a downsampled Max projection of the Channel
+# Return a list of crops [X_Start, X_End, Y_Start, Y_End, Z_Start, Z_End] in pixels around each candidate
+# Return None when no usable candidate is found so the detection runs on the full field
+def Get_Detection_Crops(imp, Channel, Spot_Diameter):
+	Image_Info = Get_Image_Info(imp)
+	Image_Name = imp.getTitle()
+	Spot_Diameter_Pix = Spot_Diameter / Image_Info["Pixel_Width"]
+	Maxima, Bin_Factor = Get_Coarse_Maxima(Get_Channel_Projection(imp, Channel), Spot_Diameter_Pix)
+	if Maxima is None:
+		Prolix_Message("Coarse detection found no candidate for {} at Channel {}. Using the full field.".format(Image_Name, Channel))
+		return None
+	if Maxima.npoints == 0 or Maxima.npoints > Coarse_To_Fine_Max_Candidates:
+		Prolix_Message("Coarse detection found {} candidates for {} at Channel {}. Using the full field.".format(Maxima.npoints, Image_Name, Channel))
+		return None
+	# Crop size follows the Spot Diameter. The axial size is doubled because the PSF is elongated in Z
+	Crop_Half_Size_XY = int(ceil(Spot_Diameter_Pix * Coarse_To_Fine_Crop_Factor)) + Bin_Factor
+	Crop_Half_Size_Z = int(ceil(Spot_Diameter / Image_Info["Pixel_Depth"] * Coarse_To_Fine_Crop_Factor * 2))
+	Detection_Crops = []
+	Candidates = []
+	for i in range(Maxima.npoints):
+		# Map the candidate back to the full resolution pixel grid
+		X = min(Maxima.xpoints[i] * Bin_Factor + Bin_Factor // 2, Image_Info["Width"] - 1)
+		Y = min(Maxima.ypoints[i] * Bin_Factor + Bin_Factor // 2, Image_Info["Height"] - 1)
+		# Skip candidates already covered by a crop
+		Covered = False
+		for X_Candidate, Y_Candidate in Candidates:
+			if abs(X - X_Candidate) <= Crop_Half_Size_XY and abs(Y - Y_Candidate) <= Crop_Half_Size_XY:
+				Covered = True
+				break
+		if Covered:
+			continue
+		Candidates.append((X, Y))
+		Z = Get_Peak_Slice(imp, Channel, X, Y)
+		Detection_Crops.append(Get_Crop(Image_Info, X, Y, Z, Crop_Half_Size_XY, Crop_Half_Size_Z))
+	Prolix_Message("Coarse detection crops for {} at Channel {}: {}".format(Image_Name, Channel, Detection_Crops))
+	return Detection_Crops
+
+# Return the crop [X Start, X End, Y Start, Y End, Z Start, Z End] in pixels around X, Y, Z clipped to the image
+def Get_Crop(Image_Info, X, Y, Z, Crop_Half_Size_XY, Crop_Half_Size_Z):
+	return [
+		max(0, X - Crop_Half_Size_XY), min(Image_Info["Width"] - 1, X + Crop_Half_Size_XY),
+		max(0, Y - Crop_Half_Size_XY), min(Image_Info["Height"] - 1, Y + Crop_Half_Size_XY),
+		max(0, Z - Crop_Half_Size_Z), min(Image_Info["Nb_Slices"] - 1, Z + Crop_Half_Size_Z),
+		]
+
+# Return the crop around the last accepted spot of the Channel. None if there is no position or it falls outside the image
+def Get_Last_Spot_Crop(imp, Channel, Spot_Diameter):
+	if Channel not in Last_Spot_Positions:
+		return None
+	Image_Info = Get_Image_Info(imp)
+	X_Cal, Y_Cal, Z_Cal = Last_Spot_Positions[Channel]
+	X = int(round(X_Cal / Image_Info["Pixel_Width"]))
+	Y = int(round(Y_Cal / Image_Info["Pixel_Height"]))
+	Z = int(round(Z_Cal / Image_Info["Pixel_Depth"]))
+	if not (0 <= X < Image_Info["Width"] and 0 <= Y < Image_Info["Height"] and 0 <= Z < Image_Info["Nb_Slices"]):
+		return None
+	Crop_Half_Size_XY = int(ceil(Spot_Diameter / Image_Info["Pixel_Width"] * Last_Spot_Crop_Factor))
+	Crop_Half_Size_Z = int(ceil(Spot_Diameter / Image_Info["Pixel_Depth"] * Last_Spot_Crop_Factor * 2))
+	Last_Spot_Crop = Get_Crop(Image_Info, X, Y, Z, Crop_Half_Size_XY, Crop_Half_Size_Z)
+	Prolix_Message("Detection crop around the last accepted spot for {} at Channel {}: {}".format(imp.getTitle(), Channel, Last_Spot_Crop))
+	return Last_Spot_Crop
+
+# Run the Trackmate detection in each crop at full resolution and gather the spots in the Trackmate_Model
+# Spot positions are returned by Trackmate in the calibration of the full image. Return True if the detection succeeded
+# Crops of close candidates overlap. A spot found in several crops is kept once with its best quality
+def Run_Trackmate_Detection_Crops(imp, Trackmate_Model, Trackmate_Settings, Detection_Crops):
+	Spot_Collection = Trackmate_Model.getSpots()
+	for Crop in Detection_Crops:
+		Crop_Settings = Trackmate_Settings.copyOn(imp)
+		Crop_Settings.xstart, Crop_Settings.xend, Crop_Settings.ystart, Crop_Settings.yend, Crop_Settings.zstart, Crop_Settings.zend = Crop
+		Crop_Settings.tstart, Crop_Settings.tend = Trackmate_Settings.tstart, Trackmate_Settings.tend
+		Crop_Model = Model()
+		Crop_Model.setPhysicalUnits(Trackmate_Model.getSpaceUnits(), Trackmate_Model.getTimeUnits())
+		Crop_Workflow = TrackMate(Crop_Model, Crop_Settings)
+		if not Crop_Workflow.execDetection():
+			IJ.log("Trackmate detection failed in crop {}: {}".format(Crop, Crop_Workflow.getErrorMessage()))
+			return False
+		for Spot in Crop_Model.getSpots().iterable(False):
+			Spot_Frame = int(Spot.getFeature("FRAME"))
+			Duplicate_Spot = Find_Duplicate_Spot(Spot_Collection, Spot, Spot_Frame)
+			if Duplicate_Spot is not None:
+				if Duplicate_Spot.getFeature("QUALITY") >= Spot.getFeature("QUALITY"):
+					continue
+				Spot_Collection.remove(Duplicate_Spot, Spot_Frame)
+			Spot_Collection.add(Spot, Spot_Frame)
+	Spot_Collection.setVisible(True)
+	return True
+
+# Return the spot of the Spot_Collection at Spot_Frame closer to Spot than its radius. None if there is none
+def Find_Duplicate_Spot(Spot_Collection, Spot, Spot_Frame):
+	Square_Radius = Spot.getFeature("RADIUS") ** 2
+	for Collected_Spot in Spot_Collection.iterable(Spot_Frame, False):
+		if Collected_Spot.squareDistanceTo(Spot) < Square_Radius:
+			return Collected_Spot
+	return None
+
+# Gaussian Fit detection. Find the intensity peak of the Channel and fit a Gaussian in a small window around it
+# The fitted spot is added to the Trackmate_Model if its Quality (fitted amplitude above background) reaches the Threshold
+# Return True if the detection succeeded
+def Run_Gaussian_Fit_Detection(imp, Channel, Trackmate_Model, Spot_Diameter, Threshold, Median_Filtering, Subpixel_Localization):
+	Image_Info = Get_Image_Info(imp)
+	Image_Name = imp.getTitle()
+	Stack = imp.getStack()
+	Nb_Slices = Image_Info["Nb_Slices"]
+	# Lateral position of the peak from the Max projection
+	Projection = Get_Channel_Projection(imp, Channel)
+	if Median_Filtering:
+		RankFilters().rank(Projection, 1, RankFilters.MEDIAN)
+	Peak_Point = MaximumFinder().getMaxima(Projection, 0, False) # Maxima are sorted by value, highest first
+	if Peak_Point.npoints == 0:
+		IJ.log("Gaussian Fit found no intensity peak for {} at Channel {}.".format(Image_Name, Channel))
+		return False
+	X_Peak = Peak_Point.xpoints[0]
+	Y_Peak = Peak_Point.ypoints[0]
+	Z_Peak = Get_Peak_Slice(imp, Channel, X_Peak, Y_Peak)
+	# Fitting window sized from the Spot Diameter. The axial size is doubled because the PSF is elongated in Z
+	Half_Size_XY = max(2, int(ceil(Spot_Diameter / Image_Info["Pixel_Width"])))
+	Half_Size_Z = max(2, int(ceil(Spot_Diameter / Image_Info["Pixel_Depth"] * 2)))
+	if Nb_Slices == 1:
+		Half_Size_Z = 0
+	Window = [] # List of (dX, dY, dZ, Value) relative to the peak
+	for Z in range(max(0, Z_Peak - Half_Size_Z), min(Nb_Slices - 1, Z_Peak + Half_Size_Z) + 1):
+		Processor = Stack.getProcessor(imp.getStackIndex(Channel, Z + 1, 1))
+		for Y in range(max(0, Y_Peak - Half_Size_XY), min(Image_Info["Height"] - 1, Y_Peak + Half_Size_XY) + 1):
+			for X in range(max(0, X_Peak - Half_Size_XY), min(Image_Info["Width"] - 1, X_Peak + Half_Size_XY) + 1):
+				Window.append((X - X_Peak, Y - Y_Peak, Z - Z_Peak, Processor.getf(X, Y)))
+	Background = min([Value for dX, dY, dZ, Value in Window])
+	Peak_Value = Stack.getProcessor(imp.getStackIndex(Channel, Z_Peak + 1, 1)).getf(X_Peak, Y_Peak)
+	Offsets = [0.0, 0.0, 0.0]
+	Quality = Peak_Value - Background
+	if Subpixel_Localization:
+		Fit = Fit_Gaussian(Window, Background, Peak_Value - Background, Nb_Slices > 1)
+		if Fit is None:
+			Prolix_Message("Gaussian Fit did not converge for {} at Channel {}. Using the peak pixel.".format(Image_Name, Channel))
+		else:
+			Offsets, Quality = Fit
+			Half_Sizes = [Half_Size_XY, Half_Size_XY, max(Half_Size_Z, 1)]
+			if max([abs(Offsets[i]) / Half_Sizes[i] for i in range(3)]) > 1:
+				Prolix_Message("Gaussian Fit center outside of the window for {} at Channel {}. Using the peak pixel.".format(Image_Name, Channel))
+				Offsets = [0.0, 0.0, 0.0]
+				Quality = Peak_Value - Background
+	Prolix_Message("Gaussian Fit for {} at Channel {}: Peak ({}, {}, {}) Offsets {} Quality {}".format(Image_Name, Channel, X_Peak, Y_Peak, Z_Peak, Offsets, Quality))
+	if Quality >= Threshold:
+		Spot = TrackmateSpot(
+			(X_Peak + Offsets[0]) * Image_Info["Pixel_Width"],
+			(Y_Peak + Offsets[1]) * Image_Info["Pixel_Height"],
+			(Z_Peak + Offsets[2]) * Image_Info["Pixel_Depth"],
+			Spot_Diameter / 2,
+			Quality
+			)
+		Trackmate_Model.getSpots().add(Spot, 0)
+		Trackmate_Model.getSpots().setVisible(True)
+	return True
+
+# Fit a Gaussian on the Window by linear least squares on the log of the intensities (weighted by the squared intensities)
+# ln(I) = a + bx*X + cx*X^2 + by*Y + cy*Y^2 (+ bz*Z + cz*Z^2). Pixels below Gaussian_Fit_Min_Fraction of the peak are ignored
+# Return the Offsets [X, Y, Z] of the center in pixels and the fitted Amplitude, or None if the fit failed
+def Fit_Gaussian(Window, Background, Amplitude, Fit_Z):
+	if Fit_Z:
+		Nb_Parameters = 7
+	else:
+		Nb_Parameters = 5
+	Normal_Matrix = [[0.0] * Nb_Parameters for i in range(Nb_Parameters)]
+	Normal_Vector = [0.0] * Nb_Parameters
+	for dX, dY, dZ, Value in Window:
+		Value = Value - Background
+		if Value <= Amplitude * Gaussian_Fit_Min_Fraction:
+			continue
+		Weight = Value * Value
+		Basis = [1.0, dX, dX * dX, dY, dY * dY]
+		if Fit_Z:
+			Basis.extend([dZ, dZ * dZ])
+		Log_Value = log(Value)
+		for i in range(Nb_Parameters):
+			Weighted_Basis = Weight * Basis[i]
+			Normal_Vector[i] += Weighted_Basis * Log_Value
+			Row = Normal_Matrix[i]
+			for j in range(i, Nb_Parameters):
+				Row[j] += Weighted_Basis * Basis[j]
+	for i in range(Nb_Parameters): # The Normal Matrix is symmetric
+		for j in range(i):
+			Normal_Matrix[i][j] = Normal_Matrix[j][i]
+	Parameters = Solve_Linear_System(Normal_Matrix, Normal_Vector)
+	if Parameters is None:
+		return None
+	Offsets = [0.0, 0.0, 0.0]
+	Log_Amplitude = Parameters[0]
+	for Axis in range(int((Nb_Parameters - 1) / 2)):
+		B = Parameters[1 + 2 * Axis]
+		C = Parameters[2 + 2 * Axis]
+		if C >= 0: # Not a peak along this axis
+			return None
+		Offsets[Axis] = -B / (2 * C)
+		Log_Amplitude -= B * B / (4 * C)
+	return Offsets, exp(Log_Amplitude)
+
+# Solve Matrix * X = Vector by Gaussian elimination with partial pivoting. Return X or None if the Matrix is singular
+def Solve_Linear_System(Matrix, Vector):
+	Size = len(Vector)
+	Augmented = [list(Matrix[i]) + [Vector[i]] for i in range(Size)]
+	for Column in range(Size):
+		Pivot = max(range(Column, Size), key = lambda Row: abs(Augmented[Row][Column]))
+		if abs(Augmented[Pivot][Column]) < 1e-12:
+			return None
+		Augmented[Column], Augmented[Pivot] = Augmented[Pivot], Augmented[Column]
+		for Row in range(Column + 1, Size):
+			Factor = Augmented[Row][Column] / Augmented[Column][Column]
+			for k in range(Column, Size + 1):
+				Augmented[Row][k] -= Factor * Augmented[Column][k]
+	Solution = [0.0] * Size
+	for Row in range(Size - 1, -1, -1):
+		Sum = Augmented[Row][Size]
+		for k in range(Row + 1, Size):
+			Sum -= Augmented[Row][k] * Solution[k]
+		Solution[Row] = Sum / Augmented[Row][Row]
+	return Solution
+
+# Spot Table storing the detection results of a Channel
+# Values shared by all spots are stored once in Spot_Table["Constants"], per spot values are stored in typed arrays
+Spot_Table_Spot_Columns = [ # Key, Array Typecode, Trackmate Feature
+	("Spot_Quality", "l", "QUALITY"),
+	("Spot_Pos_X", "d", "POSITION_X"),
+	("Spot_Pos_Y", "d", "POSITION_Y"),
+	("Spot_Pos_Z", "d", "POSITION_Z"),
+	("Spot_Pos_T", "d", "POSITION_T"),
+	("Spot_Frame", "l", "FRAME"),
+	("Spot_Radius", "d", "RADIUS"),
+	("Spot_Visibility", "d", "VISIBILITY"),
+	]
+Spot_Table_FWHM_Columns = ["Spot_FWHM_X", "Spot_FWHM_Y", "Spot_FWHM_Z"] # Not a Trackmate Feature. NaN when not measured
+
+# Return an empty Spot_Table a dictionnary with the Constants and one typed array per spot value
+def Create_Spot_Table(Constants):
+	Spot_Table = {"Constants": Constants, "Spot_ID": array("l")}
+	for Key, Typecode, Feature in Spot_Table_Spot_Columns:
+		Spot_Table[Key] = array(Typecode)
+	for Key in Spot_Table_FWHM_Columns:
+		Spot_Table[Key] = array("d")
+	return Spot_Table
+
+# Append the features of a Trackmate Spot and its FWHM [X, Y, Z] (None if not measured) to the Spot_Table
+def Add_Spot(Spot_Table, Spot, FWHM = None):
+	Spot_Table["Spot_ID"].append(int(Spot.ID()))
+	for Key, Typecode, Feature in Spot_Table_Spot_Columns:
+		Value = Spot.getFeature(Feature)
+		if Value is None:
+			Value = 0
+		if Typecode == "l":
+			Spot_Table[Key].append(int(Value))
+		else:
+			Spot_Table[Key].append(float(Value))
+	if FWHM is None:
+		FWHM = [float("nan")] * len(Spot_Table_FWHM_Columns)
+	for Key, Value in zip(Spot_Table_FWHM_Columns, FWHM):
+		Spot_Table[Key].append(Value)
+	return
+
+def Get_Nb_Spots(Spot_Table):
+	return len(Spot_Table["Spot_ID"])
+
+
+# Measure the FWHM of a Spot with 1D Gaussian fits on the X, Y and Z line profiles through the Spot center
+# Return [FWHM_X, FWHM_Y, FWHM_Z] in the image space unit. NaN if the profile is too short or the fit failed
+def Measure_Spot_FWHM(imp, Channel, Spot, Spot_Diameter):
+	Image_Info = Get_Image_Info(imp)
+	Stack = imp.getStack()
+	Pixel_Sizes = [Image_Info["Pixel_Width"], Image_Info["Pixel_Height"], Image_Info["Pixel_Depth"]]
+	Image_Sizes = [Image_Info["Width"], Image_Info["Height"], Image_Info["Nb_Slices"]]
+	Center = [
+		int(round(Spot.getFeature("POSITION_X") / Pixel_Sizes[0])),
+		int(round(Spot.getFeature("POSITION_Y") / Pixel_Sizes[1])),
+		int(round(Spot.getFeature("POSITION_Z") / Pixel_Sizes[2])),
+		]
+	for Axis in range(3):
+		Center[Axis] = max(0, min(Image_Sizes[Axis] - 1, Center[Axis]))
+	FWHM = []
+	for Axis in range(3):
+		Half_Length = int(ceil(Spot_Diameter * FWHM_Profile_Factor / Pixel_Sizes[Axis]))
+		if Axis == 2:
+			Half_Length = Half_Length * 2
+		Positions = []
+		Values = []
+		Point = list(Center)
+		for Index in range(max(0, Center[Axis] - Half_Length), min(Image_Sizes[Axis] - 1, Center[Axis] + Half_Length) + 1):
+			Point[Axis] = Index
+			Processor = Stack.getProcessor(imp.getStackIndex(Channel, Point[2] + 1, 1))
+			Positions.append(Index * Pixel_Sizes[Axis])
+			Values.append(Processor.getf(Point[0], Point[1]))
+		if len(Values) < 5: # Not enough points to fit the 4 parameters of the Gaussian
+			FWHM.append(float("nan"))
+			continue
+		Fitter = CurveFitter(Positions, Values)
+		Fitter.doFit(CurveFitter.GAUSSIAN) # y = a + (b-a)*exp(-(x-c)^2/(2*d^2))
+		Sigma = abs(Fitter.getParams()[3])
+		if Fitter.getStatus() != CurveFitter.SUCCESS or Sigma == 0:
+			FWHM.append(float("nan"))
+		else:
+			FWHM.append(2 * sqrt(2 * log(2)) * Sigma)
+	return FWHM
 
 # Calculate the Nyquist Pixel Size and Nyquist Ratios
 def Nyquist_Calculator(EMWavelength_Unit, Objective_NA, Refractive_Index, Pixel_Width, Pixel_Height, Pixel_Depth):
@@ -1625,370 +3092,585 @@ def Resolution_Calculator(EMWavelength_Unit, Objective_NA, Refractive_Index, Nyq
 	Prolix_Message("Calculating Resolution with Resolution_Lateral_Theoretical: {}, Resolution_Axial_Theoretical: {}, Resolution_Lateral_Practical: {}, Resolution_Axial_Practical: {}".format(Resolution_Lateral_Theoretical, Resolution_Axial_Theoretical, Resolution_Lateral_Practical, Resolution_Axial_Practical))
 	return Resolution_Lateral_Theoretical, Resolution_Axial_Theoretical, Resolution_Lateral_Practical, Resolution_Axial_Practical
 
+# Compute the values depending only on the Channel: Emission Wavelength in Space Unit, Nyquist and Resolution values
+# Return Channel_Optics a dictionnary
+def Get_Channel_Optics(EMWavelength, Objective_NA, Refractive_Index, Pixel_Width, Pixel_Height, Pixel_Depth, Space_Unit_Std):
+	Conversion_Factor = float(Conversion_Factors[Space_Unit_Std])
+	EMWavelength_Unit = EMWavelength / Conversion_Factor
+	Nyquist_Pixel_Size_Lateral, Nyquist_Pixel_Size_Axial, Nyquist_Ratio_Lateral, Nyquist_Ratio_Axial = Nyquist_Calculator(EMWavelength_Unit, Objective_NA, Refractive_Index, Pixel_Width, Pixel_Height, Pixel_Depth)
+	Resolution_Lateral_Theoretical, Resolution_Axial_Theoretical, Resolution_Lateral_Practical, Resolution_Axial_Practical = Resolution_Calculator(EMWavelength_Unit, Objective_NA, Refractive_Index, Nyquist_Ratio_Lateral, Nyquist_Ratio_Axial)
+	Channel_Optics = {
+		"Conversion_Factor": Conversion_Factor,
+		"EMWavelength_Unit": EMWavelength_Unit,
+		"Nyquist_Pixel_Size_Lateral": Nyquist_Pixel_Size_Lateral,
+		"Nyquist_Pixel_Size_Axial": Nyquist_Pixel_Size_Axial,
+		"Nyquist_Ratio_Lateral": Nyquist_Ratio_Lateral,
+		"Nyquist_Ratio_Axial": Nyquist_Ratio_Axial,
+		"Resolution_Lateral_Theoretical": Resolution_Lateral_Theoretical,
+		"Resolution_Axial_Theoretical": Resolution_Axial_Theoretical,
+		"Resolution_Lateral_Practical": Resolution_Lateral_Practical,
+		"Resolution_Axial_Practical": Resolution_Axial_Practical,
+		}
+	return Channel_Optics
+
 # Calculate the xyz coordinates of a point in the Spot1 Spot2 Line depedning on t
 def Line(X_Ch1, Y_Ch1, Z_Ch1, X_Ch2, Y_Ch2, Z_Ch2, t):
 	x = X_Ch1 + t * (X_Ch2 - X_Ch1)
 	y = Y_Ch1 + t * (Y_Ch2 - Y_Ch1)
 	z = Z_Ch1 + t * (Z_Ch2 - Z_Ch1)
 	return x, y, z
-def Compute_Ellipse_Ratio(X_Ch1, Y_Ch1, Z_Ch1, X_Ch2, Y_Ch2, Z_Ch2, Semi_Minor_Axis, Semi_Major_Axis, t):
-	# Get the coordinates of a point on the Spot1 Spot2 line for parameter t
-	x, y, z = Line(X_Ch1, Y_Ch1, Z_Ch1, X_Ch2, Y_Ch2, Z_Ch2, t)
-	# Compute the Ellipse Ratio value from this new point
-	Ellipse_Ratio = ((x - X_Ch1)**2 / Semi_Minor_Axis**2 +
-		 (y - Y_Ch1)**2 / Semi_Minor_Axis**2 +
-		 (z - Z_Ch1)**2 / Semi_Major_Axis**2)
-	return Ellipse_Ratio
-def Project_on_Ellipse(X_Ch1, Y_Ch1, Z_Ch1, X_Ch2, Y_Ch2, Z_Ch2, Semi_Minor_Axis, Semi_Major_Axis, Max_Iterations, Initial_Step, Tolerance):
-	t = 0 # Starting from point X1 Y1 Z1
-	Step = Initial_Step # Start with an initial Step size
-	for Iteration in range(Max_Iterations):
-		Ellipse_Ratio = Compute_Ellipse_Ratio(X_Ch1, Y_Ch1, Z_Ch1, X_Ch2, Y_Ch2, Z_Ch2, Semi_Minor_Axis, Semi_Major_Axis, t)
-		if fabs(Ellipse_Ratio - 1.0) < Tolerance: # Close enough to 1
-			# print "Found t =", t, "where Ellipse Ratio is ",Ellipse_Ratio," after ",iteration," iterations"
-			Prolix_Message("Found t = {} where Ellipse Ratio = {} after {} iterations".format(t, Ellipse_Ratio, Iteration))
-			X_Ref, Y_Ref, Z_Ref = Line(X_Ch1, Y_Ch1, Z_Ch1, X_Ch2, Y_Ch2, Z_Ch2, t) # Retrieve the Coordinates
-			return X_Ref, Y_Ref, Z_Ref
-		# Adjust Step size# The smaller the difference, the smaller the Step
-		if Ellipse_Ratio > 1.0:
-			Step = Step * 0.5 # Reduce Step
-			t -= Step # Move backwards if Ellipse_Ratio > 1
+# Calculate the coordinates of the point where the Spot1 Spot2 line crosses the resolution ellipsoid centered on Spot1
+# The Ellipse Ratio along the line is t^2 * (dx^2/a^2 + dy^2/a^2 + dz^2/b^2) so the crossing (Ratio = 1) is at t = 1/sqrt(...)
+def Project_on_Ellipse(X_Ch1, Y_Ch1, Z_Ch1, X_Ch2, Y_Ch2, Z_Ch2, Semi_Minor_Axis, Semi_Major_Axis):
+	Ellipse_Ratio_Ch2 = ((X_Ch2 - X_Ch1)**2 / Semi_Minor_Axis**2 +
+		(Y_Ch2 - Y_Ch1)**2 / Semi_Minor_Axis**2 +
+		(Z_Ch2 - Z_Ch1)**2 / Semi_Major_Axis**2) # Ellipse Ratio at t = 1
+	if Ellipse_Ratio_Ch2 == 0: # Spots are colocalized the line is a single point
+		return X_Ch1, Y_Ch1, Z_Ch1
+	t = 1 / sqrt(Ellipse_Ratio_Ch2)
+	Prolix_Message("Found t = {} where Ellipse Ratio = 1".format(t))
+	X_Ref, Y_Ref, Z_Ref = Line(X_Ch1, Y_Ch1, Z_Ch1, X_Ch2, Y_Ch2, Z_Ch2, t) # Retrieve the Coordinates
+	return X_Ref, Y_Ref, Z_Ref
+
+def Get_Spot_Position(Data_Ch):
+	return Data_Ch["Spot_Pos_X"][0], Data_Ch["Spot_Pos_Y"][0], Data_Ch["Spot_Pos_Z"][0]
+
+# Return the shift, distance and colocalization metrics of the Spot2 relative to the Spot1
+def Get_Pair_Metrics(Position_Ch1, Position_Ch2, Optics_Ch1, Optics_Ch2, Pixel_Sizes):
+	X_Ch1, Y_Ch1, Z_Ch1 = Position_Ch1
+	X_Ch2, Y_Ch2, Z_Ch2 = Position_Ch2
+	Pixel_Width, Pixel_Height, Pixel_Depth = Pixel_Sizes
+	# Compute distances
+	Distance_Lateral, Distance_Axial, Distance_3D = Euclidean_Distance(X_Ch1, Y_Ch1, Z_Ch1, X_Ch2, Y_Ch2, Z_Ch2)
+	# Resolution is in nm must convert it to match the distance values
+	Semi_Minor_Axis = (max(Optics_Ch1["Resolution_Lateral_Practical"], Optics_Ch2["Resolution_Lateral_Practical"]))/2 # Using the largest number to calculate the Ratios
+	Semi_Major_Axis = (max(Optics_Ch1["Resolution_Axial_Practical"], Optics_Ch2["Resolution_Axial_Practical"]))/2 # Using the largest number to calculate the Ratios
+	# Project the Spot1->Spot2 vector to the Ellipse. Colocalized spots are projected on Spot1
+	X_Proj, Y_Proj, Z_Proj = Project_on_Ellipse(X_Ch1, Y_Ch1, Z_Ch1, X_Ch2, Y_Ch2, Z_Ch2, Semi_Minor_Axis, Semi_Major_Axis)
+	Distance_Lateral_Ref, Distance_Axial_Ref, Distance_3D_Ref = Euclidean_Distance(X_Ch1, Y_Ch1, Z_Ch1, X_Proj, Y_Proj, Z_Proj)
+	if Distance_3D_Ref == 0:
+		Colocalization_Ratio = 0
+	else:
+		Colocalization_Ratio = Distance_3D / Distance_3D_Ref
+	return {
+		"Diff_X": X_Ch2 - X_Ch1,
+		"Diff_Y": Y_Ch2 - Y_Ch1,
+		"Diff_Z": Z_Ch2 - Z_Ch1,
+		"Diff_X_Pix": (X_Ch2 - X_Ch1) / Pixel_Width,
+		"Diff_Y_Pix": (Y_Ch2 - Y_Ch1) / Pixel_Height,
+		"Diff_Z_Pix": (Z_Ch2 - Z_Ch1) / Pixel_Depth,
+		"Distance_Lateral": Distance_Lateral,
+		"Distance_Axial": Distance_Axial,
+		"Distance_3D": Distance_3D,
+		"X_Proj": X_Proj,
+		"Y_Proj": Y_Proj,
+		"Z_Proj": Z_Proj,
+		"Diff_X_Ref": X_Proj - X_Ch1,
+		"Diff_Y_Ref": Y_Proj - Y_Ch1,
+		"Diff_Z_Ref": Z_Proj - Z_Ch1,
+		"Semi_Minor_Axis": Semi_Minor_Axis,
+		"Semi_Major_Axis": Semi_Major_Axis,
+		"Distance_Lateral_Ref": Distance_Lateral_Ref,
+		"Distance_Axial_Ref": Distance_Axial_Ref,
+		"Distance_3D_Ref": Distance_3D_Ref,
+		"Colocalization_Ratio": Colocalization_Ratio,
+		}
+
+# Return the metrics of the pair (Ch2, Ch1) from the metrics of the pair (Ch1, Ch2)
+# The ellipse is centered on the Spot and symmetric so the projection of the reversed vector is the reversed projection
+def Mirror_Pair_Metrics(Metrics, Position_Ch2):
+	Mirrored_Metrics = dict(Metrics)
+	# Shifts and the Axial Distances are oriented. The other distances and the Colocalization Ratio are shared
+	for Key in ["Diff_X", "Diff_Y", "Diff_Z", "Diff_X_Pix", "Diff_Y_Pix", "Diff_Z_Pix", "Distance_Axial", "Diff_X_Ref", "Diff_Y_Ref", "Diff_Z_Ref", "Distance_Axial_Ref"]:
+		Mirrored_Metrics[Key] = -Metrics[Key]
+	for Axis, Position in zip(["X", "Y", "Z"], Position_Ch2):
+		Mirrored_Metrics[Axis + "_Proj"] = Position + Mirrored_Metrics["Diff_{}_Ref".format(Axis)]
+	return Mirrored_Metrics
+
+# Return the metrics of the pair (Ch1, Ch1). The spots are colocalized
+def Get_Same_Channel_Pair_Metrics(Position_Ch1, Optics_Ch1):
+	Metrics = {}
+	for Key in ["Diff_X", "Diff_Y", "Diff_Z", "Diff_X_Pix", "Diff_Y_Pix", "Diff_Z_Pix", "Distance_Lateral", "Distance_Axial", "Distance_3D",
+		"Diff_X_Ref", "Diff_Y_Ref", "Diff_Z_Ref", "Distance_Lateral_Ref", "Distance_Axial_Ref", "Distance_3D_Ref", "Colocalization_Ratio"]:
+		Metrics[Key] = 0.0
+	Metrics["X_Proj"], Metrics["Y_Proj"], Metrics["Z_Proj"] = Position_Ch1
+	Metrics["Semi_Minor_Axis"] = Optics_Ch1["Resolution_Lateral_Practical"] / 2
+	Metrics["Semi_Major_Axis"] = Optics_Ch1["Resolution_Axial_Practical"] / 2
+	return Metrics
+
+# Processed Data of an image. Values shared by all pairs of Channels are stored once in Data_Processed_File["Constants"]
+# Per pair values are stored raw in typed arrays ("s" for strings stored in a list) and formatted when writing the rows
+Data_Processed_File_Constant_Keys = [
+	"Filename",
+	"Objective_Mag", "Objective_NA", "Objective_Immersion", "Refractive_Index",
+	"Detection_Method", "Spot_Diameter", "Threshold_Value", "Subpixel_Localization", "Median_Filtering",
+	"Batch_Mode", "Save_Individual_Files", "Prolix_Mode",
+	"Width_Pix", "Height_Pix", "Bit_Depth",	"Pixel_Width", "Pixel_Height", "Pixel_Depth",
+	"Space_Unit", "Space_Unit_Std", "Time_Unit", "Calibration_Status",
+	]
+Data_Processed_File_Pair_Columns = [ # Key, Array Typecode, Format
+	("Channel_Ch1", "l", None), ("Channel_Name_Ch1", "s", None), ("EMWavelength_Ch1", "d", None),
+	("Nb_Detected_Spots_Ch1", "l", None), ("Spot_ID_Ch1", "l", None), ("Spot_Quality_Ch1", "d", None),
+	("Pos_X_Ch1", "d", "%.3f"), ("Pos_Y_Ch1", "d", "%.3f"), ("Pos_Z_Ch1", "d", "%.3f"), ("Pos_T_Ch1", "d", "%.3f"),
+	("Frame_Ch1", "l", None), ("Radius_Ch1", "d", None), ("Visibility_Ch1", "b", None),
+	("Channel_Ch2", "l", None), ("Channel_Name_Ch2", "s", None), ("EMWavelength_Ch2", "d", None),
+	("Nb_Detected_Spots_Ch2", "l", None), ("Spot_ID_Ch2", "l", None), ("Spot_Quality_Ch2", "d", None),
+	("Pos_X_Ch2", "d", "%.3f"), ("Pos_Y_Ch2", "d", "%.3f"), ("Pos_Z_Ch2", "d", "%.3f"), ("Pos_T_Ch2", "d", "%.3f"),
+	("Frame_Ch2", "l", None), ("Radius_Ch2", "d", None), ("Visibility_Ch2", "b", None),
+	("Channel_Pair", "s", None),
+	("Diff_X", "d", "%.3f"), ("Diff_Y", "d", "%.3f"), ("Diff_Z", "d", "%.3f"),
+	("Diff_X_Pix", "d", "%.1f"), ("Diff_Y_Pix", "d", "%.1f"), ("Diff_Z_Pix", "d", "%.1f"),
+	("Distance_Lateral", "d", "%.3f"), ("Distance_Axial", "d", "%.3f"), ("Distance_3D", "d", "%.3f"),
+	("Conversion_Factor", "d", None), ("EMWavelength_Unit_Ch1", "d", None), ("EMWavelength_Unit_Ch2", "d", None),
+	("Nyquist_Pixel_Size_Lateral_Ch1", "d", "%.3f"), ("Nyquist_Pixel_Size_Axial_Ch1", "d", "%.3f"), ("Nyquist_Ratio_Lateral_Ch1", "d", "%.1f"), ("Nyquist_Ratio_Axial_Ch1", "d", "%.1f"),
+	("Nyquist_Pixel_Size_Lateral_Ch2", "d", "%.3f"), ("Nyquist_Pixel_Size_Axial_Ch2", "d", "%.3f"), ("Nyquist_Ratio_Lateral_Ch2", "d", "%.1f"), ("Nyquist_Ratio_Axial_Ch2", "d", "%.1f"),
+	("Resolution_Lateral_Theoretical_Ch1", "d", "%.3f"), ("Resolution_Axial_Theoretical_Ch1", "d", "%.3f"), ("Resolution_Lateral_Practical_Ch1", "d", "%.3f"), ("Resolution_Axial_Practical_Ch1", "d", "%.3f"),
+	("Resolution_Lateral_Theoretical_Ch2", "d", "%.3f"), ("Resolution_Axial_Theoretical_Ch2", "d", "%.3f"), ("Resolution_Lateral_Practical_Ch2", "d", "%.3f"), ("Resolution_Axial_Practical_Ch2", "d", "%.3f"),
+	("FWHM_X_Ch1", "d", "%.3f"), ("FWHM_Y_Ch1", "d", "%.3f"), ("FWHM_Lateral_Ch1", "d", "%.3f"), ("FWHM_Axial_Ch1", "d", "%.3f"),
+	("FWHM_X_Ch2", "d", "%.3f"), ("FWHM_Y_Ch2", "d", "%.3f"), ("FWHM_Lateral_Ch2", "d", "%.3f"), ("FWHM_Axial_Ch2", "d", "%.3f"),
+	("X_Proj", "d", "%.3f"), ("Y_Proj", "d", "%.3f"), ("Z_Proj", "d", "%.3f"),
+	("Diff_X_Ref", "d", "%.3f"), ("Diff_Y_Ref", "d", "%.3f"), ("Diff_Z_Ref", "d", "%.3f"),
+	("Semi_Minor_Axis", "d", "%.3f"), ("Semi_Major_Axis", "d", "%.3f"),
+	("Distance_Lateral_Ref", "d", "%.3f"), ("Distance_Axial_Ref", "d", "%.3f"), ("Distance_3D_Ref", "d", "%.3f"),
+	("Colocalization_Ratio", "d", "%.1f"),
+	]
+Data_Processed_File_Ordered_Keys = Data_Processed_File_Constant_Keys + [Key for Key, Typecode, Format in Data_Processed_File_Pair_Columns]
+
+# Return an empty Data_Processed_File a dictionnary with the Constants and one typed array per pair value
+def Create_Data_Processed_File(Constants):
+	Data_Processed_File = {"Constants": Constants}
+	for Key, Typecode, Format in Data_Processed_File_Pair_Columns:
+		if Typecode == "s":
+			Data_Processed_File[Key] = []
 		else:
-			Step = Step * 1.5 # Increase Step
-			t += Step # Move forward if Ellipse_Ratio < 1
-	return None
+			Data_Processed_File[Key] = array(Typecode)
+	return Data_Processed_File
+
+def Get_Nb_Pairs(Data_Processed_File):
+	return len(Data_Processed_File["Channel_Ch1"])
+
+# Return the rows of a Data_Processed_File one at a time. Rows are only built when they are written
+def Data_Processed_File_Rows(Data_Processed_File):
+	Constants = Data_Processed_File["Constants"]
+	Constant_Values = [Constants[Key] for Key in Data_Processed_File_Constant_Keys] if Constants else []
+	for i in range(Get_Nb_Pairs(Data_Processed_File)):
+		Row = list(Constant_Values)
+		for Key, Typecode, Format in Data_Processed_File_Pair_Columns:
+			Value = Data_Processed_File[Key][i]
+			if Typecode == "b":
+				Value = bool(Value)
+			elif Typecode == "d" and Value != Value: # NaN values are left empty
+				Value = ""
+			elif Format is not None:
+				Value = float(Format % Value)
+			Row.append(Value)
+		yield Row
+
 def Channel_Alignment_Data_Processing(imp, Data_File): # Compute the Channel alignment for all pair of channels
-	# Return Data_File_Processed a list
+	# Return Data_Processed_File a dictionnary of Constants and typed arrays
 	Image_Info = Get_Image_Info(imp)
 	Image_Name = imp.getTitle()
 	Prolix_Message("Computing Ch Alignemnt Metrics for {}".format(Image_Name))
 	Nb_Channels = imp.getNChannels()
-	# Collect Microscope Settings
-	Settings_Stored = Read_Preferences(Settings_Template)
-	Data_Processed_File = {
-			"Filename": [],
-			"Objective_Mag": [], "Objective_NA": [], "Objective_Immersion": [], "Refractive_Index": [],
-			"Detection_Method": [], "Spot_Diameter": [], "Threshold_Value": [], "Subpixel_Localization": [], "Median_Filtering": [],
-			"Batch_Mode": [], "Save_Individual_Files": [], "Prolix_Mode": [],
-			"Width_Pix": [], "Height_Pix": [], "Bit_Depth": [],	"Pixel_Width": [], "Pixel_Height": [], "Pixel_Depth": [],
-			"Space_Unit": [], "Space_Unit_Std": [], "Time_Unit": [], "Calibration_Status": [],
-			"Channel_Ch1": [], "Channel_Name_Ch1": [], "EMWavelength_Ch1": [],
-			"Nb_Detected_Spots_Ch1": [], "Spot_ID_Ch1": [], "Spot_Quality_Ch1": [],
-			"Pos_X_Ch1": [], "Pos_Y_Ch1": [], "Pos_Z_Ch1": [], "Pos_T_Ch1": [],
-			"Frame_Ch1": [], "Radius_Ch1": [], "Visibility_Ch1": [],
-			"Channel_Ch2": [], "Channel_Name_Ch2": [], "EMWavelength_Ch2": [],
-			"Nb_Detected_Spots_Ch2": [], "Spot_ID_Ch2": [], "Spot_Quality_Ch2": [],
-			"Pos_X_Ch2": [], "Pos_Y_Ch2": [], "Pos_Z_Ch2": [], "Pos_T_Ch2": [],
-			"Frame_Ch2": [], "Radius_Ch2": [], "Visibility_Ch2": [],
-			"Channel_Pair": [],
-			"Diff_X": [], "Diff_Y": [], "Diff_Z": [],
-			"Diff_X_Pix": [], "Diff_Y_Pix": [], "Diff_Z_Pix": [],
-			"Distance_Lateral": [],	"Distance_Axial": [], "Distance_3D": [],
-			"Conversion_Factor": [], "EMWavelength_Unit_Ch1": [], "EMWavelength_Unit_Ch2": [],
-			"Nyquist_Pixel_Size_Lateral_Ch1": [], "Nyquist_Pixel_Size_Axial_Ch1": [], "Nyquist_Ratio_Lateral_Ch1": [], "Nyquist_Ratio_Axial_Ch1": [],
-			"Nyquist_Pixel_Size_Lateral_Ch2": [], "Nyquist_Pixel_Size_Axial_Ch2": [], "Nyquist_Ratio_Lateral_Ch2": [], "Nyquist_Ratio_Axial_Ch2": [],
-			"Resolution_Lateral_Theoretical_Ch1": [], "Resolution_Axial_Theoretical_Ch1": [], "Resolution_Lateral_Practical_Ch1": [], "Resolution_Axial_Practical_Ch1": [],
-			"Resolution_Lateral_Theoretical_Ch2": [], "Resolution_Axial_Theoretical_Ch2": [], "Resolution_Lateral_Practical_Ch2": [], "Resolution_Axial_Practical_Ch2": [],
-			"X_Proj": [], "Y_Proj": [], "Z_Proj": [],
-			"Diff_X_Ref": [], "Diff_Y_Ref": [], "Diff_Z_Ref": [],
-			"Semi_Minor_Axis": [], "Semi_Major_Axis": [],
-			"Distance_Lateral_Ref": [], "Distance_Axial_Ref": [], "Distance_3D_Ref": [],
-			"Colocalization_Ratio": [],
+	# Index the Data per Channel. Only Channels with exactly one spot are used
+	Data_Ch_Index = {}
+	for Data_Ch in Data_File:
+		if Data_Ch is not None and Get_Nb_Spots(Data_Ch) == 1:
+			Data_Ch_Index[int(Data_Ch["Constants"]["Channel_Nb"])] = Data_Ch
+	# Compute the Channel optics once per Channel and not for every pair of Channels
+	Channel_Optics = {}
+	for Channel, Data_Ch in Data_Ch_Index.items():
+		Channel_Optics[Channel] = Get_Channel_Optics(
+			float(Data_Ch["Constants"]["Channel_Wavelength_EM"]),
+			float(Data_Ch["Constants"]["Objective_NA"]),
+			float(Data_Ch["Constants"]["Refractive_Index"]),
+			float(Data_Ch["Constants"]["Pixel_Width"]),
+			float(Data_Ch["Constants"]["Pixel_Height"]),
+			float(Data_Ch["Constants"]["Pixel_Depth"]),
+			str(Data_Ch["Constants"]["Space_Unit_Std"])
+			)
+	# Get the image parameters once since they are the same for all Channels
+	Data_Processed_File_Constants = {}
+	if Data_Ch_Index:
+		Constants = Data_Ch_Index[min(Data_Ch_Index)]["Constants"]
+		Data_Processed_File_Constants = {
+			"Filename": str(Constants["Filename"]),
+			"Objective_Mag": str(Constants["Objective_Mag"]),
+			"Objective_NA": float(Constants["Objective_NA"]),
+			"Objective_Immersion": str(Constants["Objective_Immersion"]),
+			"Refractive_Index": float(Constants["Refractive_Index"]),
+			"Detection_Method": str(Constants["Detection_Method"]),
+			"Spot_Diameter": float(Constants["Spot_Diameter"]),
+			"Threshold_Value": float(Constants["Threshold_Value"]),
+			"Subpixel_Localization": bool(Constants["Subpixel_Localization"]),
+			"Median_Filtering": bool(Constants["Median_Filtering"]),
+			"Batch_Mode": bool(Constants["Batch_Mode"]),
+			"Save_Individual_Files": bool(Constants["Save_Individual_Files"]),
+			"Prolix_Mode": bool(Constants["Prolix_Mode"]),
+			"Width_Pix": int(Constants["Width_Pix"]),
+			"Height_Pix": int(Constants["Height_Pix"]),
+			"Bit_Depth": int(Constants["Bit_Depth"]),
+			"Pixel_Width": float(Constants["Pixel_Width"]),
+			"Pixel_Height": float(Constants["Pixel_Height"]),
+			"Pixel_Depth": float(Constants["Pixel_Depth"]),
+			"Space_Unit": str(Constants["Space_Unit"]),
+			"Space_Unit_Std": str(Constants["Space_Unit_Std"]),
+			"Time_Unit": str(Constants["Time_Unit"]),
+			"Calibration_Status": bool(Constants["Calibration_Status"]),
 			}
-	# Loop through all pair of Channels for calculating Ch Shifts
+	Data_Processed_File = Create_Data_Processed_File(Data_Processed_File_Constants)
+	# The metrics are computed once per pair of Channels (Ch1 < Ch2)
+	# The mirrored pair (Ch2, Ch1) and the same Channel pair (Ch1, Ch1) are derived from them
+	Pixel_Sizes = [Data_Processed_File_Constants.get(Key) for Key in ["Pixel_Width", "Pixel_Height", "Pixel_Depth"]]
+	Pair_Metrics = {}
+	Channels = sorted(Data_Ch_Index)
+	for i, Ch1 in enumerate(Channels):
+		Position_Ch1 = Get_Spot_Position(Data_Ch_Index[Ch1])
+		Pair_Metrics[(Ch1, Ch1)] = Get_Same_Channel_Pair_Metrics(Position_Ch1, Channel_Optics[Ch1])
+		for Ch2 in Channels[i + 1:]:
+			Position_Ch2 = Get_Spot_Position(Data_Ch_Index[Ch2])
+			Pair_Metrics[(Ch1, Ch2)] = Get_Pair_Metrics(Position_Ch1, Position_Ch2, Channel_Optics[Ch1], Channel_Optics[Ch2], Pixel_Sizes)
+			Pair_Metrics[(Ch2, Ch1)] = Mirror_Pair_Metrics(Pair_Metrics[(Ch1, Ch2)], Position_Ch2)
+	# Loop through all pair of Channels for storing Ch Shifts
 	for Ch1 in range(1, Nb_Channels+1):
 		for Ch2 in range(1, Nb_Channels+1):
-			Data_Ch1 = next((Data_Ch for Data_Ch in Data_File if Data_Ch["Channel_Nb"] == [Ch1]), None)
-			Data_Ch2 = next((Data_Ch for Data_Ch in Data_File if Data_Ch["Channel_Nb"] == [Ch2]), None)
-			if Data_Ch1 is not None and Data_Ch2 is not None and len(Data_Ch1["Channel_Nb"]) == 1 and len(Data_Ch2["Channel_Nb"]) == 1:
-				# Get All parameters from Ch1 since they are the same than Channel 2
-				Filename = str(Data_Ch1["Filename"][0])
-				Objective_Mag = str(Data_Ch1["Objective_Mag"][0])
-				Objective_NA = float(Data_Ch1["Objective_NA"][0])
-				Objective_Immersion = str(Data_Ch1["Objective_Immersion"][0])
-				Refractive_Index = float(Data_Ch1["Refractive_Index"][0])
-				Detection_Method = str(Data_Ch1["Detection_Method"][0])
-				Spot_Diameter = float(Data_Ch1["Spot_Diameter"][0])
-				Threshold_Value = float(Data_Ch1["Threshold_Value"][0])
-				Subpixel_Localization = bool(Data_Ch1["Subpixel_Localization"][0])
-				Median_Filtering = bool(Data_Ch1["Median_Filtering"][0])
-				Batch_Mode = bool(Data_Ch1["Batch_Mode"][0])
-				Save_Individual_Files = bool(Data_Ch1["Save_Individual_Files"][0])
-				Prolix_Mode = bool(Data_Ch1["Prolix_Mode"][0])
-				Width_Pix = int(Data_Ch1["Width_Pix"][0])
-				Height_Pix = int(Data_Ch1["Height_Pix"][0])
-				Bit_Depth = int(Data_Ch1["Bit_Depth"][0])
-				Pixel_Width = float(Data_Ch1["Pixel_Width"][0])
-				Pixel_Height = float(Data_Ch1["Pixel_Height"][0])
-				Pixel_Depth = float(Data_Ch1["Pixel_Depth"][0])
-				Space_Unit = str(Data_Ch1["Space_Unit"][0])
-				Space_Unit_Std = str(Data_Ch1["Space_Unit_Std"][0])
-				Time_Unit = str(Data_Ch1["Time_Unit"][0])
-				Calibration_Status = bool(Data_Ch1["Calibration_Status"][0])
-				# Get Channel Specific values
-				Channel_Ch1 = int(Data_Ch1["Channel_Nb"][0])
-				Channel_Name_Ch1 = str(Data_Ch1["Channel_Name"][0])
-				EMWavelength_Ch1 = float(Data_Ch1["Channel_Wavelength_EM"][0])
-				Nb_Detected_Spots_Ch1 = int(Data_Ch1["Nb_Detected_Spots"][0])
-				Spot_ID_Ch1 = int(Data_Ch1["Spot_ID"][0])
-				Spot_Quality_Ch1 = float(Data_Ch1["Spot_Quality"][0])
-				X_Ch1 = float(Data_Ch1["Spot_Pos_X"][0])
-				Y_Ch1 = float(Data_Ch1["Spot_Pos_Y"][0])
-				Z_Ch1 = float(Data_Ch1["Spot_Pos_Z"][0])
-				T_Ch1 = float(Data_Ch1["Spot_Pos_T"][0])
-				Frame_Ch1 = int(Data_Ch1["Spot_Frame"][0])
-				Radius_Ch1 = float(Data_Ch1["Spot_Radius"][0])
-				Visibility_Ch1 = bool(Data_Ch1["Spot_Visibility"][0])
-				Channel_Ch2 = int(Data_Ch2["Channel_Nb"][0])
-				Channel_Name_Ch2 = str(Data_Ch2["Channel_Name"][0])
-				EMWavelength_Ch2 = float(Data_Ch2["Channel_Wavelength_EM"][0])
-				Nb_Detected_Spots_Ch2 = int(Data_Ch2["Nb_Detected_Spots"][0])
-				Spot_ID_Ch2 = int(Data_Ch2["Spot_ID"][0])
-				Spot_Quality_Ch2 = float(Data_Ch2["Spot_Quality"][0])
-				X_Ch2 = float(Data_Ch2["Spot_Pos_X"][0])
-				Y_Ch2 = float(Data_Ch2["Spot_Pos_Y"][0])
-				Z_Ch2 = float(Data_Ch2["Spot_Pos_Z"][0])
-				T_Ch2 = float(Data_Ch2["Spot_Pos_T"][0])
-				Frame_Ch2 = int(Data_Ch2["Spot_Frame"][0])
-				Radius_Ch2 = float(Data_Ch2["Spot_Radius"][0])
-				Visibility_Ch2 = bool(Data_Ch2["Spot_Visibility"][0])
-				Channel_Pair = "{} x {}".format(Channel_Name_Ch1, Channel_Name_Ch2)
-				# Compute differences
-				Diff_X = float(X_Ch2 - X_Ch1)
-				Diff_Y = float(Y_Ch2 - Y_Ch1)
-				Diff_Z = float(Z_Ch2 - Z_Ch1)
-				Diff_X_Pix = float(Diff_X / Pixel_Width)
-				Diff_Y_Pix = float(Diff_Y / Pixel_Height)
-				Diff_Z_Pix = float(Diff_Z / Pixel_Depth)
-				# Compute distances
-				Distance_Lateral, Distance_Axial, Distance_3D = Euclidean_Distance(X_Ch1, Y_Ch1, Z_Ch1, X_Ch2, Y_Ch2, Z_Ch2)
-				Conversion_Factors = { # Space Unit Std: Conversion factors
-				"{}m".format(Unicode_Micron_Symbol): 1000,	# 1 nm = 0.001 m
-				"nm": 1,		# 1 nm = 1 nm
-				"mm": 1000000,	 # 1 nm = 0.000001 mm
-				"cm": 10000000,	 # 1 nm = 0.0000001 cm
-				"m": 1000000000,	 # 1 nm = 0.0000000001 m
-				"in": 2540000, # 1 nm = 0.0000000393701 in (approx.)
-				"pixels": 1,	# Assuming pixels is the default unit and conversion factor for pixels is 1 (since no physical measurement)
-				}
-				Conversion_Factor = float(Conversion_Factors[Space_Unit_Std])
-				EMWavelength_Unit_Ch1 = EMWavelength_Ch1 / Conversion_Factor
-				EMWavelength_Unit_Ch2 = EMWavelength_Ch2 / Conversion_Factor
-				Nyquist_Pixel_Size_Lateral_Ch1, Nyquist_Pixel_Size_Axial_Ch1, Nyquist_Ratio_Lateral_Ch1, Nyquist_Ratio_Axial_Ch1 = Nyquist_Calculator(EMWavelength_Unit_Ch1, Objective_NA, Refractive_Index, Pixel_Width, Pixel_Height, Pixel_Depth)
-				Nyquist_Pixel_Size_Lateral_Ch2, Nyquist_Pixel_Size_Axial_Ch2, Nyquist_Ratio_Lateral_Ch2, Nyquist_Ratio_Axial_Ch2 = Nyquist_Calculator(EMWavelength_Unit_Ch2, Objective_NA, Refractive_Index, Pixel_Width, Pixel_Height, Pixel_Depth)
-				Resolution_Lateral_Theoretical_Ch1, Resolution_Axial_Theoretical_Ch1, Resolution_Lateral_Practical_Ch1, Resolution_Axial_Practical_Ch1 = Resolution_Calculator(EMWavelength_Unit_Ch1, Objective_NA, Refractive_Index, Nyquist_Ratio_Lateral_Ch1, Nyquist_Ratio_Axial_Ch1)
-				Resolution_Lateral_Theoretical_Ch2, Resolution_Axial_Theoretical_Ch2, Resolution_Lateral_Practical_Ch2, Resolution_Axial_Practical_Ch2 = Resolution_Calculator(EMWavelength_Unit_Ch2, Objective_NA, Refractive_Index, Nyquist_Ratio_Lateral_Ch2, Nyquist_Ratio_Axial_Ch2)
-				# Resolution is in nm must convert it to match the distance values
-				Semi_Minor_Axis = (max(Resolution_Lateral_Practical_Ch1, Resolution_Lateral_Practical_Ch2))/2 # Using the largest number to calculate the Ratios
-				Semi_Major_Axis = (max(Resolution_Axial_Practical_Ch1, Resolution_Axial_Practical_Ch2))/2 # Using the largest number to calculate the Ratios
-				# If spots are not already colocalized project the Spot1->Spot2 vector to the Ellipse
-				if X_Ch1 != X_Ch2 and Y_Ch1 != Y_Ch2 and Z_Ch1 != Z_Ch2:
-					X_Proj, Y_Proj, Z_Proj = Project_on_Ellipse(X_Ch1, Y_Ch1, Z_Ch1, X_Ch2, Y_Ch2, Z_Ch2, Semi_Minor_Axis, Semi_Major_Axis, Max_Iterations = 1000, Initial_Step = 10, Tolerance = 1e-12)
-				else:
-					X_Proj = X_Ch1
-					Y_Proj = Y_Ch1
-					Z_Proj = Z_Ch1
-				Diff_X_Ref = X_Proj - X_Ch1
-				Diff_Y_Ref = Y_Proj - Y_Ch1
-				Diff_Z_Ref = Z_Proj - Z_Ch1
-				Distance_Lateral_Ref, Distance_Axial_Ref, Distance_3D_Ref = Euclidean_Distance(X_Ch1, Y_Ch1, Z_Ch1, X_Proj, Y_Proj, Z_Proj)
-				if Distance_3D_Ref == 0:
-					Colocalization_Ratio = 0
-				else:
-					Colocalization_Ratio = Distance_3D / Distance_3D_Ref
-				Data_Processed_File["Filename"].append(Filename)
-				Data_Processed_File["Objective_Mag"].append(Objective_Mag)
-				Data_Processed_File["Objective_NA"].append(Objective_NA)
-				Data_Processed_File["Objective_Immersion"].append(Objective_Immersion)
-				Data_Processed_File["Refractive_Index"].append(Refractive_Index)
-				Data_Processed_File["Detection_Method"].append(Detection_Method)
-				Data_Processed_File["Spot_Diameter"].append(Spot_Diameter)
-				Data_Processed_File["Threshold_Value"].append(Threshold_Value)
-				Data_Processed_File["Subpixel_Localization"].append(Subpixel_Localization)
-				Data_Processed_File["Median_Filtering"].append(Median_Filtering)
-				Data_Processed_File["Batch_Mode"].append(Batch_Mode)
-				Data_Processed_File["Save_Individual_Files"].append(Save_Individual_Files)
-				Data_Processed_File["Prolix_Mode"].append(Prolix_Mode)
-				Data_Processed_File["Width_Pix"].append(Width_Pix)
-				Data_Processed_File["Height_Pix"].append(Height_Pix)
-				Data_Processed_File["Bit_Depth"].append(Bit_Depth)
-				Data_Processed_File["Pixel_Width"].append(Pixel_Width)
-				Data_Processed_File["Pixel_Height"].append(Pixel_Height)
-				Data_Processed_File["Pixel_Depth"].append(Pixel_Depth)
-				Data_Processed_File["Space_Unit"].append(Space_Unit)
-				Data_Processed_File["Space_Unit_Std"].append(Space_Unit_Std)
-				Data_Processed_File["Time_Unit"].append(Time_Unit)
-				Data_Processed_File["Calibration_Status"].append(Calibration_Status)
-				Data_Processed_File["Channel_Ch1"].append(Channel_Ch1)
-				Data_Processed_File["Channel_Name_Ch1"].append(Channel_Name_Ch1)
-				Data_Processed_File["EMWavelength_Ch1"].append(EMWavelength_Ch1)
-				Data_Processed_File["Nb_Detected_Spots_Ch1"].append(Nb_Detected_Spots_Ch1)
-				Data_Processed_File["Spot_ID_Ch1"].append(Spot_ID_Ch1)
-				Data_Processed_File["Spot_Quality_Ch1"].append(Spot_Quality_Ch1)
-				Data_Processed_File["Pos_X_Ch1"].append(float("%.3f" % X_Ch1))
-				Data_Processed_File["Pos_Y_Ch1"].append(float("%.3f" % Y_Ch1))
-				Data_Processed_File["Pos_Z_Ch1"].append(float("%.3f" % Z_Ch1))
-				Data_Processed_File["Pos_T_Ch1"].append(float("%.3f" % T_Ch1))
-				Data_Processed_File["Frame_Ch1"].append(Frame_Ch1)
-				Data_Processed_File["Radius_Ch1"].append(Radius_Ch1)
-				Data_Processed_File["Visibility_Ch1"].append(Visibility_Ch1)
-				Data_Processed_File["Channel_Ch2"].append(Channel_Ch2)
-				Data_Processed_File["Channel_Name_Ch2"].append(Channel_Name_Ch2)
-				Data_Processed_File["EMWavelength_Ch2"].append(EMWavelength_Ch2)
-				Data_Processed_File["Nb_Detected_Spots_Ch2"].append(Nb_Detected_Spots_Ch2)
-				Data_Processed_File["Spot_ID_Ch2"].append(Spot_ID_Ch2)
-				Data_Processed_File["Spot_Quality_Ch2"].append(Spot_Quality_Ch2)
-				Data_Processed_File["Pos_X_Ch2"].append(float("%.3f" % X_Ch2))
-				Data_Processed_File["Pos_Y_Ch2"].append(float("%.3f" % Y_Ch2))
-				Data_Processed_File["Pos_Z_Ch2"].append(float("%.3f" % Z_Ch2))
-				Data_Processed_File["Pos_T_Ch2"].append(float("%.3f" % T_Ch2))
-				Data_Processed_File["Frame_Ch2"].append(Frame_Ch2)
-				Data_Processed_File["Radius_Ch2"].append(Radius_Ch2)
-				Data_Processed_File["Visibility_Ch2"].append(Visibility_Ch2)
-				Data_Processed_File["Channel_Pair"].append(Channel_Pair)
-				Data_Processed_File["Diff_X"].append(float("%.3f" % Diff_X))
-				Data_Processed_File["Diff_Y"].append(float("%.3f" % Diff_Y))
-				Data_Processed_File["Diff_Z"].append(float("%.3f" % Diff_Z))
-				Data_Processed_File["Diff_X_Pix"].append(float("%.1f" % Diff_X_Pix))
-				Data_Processed_File["Diff_Y_Pix"].append(float("%.1f" % Diff_Y_Pix))
-				Data_Processed_File["Diff_Z_Pix"].append(float("%.1f" % Diff_Z_Pix))
-				Data_Processed_File["Distance_Lateral"].append(float("%.3f" % Distance_Lateral))
-				Data_Processed_File["Distance_Axial"].append(float("%.3f" % Distance_Axial))
-				Data_Processed_File["Distance_3D"].append(float("%.3f" % Distance_3D))
-				Data_Processed_File["Conversion_Factor"].append(Conversion_Factor)
-				Data_Processed_File["EMWavelength_Unit_Ch1"].append(EMWavelength_Unit_Ch1)
-				Data_Processed_File["EMWavelength_Unit_Ch2"].append(EMWavelength_Unit_Ch2)
-				Data_Processed_File["Nyquist_Pixel_Size_Lateral_Ch1"].append(float("%.3f" % Nyquist_Pixel_Size_Lateral_Ch1))
-				Data_Processed_File["Nyquist_Pixel_Size_Axial_Ch1"].append(float("%.3f" % Nyquist_Pixel_Size_Axial_Ch1))
-				Data_Processed_File["Nyquist_Ratio_Lateral_Ch1"].append(float("%.1f" % Nyquist_Ratio_Lateral_Ch1))
-				Data_Processed_File["Nyquist_Ratio_Axial_Ch1"].append(float("%.1f" % Nyquist_Ratio_Axial_Ch1))
-				Data_Processed_File["Nyquist_Pixel_Size_Lateral_Ch2"].append(float("%.3f" % Nyquist_Pixel_Size_Lateral_Ch2))
-				Data_Processed_File["Nyquist_Pixel_Size_Axial_Ch2"].append(float("%.3f" % Nyquist_Pixel_Size_Axial_Ch2))
-				Data_Processed_File["Nyquist_Ratio_Lateral_Ch2"].append(float("%.1f" % Nyquist_Ratio_Lateral_Ch2))
-				Data_Processed_File["Nyquist_Ratio_Axial_Ch2"].append(float("%.1f" % Nyquist_Ratio_Axial_Ch2))
-				Data_Processed_File["Resolution_Lateral_Theoretical_Ch1"].append(float("%.3f" % Resolution_Lateral_Theoretical_Ch1))
-				Data_Processed_File["Resolution_Axial_Theoretical_Ch1"].append(float("%.3f" % Resolution_Axial_Theoretical_Ch1))
-				Data_Processed_File["Resolution_Lateral_Practical_Ch1"].append(float("%.3f" % Resolution_Lateral_Practical_Ch1))
-				Data_Processed_File["Resolution_Axial_Practical_Ch1"].append(float("%.3f" % Resolution_Axial_Practical_Ch1))
-				Data_Processed_File["Resolution_Lateral_Theoretical_Ch2"].append(float("%.3f" % Resolution_Lateral_Theoretical_Ch2))
-				Data_Processed_File["Resolution_Axial_Theoretical_Ch2"].append(float("%.3f" % Resolution_Axial_Theoretical_Ch2))
-				Data_Processed_File["Resolution_Lateral_Practical_Ch2"].append(float("%.3f" % Resolution_Lateral_Practical_Ch2))
-				Data_Processed_File["Resolution_Axial_Practical_Ch2"].append(float("%.3f" % Resolution_Axial_Practical_Ch2))
-				Data_Processed_File["X_Proj"].append(float("%.3f" % X_Proj))
-				Data_Processed_File["Y_Proj"].append(float("%.3f" % Y_Proj))
-				Data_Processed_File["Z_Proj"].append(float("%.3f" % Z_Proj))
-				Data_Processed_File["Diff_X_Ref"].append(float("%.3f" % Diff_X_Ref))
-				Data_Processed_File["Diff_Y_Ref"].append(float("%.3f" % Diff_Y_Ref))
-				Data_Processed_File["Diff_Z_Ref"].append(float("%.3f" % Diff_Z_Ref))
-				Data_Processed_File["Semi_Minor_Axis"].append(float("%.3f" % Semi_Minor_Axis))
-				Data_Processed_File["Semi_Major_Axis"].append(float("%.3f" % Semi_Major_Axis))
-				Data_Processed_File["Distance_Lateral_Ref"].append(float("%.3f" % Distance_Lateral_Ref))
-				Data_Processed_File["Distance_Axial_Ref"].append(float("%.3f" % Distance_Axial_Ref))
-				Data_Processed_File["Distance_3D_Ref"].append(float("%.3f" % Distance_3D_Ref))
-				Data_Processed_File["Colocalization_Ratio"].append(float("%.1f" % Colocalization_Ratio))
-		global Data_Processed_File_Ordered_Keys
-		global Data_Processed_File_Header
-		Data_Processed_File_Ordered_Keys = [
-			"Filename",
-			"Objective_Mag", "Objective_NA", "Objective_Immersion", "Refractive_Index",
-			"Detection_Method", "Spot_Diameter", "Threshold_Value", "Subpixel_Localization", "Median_Filtering",
-			"Batch_Mode", "Save_Individual_Files", "Prolix_Mode",
-			"Width_Pix", "Height_Pix", "Bit_Depth",	"Pixel_Width", "Pixel_Height", "Pixel_Depth",
-			"Space_Unit", "Space_Unit_Std", "Time_Unit", "Calibration_Status",
-			"Channel_Ch1", "Channel_Name_Ch1", "EMWavelength_Ch1",
-			"Nb_Detected_Spots_Ch1", "Spot_ID_Ch1", "Spot_Quality_Ch1",
-			"Pos_X_Ch1", "Pos_Y_Ch1", "Pos_Z_Ch1", "Pos_T_Ch1",
-			"Frame_Ch1", "Radius_Ch1", "Visibility_Ch1",
-			"Channel_Ch2", "Channel_Name_Ch2", "EMWavelength_Ch2",
-			"Nb_Detected_Spots_Ch2", "Spot_ID_Ch2", "Spot_Quality_Ch2",
-			"Pos_X_Ch2", "Pos_Y_Ch2", "Pos_Z_Ch2", "Pos_T_Ch2",
-			"Frame_Ch2", "Radius_Ch2", "Visibility_Ch2",
-			"Channel_Pair",
-			"Diff_X", "Diff_Y", "Diff_Z",
-			"Diff_X_Pix", "Diff_Y_Pix", "Diff_Z_Pix",
-			"Distance_Lateral",	"Distance_Axial", "Distance_3D",
-			"Conversion_Factor", "EMWavelength_Unit_Ch1", "EMWavelength_Unit_Ch2",
-			"Nyquist_Pixel_Size_Lateral_Ch1", "Nyquist_Pixel_Size_Axial_Ch1", "Nyquist_Ratio_Lateral_Ch1", "Nyquist_Ratio_Axial_Ch1",
-			"Nyquist_Pixel_Size_Lateral_Ch2", "Nyquist_Pixel_Size_Axial_Ch2", "Nyquist_Ratio_Lateral_Ch2", "Nyquist_Ratio_Axial_Ch2",
-			"Resolution_Lateral_Theoretical_Ch1", "Resolution_Axial_Theoretical_Ch1", "Resolution_Lateral_Practical_Ch1", "Resolution_Axial_Practical_Ch1",
-			"Resolution_Lateral_Theoretical_Ch2", "Resolution_Axial_Theoretical_Ch2", "Resolution_Lateral_Practical_Ch2", "Resolution_Axial_Practical_Ch2",
-			"X_Proj", "Y_Proj", "Z_Proj",
-			"Diff_X_Ref", "Diff_Y_Ref", "Diff_Z_Ref",
-			"Semi_Minor_Axis", "Semi_Major_Axis",
-			"Distance_Lateral_Ref", "Distance_Axial_Ref", "Distance_3D_Ref",
-			"Colocalization_Ratio",
-			]
-		Data_Processed_File_Header = [
-		"Filename",
-		"Objective Magnification", 		"Objective NA", "Objective Immersion Media", "Immersion Media Refractive Index",
-		"Detection Method", "Spot Diameter ({})".format(Space_Unit_Std), "Threshold Value", "Subpixel Localization", "Median Filtering",
-		"Batch Mode", "Save Individual Files", "Prolix Mode",
-		"Image Width (pixels)", "Image Height (pixels)", "Image Bit Depth", "Pixel Width ({}/px)".format(Space_Unit_Std), "Pixel Height ({}/px)".format(Space_Unit_Std), "Pixel Depth ({}/px)".format(Space_Unit_Std),
-		"Space Unit", "Space Unit Standard", " Time Unit", "Calibration Status",
-		"Channel 1", "Name Channel 1", "EM Wavelength Channel 1 (nm)",
-		"Nb Detected Spots Ch1", "Spot ID Ch1", "Spot Quality Ch1",
-		"X Ch1 ({})".format(Space_Unit_Std), "Y Ch1 ({})".format(Space_Unit_Std),"Z Ch1 ({})".format(Space_Unit_Std), "T Ch1 ({})".format(Time_Unit),
-		"Frame Ch1", "Radius Ch1 ({})".format(Space_Unit_Std), "Visibility Ch1",
-		"Channel 2", "Name Channel 2", "EM Wavelength Channel 2 (nm)",
-		"Nb Detected Spots Ch2", "Spot ID Ch2", "Spot Quality Ch2",
-		"X Ch2 ({})".format(Space_Unit_Std), "Y Ch2 ({})".format(Space_Unit_Std), "Z Ch2 ({})".format(Space_Unit_Std), "T Ch2 ({})".format(Time_Unit),
-		"Frame Ch2", "Radius Ch2", "Visibility Ch2",
-		"Channel Pair",
-		"X Shift ({})".format(Space_Unit_Std), "Y Shift ({})".format(Space_Unit_Std), "Z Shift ({})".format(Space_Unit_Std),
-		"X Shift (pixels)", "Y Shift (pixels)", "Z Shift (pixels)",
-		"Distance Lateral ({})".format(Space_Unit_Std), "Distance Axial ({})".format(Space_Unit_Std), "Distance 3D ({})".format(Space_Unit_Std),
-		"Conversion Factor", "EMWavelength Unit Ch1 ({})".format(Space_Unit_Std), "EMWavelength Unit Ch2 ({})".format(Space_Unit_Std),
-		"Nyquist Pixel Size Lateral Ch1 ({})".format(Space_Unit_Std), "Nyquist Pixel Size Axial Ch1 ({})".format(Space_Unit_Std), "Nyquist Ratio Lateral Ch1", "Nyquist Ratio Axial Ch1",
-		"Nyquist Pixel Size Lateral Ch2 ({})".format(Space_Unit_Std), "Nyquist Pixel Size Axial Ch2 ({})".format(Space_Unit_Std), "Nyquist Ratio Lateral Ch2", "Nyquist Ratio Axial Ch2",
-		"Resolution Lateral Theoretical Ch1 ({})".format(Space_Unit_Std), "Resolution Axial Theoretical Ch1 ({})".format(Space_Unit_Std), "Resolution Lateral Practical Ch1 ({})".format(Space_Unit_Std), "Resolution Axial Practical Ch1 ({})".format(Space_Unit_Std),
-		"Resolution Lateral Theoretical Ch2 ({})".format(Space_Unit_Std), "Resolution Axial Theoretical Ch2 ({})".format(Space_Unit_Std), "Resolution Lateral Practical Ch2 ({})".format(Space_Unit_Std), "Resolution Axial Practical Ch2 ({})".format(Space_Unit_Std),
-		"X Ref ({})".format(Space_Unit_Std), "Y Ref ({})".format(Space_Unit_Std), "Z Ref ({})".format(Space_Unit_Std),
-		"X Ref Shift ({})".format(Space_Unit_Std), "Y Ref Shift ({})".format(Space_Unit_Std), "Z Ref Shift ({})".format(Space_Unit_Std),
-		"Semi Minor Axis ({})".format(Space_Unit_Std), "Semi Major Axis ({})".format(Space_Unit_Std),
-		"Distance Lateral Ref ({})".format(Space_Unit_Std), "Distance Axial Ref ({})".format(Space_Unit_Std), "Distance 3D Ref ({})".format(Space_Unit_Std),
-		"Colocalization Ratio",
-		]
-		Settings_Stored = Read_Preferences(Settings_Template)
+			if (Ch1, Ch2) in Pair_Metrics:
+				Data_Ch1 = Data_Ch_Index[Ch1]
+				Data_Ch2 = Data_Ch_Index[Ch2]
+				Optics_Ch1 = Channel_Optics[Ch1]
+				Optics_Ch2 = Channel_Optics[Ch2]
+				Pair = dict(Pair_Metrics[(Ch1, Ch2)])
+				Pair.update({
+					"Channel_Ch1": Ch1,
+					"Channel_Name_Ch1": str(Data_Ch1["Constants"]["Channel_Name"]),
+					"EMWavelength_Ch1": float(Data_Ch1["Constants"]["Channel_Wavelength_EM"]),
+					"Nb_Detected_Spots_Ch1": int(Data_Ch1["Constants"]["Nb_Detected_Spots"]),
+					"Spot_ID_Ch1": Data_Ch1["Spot_ID"][0],
+					"Spot_Quality_Ch1": Data_Ch1["Spot_Quality"][0],
+					"Pos_X_Ch1": Data_Ch1["Spot_Pos_X"][0],
+					"Pos_Y_Ch1": Data_Ch1["Spot_Pos_Y"][0],
+					"Pos_Z_Ch1": Data_Ch1["Spot_Pos_Z"][0],
+					"Pos_T_Ch1": Data_Ch1["Spot_Pos_T"][0],
+					"Frame_Ch1": Data_Ch1["Spot_Frame"][0],
+					"Radius_Ch1": Data_Ch1["Spot_Radius"][0],
+					"Visibility_Ch1": int(bool(Data_Ch1["Spot_Visibility"][0])),
+					"Channel_Ch2": Ch2,
+					"Channel_Name_Ch2": str(Data_Ch2["Constants"]["Channel_Name"]),
+					"EMWavelength_Ch2": float(Data_Ch2["Constants"]["Channel_Wavelength_EM"]),
+					"Nb_Detected_Spots_Ch2": int(Data_Ch2["Constants"]["Nb_Detected_Spots"]),
+					"Spot_ID_Ch2": Data_Ch2["Spot_ID"][0],
+					"Spot_Quality_Ch2": Data_Ch2["Spot_Quality"][0],
+					"Pos_X_Ch2": Data_Ch2["Spot_Pos_X"][0],
+					"Pos_Y_Ch2": Data_Ch2["Spot_Pos_Y"][0],
+					"Pos_Z_Ch2": Data_Ch2["Spot_Pos_Z"][0],
+					"Pos_T_Ch2": Data_Ch2["Spot_Pos_T"][0],
+					"Frame_Ch2": Data_Ch2["Spot_Frame"][0],
+					"Radius_Ch2": Data_Ch2["Spot_Radius"][0],
+					"Visibility_Ch2": int(bool(Data_Ch2["Spot_Visibility"][0])),
+					"Channel_Pair": "{} x {}".format(Data_Ch1["Constants"]["Channel_Name"], Data_Ch2["Constants"]["Channel_Name"]),
+					"Conversion_Factor": Optics_Ch1["Conversion_Factor"],
+					"EMWavelength_Unit_Ch1": Optics_Ch1["EMWavelength_Unit"],
+					"EMWavelength_Unit_Ch2": Optics_Ch2["EMWavelength_Unit"],
+					})
+				# FWHM measured on the spots. The Lateral FWHM is the mean of the X and Y FWHM
+				for Suffix, Data_Ch in [("_Ch1", Data_Ch1), ("_Ch2", Data_Ch2)]:
+					Pair["FWHM_X" + Suffix] = Data_Ch["Spot_FWHM_X"][0]
+					Pair["FWHM_Y" + Suffix] = Data_Ch["Spot_FWHM_Y"][0]
+					Pair["FWHM_Lateral" + Suffix] = (Data_Ch["Spot_FWHM_X"][0] + Data_Ch["Spot_FWHM_Y"][0]) / 2
+					Pair["FWHM_Axial" + Suffix] = Data_Ch["Spot_FWHM_Z"][0]
+				for Optics_Key in ["Nyquist_Pixel_Size_Lateral", "Nyquist_Pixel_Size_Axial", "Nyquist_Ratio_Lateral", "Nyquist_Ratio_Axial", "Resolution_Lateral_Theoretical", "Resolution_Axial_Theoretical", "Resolution_Lateral_Practical", "Resolution_Axial_Practical"]:
+					Pair[Optics_Key + "_Ch1"] = Optics_Ch1[Optics_Key]
+					Pair[Optics_Key + "_Ch2"] = Optics_Ch2[Optics_Key]
+				for Key, Typecode, Format in Data_Processed_File_Pair_Columns:
+					Data_Processed_File[Key].append(Pair[Key])
+	Space_Unit_Std = Image_Info["Space_Unit_Std"]
+	Time_Unit = Image_Info["Time_Unit"]
+	global Data_Processed_File_Header
+	Data_Processed_File_Header = [
+	"Filename",
+	"Objective Magnification", 		"Objective NA", "Objective Immersion Media", "Immersion Media Refractive Index",
+	"Detection Method", "Spot Diameter ({})".format(Space_Unit_Std), "Threshold Value", "Subpixel Localization", "Median Filtering",
+	"Batch Mode", "Save Individual Files", "Prolix Mode",
+	"Image Width (pixels)", "Image Height (pixels)", "Image Bit Depth", "Pixel Width ({}/px)".format(Space_Unit_Std), "Pixel Height ({}/px)".format(Space_Unit_Std), "Pixel Depth ({}/px)".format(Space_Unit_Std),
+	"Space Unit", "Space Unit Standard", " Time Unit", "Calibration Status",
+	"Channel 1", "Name Channel 1", "EM Wavelength Channel 1 (nm)",
+	"Nb Detected Spots Ch1", "Spot ID Ch1", "Spot Quality Ch1",
+	"X Ch1 ({})".format(Space_Unit_Std), "Y Ch1 ({})".format(Space_Unit_Std),"Z Ch1 ({})".format(Space_Unit_Std), "T Ch1 ({})".format(Time_Unit),
+	"Frame Ch1", "Radius Ch1 ({})".format(Space_Unit_Std), "Visibility Ch1",
+	"Channel 2", "Name Channel 2", "EM Wavelength Channel 2 (nm)",
+	"Nb Detected Spots Ch2", "Spot ID Ch2", "Spot Quality Ch2",
+	"X Ch2 ({})".format(Space_Unit_Std), "Y Ch2 ({})".format(Space_Unit_Std), "Z Ch2 ({})".format(Space_Unit_Std), "T Ch2 ({})".format(Time_Unit),
+	"Frame Ch2", "Radius Ch2", "Visibility Ch2",
+	"Channel Pair",
+	"X Shift ({})".format(Space_Unit_Std), "Y Shift ({})".format(Space_Unit_Std), "Z Shift ({})".format(Space_Unit_Std),
+	"X Shift (pixels)", "Y Shift (pixels)", "Z Shift (pixels)",
+	"Distance Lateral ({})".format(Space_Unit_Std), "Distance Axial ({})".format(Space_Unit_Std), "Distance 3D ({})".format(Space_Unit_Std),
+	"Conversion Factor", "EMWavelength Unit Ch1 ({})".format(Space_Unit_Std), "EMWavelength Unit Ch2 ({})".format(Space_Unit_Std),
+	"Nyquist Pixel Size Lateral Ch1 ({})".format(Space_Unit_Std), "Nyquist Pixel Size Axial Ch1 ({})".format(Space_Unit_Std), "Nyquist Ratio Lateral Ch1", "Nyquist Ratio Axial Ch1",
+	"Nyquist Pixel Size Lateral Ch2 ({})".format(Space_Unit_Std), "Nyquist Pixel Size Axial Ch2 ({})".format(Space_Unit_Std), "Nyquist Ratio Lateral Ch2", "Nyquist Ratio Axial Ch2",
+	"Resolution Lateral Theoretical Ch1 ({})".format(Space_Unit_Std), "Resolution Axial Theoretical Ch1 ({})".format(Space_Unit_Std), "Resolution Lateral Practical Ch1 ({})".format(Space_Unit_Std), "Resolution Axial Practical Ch1 ({})".format(Space_Unit_Std),
+	"Resolution Lateral Theoretical Ch2 ({})".format(Space_Unit_Std), "Resolution Axial Theoretical Ch2 ({})".format(Space_Unit_Std), "Resolution Lateral Practical Ch2 ({})".format(Space_Unit_Std), "Resolution Axial Practical Ch2 ({})".format(Space_Unit_Std),
+	"FWHM X Ch1 ({})".format(Space_Unit_Std), "FWHM Y Ch1 ({})".format(Space_Unit_Std), "FWHM Lateral Ch1 ({})".format(Space_Unit_Std), "FWHM Axial Ch1 ({})".format(Space_Unit_Std),
+	"FWHM X Ch2 ({})".format(Space_Unit_Std), "FWHM Y Ch2 ({})".format(Space_Unit_Std), "FWHM Lateral Ch2 ({})".format(Space_Unit_Std), "FWHM Axial Ch2 ({})".format(Space_Unit_Std),
+	"X Ref ({})".format(Space_Unit_Std), "Y Ref ({})".format(Space_Unit_Std), "Z Ref ({})".format(Space_Unit_Std),
+	"X Ref Shift ({})".format(Space_Unit_Std), "Y Ref Shift ({})".format(Space_Unit_Std), "Z Ref Shift ({})".format(Space_Unit_Std),
+	"Semi Minor Axis ({})".format(Space_Unit_Std), "Semi Major Axis ({})".format(Space_Unit_Std),
+	"Distance Lateral Ref ({})".format(Space_Unit_Std), "Distance Axial Ref ({})".format(Space_Unit_Std), "Distance 3D Ref ({})".format(Space_Unit_Std),
+	"Colocalization Ratio",
+	]
+	Settings_Stored = Read_Preferences(Settings_Template)
 	if Settings_Stored[Function_Name+".Save_Individual_Files"]:
-		Data_Processed_Ouput_Path = Generate_Unique_Filepath(Output_Dir, Image_Info["Basename"], "Channel-Alignment_All-Data", ".csv")
-		CSV_File = open(Data_Processed_Ouput_Path, "w")
-		CSV_Writer = csv.writer(CSV_File, delimiter = ",", lineterminator = "\n")
-		CSV_Writer.writerow(Data_Processed_File_Header)
-		for i in range(len(Data_Processed_File["Filename"])):
-			Row = []
-			for Key in Data_Processed_File_Ordered_Keys:
-				Value = Data_Processed_File[Key][i]
-				Row.append(Value)
-			CSV_Writer.writerow(Row)
-		CSV_File.close()
+		if Settings_Stored[Function_Name+".Output_Format"] in ["Long", "Both"]:
+			Data_Processed_Ouput_Path = Generate_Unique_Filepath(Output_Dir, Image_Info["Basename"], "Channel-Alignment_All-Data", ".csv")
+			CSV_File = open(Data_Processed_Ouput_Path, "w")
+			CSV_Writer = csv.writer(CSV_File, delimiter = ",", lineterminator = "\n")
+			CSV_Writer.writerow(Data_Processed_File_Header)
+			for Row in Data_Processed_File_Rows(Data_Processed_File):
+				CSV_Writer.writerow(Row)
+			CSV_File.close()
+		if Settings_Stored[Function_Name+".Output_Format"] in ["Matrix", "Both"]:
+			Data_Processed_Ouput_Path = Generate_Unique_Filepath(Output_Dir, Image_Info["Basename"], "Channel-Alignment_Matrix", ".csv")
+			CSV_File = open(Data_Processed_Ouput_Path, "w")
+			CSV_Writer = csv.writer(CSV_File, delimiter = ",", lineterminator = "\n")
+			CSV_Writer.writerow(Get_Matrix_Header(Nb_Channels))
+			for Row in Data_Processed_File_Matrix_Rows(Data_Processed_File, Nb_Channels):
+				CSV_Writer.writerow(Row)
+			CSV_File.close()
 	return Data_Processed_File
+
+# Matrix output. One Channel x Channel table per metric and per image
+# Row Channel is Ch1 and column Channel is Ch2 so the values read as Ch2 relative to Ch1
+Data_Processed_File_Matrix_Keys = [ # Key, Label
+	("Distance_3D", "Distance 3D"),
+	("Colocalization_Ratio", "Colocalization Ratio"),
+	]
+
+def Get_Matrix_Header(Nb_Channels):
+	return ["Filename", "Objective Magnification", "Metric", "Channel", "Channel Name"] + ["Channel {}".format(Channel) for Channel in range(1, Nb_Channels + 1)]
+
+# Return the rows of the matrices of a Data_Processed_File. Pairs not computed are left empty
+def Data_Processed_File_Matrix_Rows(Data_Processed_File, Nb_Channels):
+	Constants = Data_Processed_File["Constants"]
+	if not Constants:
+		return
+	Pair_Index = {}
+	Channel_Names = {}
+	for i in range(Get_Nb_Pairs(Data_Processed_File)):
+		Ch1 = Data_Processed_File["Channel_Ch1"][i]
+		Pair_Index[(Ch1, Data_Processed_File["Channel_Ch2"][i])] = i
+		Channel_Names[Ch1] = Data_Processed_File["Channel_Name_Ch1"][i]
+	Formats = dict((Key, Format) for Key, Typecode, Format in Data_Processed_File_Pair_Columns)
+	for Key, Matrix_Label in Data_Processed_File_Matrix_Keys:
+		if Key.startswith("Distance"):
+			Matrix_Label = "{} ({})".format(Matrix_Label, Constants["Space_Unit_Std"])
+		for Ch1 in sorted(Channel_Names):
+			Row = [Constants["Filename"], Constants["Objective_Mag"], Matrix_Label, Ch1, Channel_Names[Ch1]]
+			for Ch2 in range(1, Nb_Channels + 1):
+				if (Ch1, Ch2) in Pair_Index:
+					Row.append(float(Formats[Key] % Data_Processed_File[Key][Pair_Index[(Ch1, Ch2)]]))
+				else:
+					Row.append("")
+			yield Row
+# Chromatic shift model. Fit the shift of the beads between two Channels as a function of their position in the field
+# The positions are normalized by the field size: U = X / Field_Width, V = Y / Field_Height
+# Order 1 is an affine model Shift = C0 + C1*U + C2*V. Order 2 adds C3*U^2 + C4*U*V + C5*V^2
+Shift_Model_Terms = {1: ["1", "U", "V"], 2: ["1", "U", "V", "U^2", "U*V", "V^2"]}
+
+def Get_Shift_Model_Basis(U, V, Order):
+	if Order == 1:
+		return [1.0, U, V]
+	return [1.0, U, V, U * U, U * V, V * V]
+
+# Least squares fit of Values = Basis * Coefficients from the normal equations. Return the Coefficients or None
+def Fit_Least_Squares(Basis_Rows, Values):
+	Nb_Parameters = len(Basis_Rows[0])
+	Normal_Matrix = [[0.0] * Nb_Parameters for i in range(Nb_Parameters)]
+	Normal_Vector = [0.0] * Nb_Parameters
+	for Basis, Value in zip(Basis_Rows, Values):
+		for i in range(Nb_Parameters):
+			Normal_Vector[i] += Basis[i] * Value
+			for j in range(Nb_Parameters):
+				Normal_Matrix[i][j] += Basis[i] * Basis[j]
+	return Solve_Linear_System(Normal_Matrix, Normal_Vector)
+
+def Evaluate_Shift_Model(Coefficients, U, V, Order):
+	return sum([Coefficient * Term for Coefficient, Term in zip(Coefficients, Get_Shift_Model_Basis(U, V, Order))])
+
+# Gather the beads of all processed images per Objective and pair of Channels and fit the shift models
+# Return a list of Shift_Model dictionnaries
+def Fit_Shift_Models(Data_Processed_All_Files):
+	Settings_Stored = Read_Preferences(Settings_Template)
+	Requested_Order = Settings_Stored[Function_Name+".Shift_Model_Order"]
+	Bead_Groups = {} # (Objective_Mag, Channel_Ch1, Channel_Ch2) -> Beads
+	for Data_Processed_File in Data_Processed_All_Files:
+		Constants = Data_Processed_File["Constants"]
+		if not Constants:
+			continue
+		for i in range(Get_Nb_Pairs(Data_Processed_File)):
+			Ch1 = Data_Processed_File["Channel_Ch1"][i]
+			Ch2 = Data_Processed_File["Channel_Ch2"][i]
+			if Ch1 == Ch2:
+				continue
+			Key = (Constants["Objective_Mag"], Ch1, Ch2)
+			if Key not in Bead_Groups:
+				Bead_Groups[Key] = {
+					"Channel_Name_Ch1": Data_Processed_File["Channel_Name_Ch1"][i],
+					"Channel_Name_Ch2": Data_Processed_File["Channel_Name_Ch2"][i],
+					"Space_Unit_Std": Constants["Space_Unit_Std"],
+					"Field_Width": 0.0,
+					"Field_Height": 0.0,
+					"Beads": [],
+					}
+			Bead_Group = Bead_Groups[Key]
+			Bead_Group["Field_Width"] = max(Bead_Group["Field_Width"], Constants["Width_Pix"] * Constants["Pixel_Width"])
+			Bead_Group["Field_Height"] = max(Bead_Group["Field_Height"], Constants["Height_Pix"] * Constants["Pixel_Height"])
+			Bead_Group["Beads"].append((
+				Constants["Filename"],
+				Data_Processed_File["Pos_X_Ch1"][i], Data_Processed_File["Pos_Y_Ch1"][i],
+				Data_Processed_File["Diff_X"][i], Data_Processed_File["Diff_Y"][i], Data_Processed_File["Diff_Z"][i],
+				))
+	Shift_Models = []
+	for Key in sorted(Bead_Groups.keys()):
+		Objective_Mag, Ch1, Ch2 = Key
+		Bead_Group = Bead_Groups[Key]
+		Beads = Bead_Group["Beads"]
+		# Use the highest order that the number of beads can support
+		Order = Requested_Order
+		while Order > 1 and len(Beads) < len(Shift_Model_Terms[Order]):
+			Order -= 1
+		if len(Beads) < len(Shift_Model_Terms[Order]):
+			Prolix_Message("Not enough beads to fit a shift model for {} {} x {}: {} beads.".format(Objective_Mag, Ch1, Ch2, len(Beads)))
+			continue
+		Basis_Rows = []
+		for Filename, X, Y, Diff_X, Diff_Y, Diff_Z in Beads:
+			Basis_Rows.append(Get_Shift_Model_Basis(X / Bead_Group["Field_Width"], Y / Bead_Group["Field_Height"], Order))
+		Coefficients = []
+		for Axis in range(3):
+			Axis_Coefficients = Fit_Least_Squares(Basis_Rows, [Bead[3 + Axis] for Bead in Beads])
+			if Axis_Coefficients is None: # Beads are aligned, the model is undetermined
+				break
+			Coefficients.append(Axis_Coefficients)
+		if len(Coefficients) < 3:
+			IJ.log("Shift model could not be fitted for {} {} x {}. The beads do not cover the field.".format(Objective_Mag, Ch1, Ch2))
+			continue
+		Residuals = []
+		for Bead, Basis in zip(Beads, Basis_Rows):
+			Residuals.append([Bead[3 + Axis] - sum([C * B for C, B in zip(Coefficients[Axis], Basis)]) for Axis in range(3)])
+		Shift_Model = {
+			"Objective_Mag": Objective_Mag,
+			"Channel_Ch1": Ch1,
+			"Channel_Ch2": Ch2,
+			"Order": Order,
+			"Coefficients": Coefficients,
+			"Residuals": Residuals,
+			"RMS_Residuals": [sqrt(sum([Residual[Axis] ** 2 for Residual in Residuals]) / len(Residuals)) for Axis in range(3)],
+			}
+		Shift_Model.update(Bead_Group)
+		Shift_Models.append(Shift_Model)
+	return Shift_Models
+
+# Write the shift models, the residuals of each bead and a shift map image per Objective
+def Save_Shift_Models(Shift_Models):
+	if not Shift_Models:
+		return
+	Shift_Model_Output_Path = Generate_Unique_Filepath(Output_Dir, "{}_Shift-Model".format(Function_Name), "Merged", ".csv")
+	CSV_File = open(Shift_Model_Output_Path, "w")
+	CSV_Writer = csv.writer(CSV_File, delimiter = ",", lineterminator = "\n")
+	Header = ["Objective Magnification", "Channel 1", "Name Channel 1", "Channel 2", "Name Channel 2", "Space Unit", "Field Width", "Field Height", "Model Order", "Nb Beads"]
+	for Axis_Name in ["X", "Y", "Z"]:
+		Header.extend(["{} Shift C{} ({})".format(Axis_Name, i, Term) for i, Term in enumerate(Shift_Model_Terms[2])])
+	Header.extend(["RMS Residual X", "RMS Residual Y", "RMS Residual Z"])
+	CSV_Writer.writerow(Header)
+	for Shift_Model in Shift_Models:
+		Row = [
+			Shift_Model["Objective_Mag"], Shift_Model["Channel_Ch1"], Shift_Model["Channel_Name_Ch1"], Shift_Model["Channel_Ch2"], Shift_Model["Channel_Name_Ch2"],
+			Shift_Model["Space_Unit_Std"], round(Shift_Model["Field_Width"], 3), round(Shift_Model["Field_Height"], 3), Shift_Model["Order"], len(Shift_Model["Beads"]),
+			]
+		for Axis_Coefficients in Shift_Model["Coefficients"]:
+			Row.extend([float("%.6g" % Coefficient) for Coefficient in Axis_Coefficients])
+			Row.extend([0.0] * (len(Shift_Model_Terms[2]) - len(Axis_Coefficients))) # Unused terms of lower orders
+		Row.extend([round(RMS, 4) for RMS in Shift_Model["RMS_Residuals"]])
+		CSV_Writer.writerow(Row)
+	CSV_File.close()
+
+	Residuals_Output_Path = Generate_Unique_Filepath(Output_Dir, "{}_Shift-Residuals".format(Function_Name), "Merged", ".csv")
+	CSV_File = open(Residuals_Output_Path, "w")
+	CSV_Writer = csv.writer(CSV_File, delimiter = ",", lineterminator = "\n")
+	CSV_Writer.writerow(["Objective Magnification", "Channel 1", "Channel 2", "Filename", "X Ch1", "Y Ch1", "X Shift", "Y Shift", "Z Shift", "X Residual", "Y Residual", "Z Residual"])
+	for Shift_Model in Shift_Models:
+		for Bead, Residual in zip(Shift_Model["Beads"], Shift_Model["Residuals"]):
+			Filename, X, Y, Diff_X, Diff_Y, Diff_Z = Bead
+			CSV_Writer.writerow([
+				Shift_Model["Objective_Mag"], Shift_Model["Channel_Ch1"], Shift_Model["Channel_Ch2"], Filename,
+				round(X, 3), round(Y, 3), round(Diff_X, 3), round(Diff_Y, 3), round(Diff_Z, 3),
+				round(Residual[0], 4), round(Residual[1], 4), round(Residual[2], 4),
+				])
+	CSV_File.close()
+
+	# Shift map. One slice per pair of Channels and per axis, sampled from the model on a coarse grid
+	Objectives = []
+	for Shift_Model in Shift_Models:
+		if Shift_Model["Objective_Mag"] not in Objectives:
+			Objectives.append(Shift_Model["Objective_Mag"])
+	for Objective_Mag in Objectives:
+		Objective_Models = [Shift_Model for Shift_Model in Shift_Models if Shift_Model["Objective_Mag"] == Objective_Mag]
+		Field_Width = Objective_Models[0]["Field_Width"]
+		Field_Height = Objective_Models[0]["Field_Height"]
+		Shift_Map_Stack = ImageStack(Shift_Map_Grid_Size, Shift_Map_Grid_Size)
+		for Shift_Model in Objective_Models:
+			for Axis, Axis_Name in enumerate(["X", "Y", "Z"]):
+				Shift_Map = FloatProcessor(Shift_Map_Grid_Size, Shift_Map_Grid_Size)
+				for Grid_Y in range(Shift_Map_Grid_Size):
+					for Grid_X in range(Shift_Map_Grid_Size):
+						U = (Grid_X + 0.5) / Shift_Map_Grid_Size * Field_Width / Shift_Model["Field_Width"]
+						V = (Grid_Y + 0.5) / Shift_Map_Grid_Size * Field_Height / Shift_Model["Field_Height"]
+						Shift_Map.setf(Grid_X, Grid_Y, Evaluate_Shift_Model(Shift_Model["Coefficients"][Axis], U, V, Shift_Model["Order"]))
+				Shift_Map_Stack.addSlice("{} x {} {} Shift".format(Shift_Model["Channel_Name_Ch1"], Shift_Model["Channel_Name_Ch2"], Axis_Name), Shift_Map)
+		Shift_Map_imp = ImagePlus("{}_Shift-Map_{}".format(Function_Name, Objective_Mag), Shift_Map_Stack)
+		Shift_Map_Calibration = Shift_Map_imp.getCalibration()
+		Shift_Map_Calibration.pixelWidth = Field_Width / Shift_Map_Grid_Size
+		Shift_Map_Calibration.pixelHeight = Field_Height / Shift_Map_Grid_Size
+		Shift_Map_Calibration.setUnit(Objective_Models[0]["Space_Unit_Std"])
+		Shift_Map_Output_Path = Generate_Unique_Filepath(Output_Dir, "{}_Shift-Map".format(Function_Name), Objective_Mag, ".tif")
+		IJ.saveAsTiff(Shift_Map_imp, Shift_Map_Output_Path)
+		Shift_Map_imp.close()
+	return
+
 # We are done with functions... Getting to work now...
 Initialize_Preferences(Settings_Template, Reset_Preferences)
 Image_List = Get_Images()
 if not os.path.exists(Output_Dir): os.makedirs(Output_Dir)
 Data_All_Files, Data_Processed_All_Files, Processed_Image_List = Process_Image_List(Image_List)
-Output_Data_Processed_CSV_Path = Generate_Unique_Filepath(Output_Dir, "{}_All-Data".format(Function_Name), "Merged", ".csv")
-Output_Data_Processed_File = open(Output_Data_Processed_CSV_Path, "w")
-CSV_Writer = csv.writer(Output_Data_Processed_File, delimiter = ",", lineterminator = "\n")
-CSV_Writer.writerow(Data_Processed_File_Header)
-for Data_Processed_File in Data_Processed_All_Files:
-	for i in range(len(Data_Processed_File["Filename"])):
-		Row = []
-		for Key in Data_Processed_File_Ordered_Keys:
-					Value = Data_Processed_File[Key][i]
-					Row.append(Value)
-		CSV_Writer.writerow(Row)
-Output_Data_Processed_File.close()
+Settings_Stored = Read_Preferences(Settings_Template)
+if Settings_Stored[Function_Name+".Output_Format"] in ["Long", "Both"]:
+	Output_Data_Processed_CSV_Path = Generate_Unique_Filepath(Output_Dir, "{}_All-Data".format(Function_Name), "Merged", ".csv")
+	Output_Data_Processed_File = open(Output_Data_Processed_CSV_Path, "w")
+	CSV_Writer = csv.writer(Output_Data_Processed_File, delimiter = ",", lineterminator = "\n")
+	CSV_Writer.writerow(Data_Processed_File_Header)
+	for Data_Processed_File in Data_Processed_All_Files:
+		for Row in Data_Processed_File_Rows(Data_Processed_File):
+			CSV_Writer.writerow(Row)
+	Output_Data_Processed_File.close()
+if Settings_Stored[Function_Name+".Output_Format"] in ["Matrix", "Both"]:
+	Max_Nb_Channels = max([0] + [max(Data_Processed_File["Channel_Ch1"]) for Data_Processed_File in Data_Processed_All_Files if Get_Nb_Pairs(Data_Processed_File) > 0])
+	Output_Matrix_CSV_Path = Generate_Unique_Filepath(Output_Dir, "{}_Matrix".format(Function_Name), "Merged", ".csv")
+	Output_Matrix_File = open(Output_Matrix_CSV_Path, "w")
+	CSV_Writer = csv.writer(Output_Matrix_File, delimiter = ",", lineterminator = "\n")
+	CSV_Writer.writerow(Get_Matrix_Header(Max_Nb_Channels))
+	for Data_Processed_File in Data_Processed_All_Files:
+		for Row in Data_Processed_File_Matrix_Rows(Data_Processed_File, Max_Nb_Channels):
+			CSV_Writer.writerow(Row)
+	Output_Matrix_File.close()
+Save_Shift_Models(Fit_Shift_Models(Data_Processed_All_Files))
+# The Essential Data is built from the processed data and does not need the All-Data file
 Output_Essential_Data_Processed_CSV_Path = Generate_Unique_Filepath(Output_Dir, "{}_Essential-Data".format(Function_Name), "Merged", ".csv")
-Output_Data_Processed_File = open(Output_Data_Processed_CSV_Path, "r")
-Reader = csv.reader(Output_Data_Processed_File, delimiter = ",", lineterminator = "\n")
-Header = next(Reader)
 Filename_Column_Index = 0
-Selected_Columns = [0, 1, 23, 24, 36, 37, 53, 54, 55, 89] # Add Index to have more columns saved in the Essential Data
-Selected_Header = [Header[i] for i in Selected_Columns]
+Selected_Keys = ["Filename", "Objective_Mag", "Channel_Ch1", "Channel_Name_Ch1", "Channel_Ch2", "Channel_Name_Ch2", "Diff_X_Pix", "Diff_Y_Pix", "Diff_Z_Pix", "Pixel_Width", "Pixel_Height", "Pixel_Depth", "Colocalization_Ratio"] # Add Keys to have more columns saved in the Essential Data
+Selected_Columns = [Data_Processed_File_Ordered_Keys.index(Key) for Key in Selected_Keys]
+Selected_Header = [Data_Processed_File_Header[i] for i in Selected_Columns]
 Max_Filename_Variables = 0
 Processed_Rows = []
-for Row in Reader:
+for Row in (Row for Data_Processed_File in Data_Processed_All_Files for Row in Data_Processed_File_Rows(Data_Processed_File)):
 	Filename = Row[Filename_Column_Index]
 	Filename_Variables = Filename.split("_")
 	if "." in Filename_Variables[-1]:
@@ -2015,8 +3697,6 @@ for Selected_Row, Filename_Variables in Processed_Rows:
 	)
 	CSV_Writer.writerow(Final_Row)
 Output_Essential_Data_Processed_File.close()
-Output_Data_Processed_File.close()
 Message = "{} {} successful.\n{} images have been processed.\n Files are saved in {}".format(Plugin_Name, Function_Name, len(Processed_Image_List), Output_Dir)
 IJ.log(Message)
-JOptionPane.showMessageDialog(None, Message, "{} {}".format(Plugin_Name, Function_Name), JOptionPane.INFORMATION_MESSAGE)
-java.lang.System.gc() # Cleaning up my mess ;-)
\ No newline at end of file
+JOptionPane.showMessageDialog(None, Message, "{} {}".format(Plugin_Name, Function_Name), JOptionPane.INFORMATION_MESSAGE)
\ No newline at end of file
@@ -0,0 +1,727 @@
+# Written by Nicolas Stifani nstifani@gmail.com for info
+
+# Import General Features
+import os
+import sys
+import csv
+import json
+
+
+# Import ImageJ Features
+from ij import IJ, Prefs
+from ij.process import ImageProcessor, Blitter
+
+
+# Import Bioformat Features
+from loci.formats import MetadataTools, FormatTools
+from loci.formats.out import OMETiffWriter
+from loci.plugins.util import ImageProcessorReader
+from loci.common import DataTools
+from ome.units import UNITS
+
+
+# Import Java Features
+from java.awt import Font, GridBagLayout, GridBagConstraints, Insets, Toolkit
+from javax.swing import JOptionPane, JFileChooser, JTextField, JLabel, JRadioButton, ButtonGroup, JButton, JCheckBox, JPanel, JDialog
+from javax.swing.filechooser import FileNameExtensionFilter
+from java.util.concurrent import Executors, Callable
+from java.lang import Runtime
+from mpicbg.models import AffineModel2D
+from mpicbg.ij import InverseTransformMapping
+
+# -*- coding: utf-8 -*-
+reload(sys)
+sys.setdefaultencoding("utf-8")
+
+
+
+# Defining some constants
+Plugin_Name = "QC Scope"
+Function_Name = "Channel Registration"
+Unicode_Micron_Symbol = "u" #chr(0xB5)
+Reset_Preferences = False # useful to reset Preferences with the template
+User_Desktop_Path = os.path.join(os.path.expanduser("~"), "Desktop") # Used for Saving the Output DIrectory and as a default for selecting an input directory
+Output_Dir = os.path.join(User_Desktop_Path, "Output") # Where all files are saved
+Folder_Index_Path = os.path.join(Output_Dir, "{}_Folder-Index.json".format(Plugin_Name)) # Directory listings of the scanned folders shared by the QC Scope scripts
+
+# Tuple (List) of supported image file extensions. When an input folder is selected only images with these extensions are selected
+Image_Valid_Extensions = (".tif", ".tiff", ".jpg", ".jpeg", ".png", ".czi", ".nd2", ".lif", ".lsm", ".ome.tif", ".ome.tiff")
+Image_Valid_Extension_Set = frozenset([Extension for Extension in Image_Valid_Extensions if Extension.count(".") == 1]) # .ome.tif files end with .tif
+Scan_Threads = 8 # Directories listed in parallel by Scan_Folder
+
+# Conversion factors from the Standard Space Units of the Channel Alignment results to micrometers
+Micrometer_Conversion_Factors = {
+	Unicode_Micron_Symbol + "m": 1.0,
+	"nm": 0.001,
+	"mm": 1000.0,
+	"cm": 10000.0,
+	"m": 1000000.0,
+	"in": 25400.0,
+	}
+
+# Files larger than this are written as BigTIFF
+Big_Tiff_Size_Limit = 2000000000
+
+# Relative difference tolerated between the pixel size of an image and the pixel size of the alignment result for shifts in pixels
+Pixel_Size_Tolerance = 0.01
+
+# Dictionnary of Settings
+Settings_Template = {
+	Function_Name + ".Alignment_File": "",
+	Function_Name + ".Objective_Mag": "",
+	Function_Name + ".Correction_Mode": "Translation",
+	Function_Name + ".Reference_Channel": 1,
+	Function_Name + ".Nb_Workers": 2,
+	Function_Name + ".Prolix_Mode": False,
+}
+
+
+# Some useful functions
+# Display a message in the log only in Prolix_Mode
+def Prolix_Message(Message):
+	Settings_Stored = Read_Preferences(Settings_Template)
+	if Settings_Stored[Function_Name + ".Prolix_Mode"]:
+		IJ.log(Message)
+	return
+
+# Check if Setting in the Setting List are in the Preferences. If not, write them from the Templates. Also used to Reset Settings
+def Initialize_Preferences(Settings, Reset_Preferences):
+ 	if Reset_Preferences:
+		Save_Preferences(Settings)
+	else:
+		for Setting, Value in Settings.items():
+		 	if Prefs.get(Setting, None) is None:
+				Save_Preferences(Settings)
+ 				break
+	return
+
+# Read the Preferences an return a dictionnary with the settings
+def Read_Preferences(Settings):
+	Preferences_Stored = {}
+	for Key, Default_Value in Settings.items():
+		Value = Prefs.get(Key, str(Default_Value))
+		# Use the Type of data from theTemplate to convert the settings from the Pref in the correct type
+		if isinstance(Default_Value, bool):
+			Value = bool(int(Value)) # Interestingly Boolean are saved as a float in the Pref so we need to convert to int and then to boolean
+		elif isinstance(Default_Value, float):
+			Value = float(Value)
+		elif isinstance(Default_Value, int):
+			Value = int(Value)
+		else:
+			Value = str(Value)
+		Preferences_Stored[Key] = Value
+	return Preferences_Stored # A dictionary of the Settings
+
+# Save Settings in the Preference File
+def Save_Preferences(Settings):
+	for Key, Value in Settings.items():
+		if isinstance(Value, bool):
+			Value = int(Value)
+		else:
+			Value = str(Value)
+		Prefs.set(Key, str(Value)) # Write the Preferences as strings
+	Prefs.savePreferences()
+	return
+
+# Return InputDir_Path as a string
+def Select_Folder(Default_Path):
+	Prolix_Message("Selecting Folder...")
+	Chooser = JFileChooser(Default_Path)
+	Chooser.setFileSelectionMode(JFileChooser.DIRECTORIES_ONLY)
+	Chooser.setDialogTitle("Choose a directory containing the images to correct")
+	Return_Value = Chooser.showOpenDialog(None)
+	if Return_Value == JFileChooser.APPROVE_OPTION:
+		InputDir_Path = Chooser.getSelectedFile().getAbsolutePath()
+		Prolix_Message("Success Selecting Folder: {}.".format(InputDir_Path))
+	else:
+		Message="Folder selection was canceled by user."
+		IJ.log(Message)
+		JOptionPane.showMessageDialog(None, Message, "{} {}".format(Plugin_Name, Function_Name), JOptionPane.INFORMATION_MESSAGE)
+		sys.exit(Message)
+	return InputDir_Path
+
+# Return the path of the selected Channel Alignment result (csv) or None if canceled
+def Select_Alignment_File(Default_Path):
+	Chooser = JFileChooser(Default_Path)
+	Chooser.setFileSelectionMode(JFileChooser.FILES_ONLY)
+	Chooser.setFileFilter(FileNameExtensionFilter("Channel Alignment results (csv)", ["csv"]))
+	Chooser.setDialogTitle("Choose a Channel Alignment result")
+	if Chooser.showOpenDialog(None) == JFileChooser.APPROVE_OPTION:
+		return str(Chooser.getSelectedFile().getAbsolutePath())
+	return None
+
+# Return the sorted list of the image files in Input_Dir_Path and its subdirectories
+# Directories are listed in parallel one depth at a time. Listings are kept in the Folder Index and a directory is only listed again when its mtime changed
+def Scan_Folder(Input_Dir_Path):
+	Folder_Index = Read_Folder_Index()
+	Scanned_Index = {}
+	Image_List = []
+	Executor = Executors.newFixedThreadPool(Scan_Threads)
+	try:
+		Directories = [Input_Dir_Path]
+		while Directories:
+			Futures = [Executor.submit(Directory_Lister(Directory, Folder_Index.get(Directory))) for Directory in Directories]
+			Directories = []
+			for Future in Futures:
+				Listing = Future.get()
+				if Listing is None:
+					continue
+				Scanned_Index[Listing["Path"]] = Listing
+				Image_List.extend([str(os.path.join(Listing["Path"], Name)) for Name in Listing["Files"]])
+				Directories.extend([os.path.join(Listing["Path"], Directory) for Directory in Listing["Dirs"]])
+	finally:
+		Executor.shutdown()
+	# Directories removed from the scanned folder are dropped from the Folder Index
+	for Directory in Folder_Index.keys():
+		if (Directory == Input_Dir_Path or Directory.startswith(os.path.join(Input_Dir_Path, ""))) and Directory not in Scanned_Index:
+			del Folder_Index[Directory]
+	Folder_Index.update(Scanned_Index)
+	Write_Folder_Index(Folder_Index)
+	Image_List.sort()
+	return Image_List
+
+# List a Directory on the Scan_Folder threads
+class Directory_Lister(Callable):
+	def __init__(self, Directory, Cached_Listing):
+		self.Directory = Directory
+		self.Cached_Listing = Cached_Listing
+	def call(self):
+		return List_Directory(self.Directory, self.Cached_Listing)
+
+# Return the Listing {"Path", "Mtime", "Files", "Dirs"} of the image files and subdirectories of Directory. None if it cannot be read
+# The Cached_Listing is returned if the Directory did not change. Only entries without an image extension are checked for being a directory
+def List_Directory(Directory, Cached_Listing):
+	try:
+		Mtime = os.path.getmtime(Directory)
+		if Cached_Listing is not None and Cached_Listing["Mtime"] == Mtime:
+			return Cached_Listing
+		Files = []
+		Dirs = []
+		for Name in os.listdir(Directory):
+			if os.path.splitext(Name)[1].lower() in Image_Valid_Extension_Set:
+				Files.append(Name)
+			else:
+				Path = os.path.join(Directory, Name)
+				if os.path.isdir(Path) and not os.path.islink(Path): # Links are not followed
+					Dirs.append(Name)
+		return {"Path": Directory, "Mtime": Mtime, "Files": Files, "Dirs": Dirs}
+	except Exception, Error:
+		IJ.log("Failed listing {}: {}".format(Directory, Error))
+		return None
+
+# Return the Folder Index a dictionnary Directory -> Listing (see List_Directory)
+def Read_Folder_Index():
+	if not os.path.exists(Folder_Index_Path):
+		return {}
+	Index_File = open(Folder_Index_Path, "r")
+	try:
+		return json.load(Index_File)
+	except ValueError: # File partially written by an interrupted run
+		return {}
+	finally:
+		Index_File.close()
+
+def Write_Folder_Index(Folder_Index):
+	if not os.path.exists(Output_Dir):
+		os.makedirs(Output_Dir)
+	Index_File = open(Folder_Index_Path, "w")
+	json.dump(Folder_Index, Index_File)
+	Index_File.close()
+	return
+
+# Generate a Unique filepath Directory\Basename_Suffix-001.Extension
+def Generate_Unique_Filepath(Directory, Basename, Suffix, Extension):
+	Prolix_Message("Generating Unique Filepath {}...".format(Basename))
+	Filename = "{}_{}{}".format(Basename, Suffix, Extension)
+	Filepath = os.path.join(Directory, Filename)
+	if not os.path.exists(Filepath):
+		Prolix_Message("Success Generating Unique Filepath {}.".format(Basename))
+		return Filepath
+	File_Counter = 2
+	while True:
+		Filename = "{}_{}-{:03d}{}".format(Basename, Suffix, File_Counter, Extension)
+		Filepath = os.path.join(Directory, Filename)
+		if not os.path.exists(Filepath):
+			Prolix_Message("Success Generating Unique Filepath {}.".format(Basename))
+			return Filepath
+		File_Counter += 1
+	return
+
+# Return the index of the first column of the Header starting with Prefix and not containing Exclude
+def Find_Column(Header, Prefix, Exclude = None):
+	for Index, Column in enumerate(Header):
+		if Column.startswith(Prefix) and (Exclude is None or Exclude not in Column):
+			return Index
+	return None
+
+# Return the unit written between parenthesis in a Column name. "X Shift (um)" returns "um"
+def Get_Column_Unit(Column):
+	if "(" in Column and Column.endswith(")"):
+		return Column[Column.rindex("(") + 1:-1]
+	return ""
+
+# Return the Pixel sizes [Width, Height, Depth] of a Row in micrometers. None if the Row has no calibrated pixel size
+def Get_Row_Pixel_Sizes(Header, Row):
+	Pixel_Sizes = []
+	for Axis_Name in ["Width", "Height", "Depth"]:
+		Column = Find_Column(Header, "Pixel {} (".format(Axis_Name))
+		if Column is None:
+			return None
+		Unit = Get_Column_Unit(Header[Column]).replace("/px", "")
+		if Unit not in Micrometer_Conversion_Factors:
+			return None
+		Pixel_Sizes.append(float(Row[Column]) * Micrometer_Conversion_Factors[Unit])
+	return Pixel_Sizes
+
+# Return True if the Pixel sizes are the same within the Pixel_Size_Tolerance. Depths are ignored for single plane images
+def Same_Pixel_Sizes(Pixel_Sizes_1, Pixel_Sizes_2, Nb_Axes = 3):
+	for Axis in range(Nb_Axes):
+		if abs(Pixel_Sizes_1[Axis] - Pixel_Sizes_2[Axis]) > Pixel_Size_Tolerance * max(abs(Pixel_Sizes_1[Axis]), abs(Pixel_Sizes_2[Axis])):
+			return False
+	return True
+
+# Read the Corrections from a Channel Alignment result
+# All-Data and Essential-Data files give a mean translation per Channel. Shift-Model files give an affine model per Channel
+# Only the rows of one objective are used: Objective_Mag or the only objective of the file
+# Return Corrections a dictionnary Channel -> Correction dictionnary. All shifts are the position of Channel minus the Reference_Channel
+# Shifts in pixels keep the Pixel_Sizes they were measured with (None if unknown) so they are only applied to images with the same calibration
+def Read_Corrections(Alignment_File_Path, Reference_Channel, Correction_Mode, Objective_Mag):
+	CSV_File = open(Alignment_File_Path, "r")
+	Reader = csv.reader(CSV_File, delimiter = ",", lineterminator = "\n")
+	Header = next(Reader)
+	Rows = [Row for Row in Reader]
+	CSV_File.close()
+	Channel_1_Column = Find_Column(Header, "Channel 1")
+	Channel_2_Column = Find_Column(Header, "Channel 2")
+	if Channel_1_Column is None or Channel_2_Column is None:
+		IJ.log("{} is not a Channel Alignment result.".format(Alignment_File_Path))
+		return None
+	Rows = [Row for Row in Rows if int(Row[Channel_1_Column]) == Reference_Channel]
+	# Shifts of different objectives are never mixed
+	Objective_Column = Find_Column(Header, "Objective Magnification")
+	if Objective_Column is not None:
+		Objectives = sorted(set([Row[Objective_Column].strip() for Row in Rows]))
+		if Objective_Mag == "" and len(Objectives) == 1:
+			Objective_Mag = Objectives[0]
+		if Objective_Mag not in Objectives:
+			IJ.log("Select one objective of {} in the dialog. Objectives found: {}.".format(Alignment_File_Path, ", ".join(Objectives)))
+			return None
+		Rows = [Row for Row in Rows if Row[Objective_Column].strip() == Objective_Mag]
+		Prolix_Message("Using the corrections of the {} objective.".format(Objective_Mag))
+	Corrections = {}
+	if "Model Order" in Header:
+		if Correction_Mode != "Affine":
+			Prolix_Message("Shift model found in {}. Using the translation at the center of the field.".format(Alignment_File_Path))
+		Unit = Header.index("Space Unit")
+		for Row in Rows:
+			Channel = int(Row[Channel_2_Column])
+			if int(Row[Header.index("Model Order")]) > 1:
+				IJ.log("Channel {} shift model is not affine. Only its affine terms are applied.".format(Channel))
+			Coefficients = []
+			for Axis_Name in ["X", "Y", "Z"]:
+				Coefficients.append([float(Row[Find_Column(Header, "{} Shift C{} ".format(Axis_Name, i))]) for i in range(3)])
+			Correction = {
+				"Unit": Row[Unit],
+				"Field_Width": float(Row[Header.index("Field Width")]),
+				"Field_Height": float(Row[Header.index("Field Height")]),
+				"Shift": [Axis_Coefficients[0] + 0.5 * Axis_Coefficients[1] + 0.5 * Axis_Coefficients[2] for Axis_Coefficients in Coefficients], # At the center of the field
+				"Pixel_Sizes": None,
+				}
+			if Correction_Mode == "Affine":
+				Correction["Coefficients"] = Coefficients
+			Corrections[Channel] = Correction
+	else:
+		if Correction_Mode == "Affine":
+			IJ.log("{} has no shift model. Applying a translation per Channel.".format(Alignment_File_Path))
+		# Prefer the calibrated shifts of the All-Data files. Essential-Data files only have pixel shifts
+		Shift_Columns = [Find_Column(Header, "{} Shift (".format(Axis_Name), Exclude = "pixels") for Axis_Name in ["X", "Y", "Z"]]
+		if None in Shift_Columns:
+			Shift_Columns = [Find_Column(Header, "{} Shift (pixels)".format(Axis_Name)) for Axis_Name in ["X", "Y", "Z"]]
+		if None in Shift_Columns:
+			IJ.log("No shift found in {}.".format(Alignment_File_Path))
+			return None
+		Unit = Get_Column_Unit(Header[Shift_Columns[0]])
+		Shifts = {}
+		Pixel_Sizes = None
+		for Row in Rows:
+			Shifts.setdefault(int(Row[Channel_2_Column]), []).append([float(Row[Column]) for Column in Shift_Columns])
+			if Unit == "pixels": # Shifts in pixels can only be averaged over images with the same calibration
+				Row_Pixel_Sizes = Get_Row_Pixel_Sizes(Header, Row)
+				if Row_Pixel_Sizes is None:
+					continue
+				if Pixel_Sizes is None:
+					Pixel_Sizes = Row_Pixel_Sizes
+				elif not Same_Pixel_Sizes(Pixel_Sizes, Row_Pixel_Sizes):
+					IJ.log("{} has shifts in pixels measured with different pixel sizes. They cannot be averaged.".format(Alignment_File_Path))
+					return None
+		if Unit == "pixels" and Pixel_Sizes is None:
+			IJ.log("{} has no pixel size. Its shifts in pixels are applied without checking the calibration of the images.".format(Alignment_File_Path))
+		for Channel, Channel_Shifts in Shifts.items():
+			Corrections[Channel] = {
+				"Unit": Unit,
+				"Shift": [sum([Shift[Axis] for Shift in Channel_Shifts]) / len(Channel_Shifts) for Axis in range(3)], # Mean over all measured images
+				"Pixel_Sizes": Pixel_Sizes,
+				}
+	for Channel, Correction in sorted(Corrections.items()):
+		Correction["Objective_Mag"] = Objective_Mag
+		Prolix_Message("Channel {} correction: {}".format(Channel, Correction))
+	return Corrections
+
+# Return the Pixel sizes of the first series in micrometers. Uncalibrated axes are 1
+def Get_Pixel_Sizes(Metadata):
+	Pixel_Sizes = []
+	for Physical_Size in [Metadata.getPixelsPhysicalSizeX(0), Metadata.getPixelsPhysicalSizeY(0), Metadata.getPixelsPhysicalSizeZ(0)]:
+		if Physical_Size is None:
+			Pixel_Sizes.append(1.0)
+		else:
+			Pixel_Sizes.append(Physical_Size.value(UNITS.MICROMETER).doubleValue())
+	return Pixel_Sizes
+
+# Convert a Correction in pixels of the image to correct
+# Return the Shift [X, Y, Z] in pixels and an AffineModel2D mapping the corrected pixels to the original pixels (None for translations)
+# Return None if the unit of the Correction is unknown
+def Get_Pixel_Correction(Correction, Pixel_Sizes):
+	if Correction["Unit"] == "pixels": # Shift models of uncalibrated images are in pixels
+		Factor = 1.0
+		Pixel_Sizes = [1.0, 1.0, 1.0]
+	elif Correction["Unit"] in Micrometer_Conversion_Factors:
+		Factor = Micrometer_Conversion_Factors[Correction["Unit"]]
+	else:
+		return None
+	Shift = [Correction["Shift"][Axis] * Factor / Pixel_Sizes[Axis] for Axis in range(3)]
+	if "Coefficients" not in Correction:
+		return Shift, None
+	# Shift(U, V) = C0 + C1*U + C2*V with U = X / Field_Width. The Channel position is X + Shift(U, V)
+	CX = [Coefficient * Factor for Coefficient in Correction["Coefficients"][0]]
+	CY = [Coefficient * Factor for Coefficient in Correction["Coefficients"][1]]
+	Field_Width = Correction["Field_Width"] * Factor
+	Field_Height = Correction["Field_Height"] * Factor
+	Affine_Model = AffineModel2D()
+	Affine_Model.set(
+		1 + CX[1] / Field_Width, # m00
+		CY[1] * Pixel_Sizes[0] / (Field_Width * Pixel_Sizes[1]), # m10
+		CX[2] * Pixel_Sizes[1] / (Field_Height * Pixel_Sizes[0]), # m01
+		1 + CY[2] / Field_Height, # m11
+		CX[0] / Pixel_Sizes[0], # m02
+		CY[0] / Pixel_Sizes[1], # m12
+		)
+	return Shift, Affine_Model
+
+# Return the corrected processor of a plane. Planes are read on demand with Read_Plane(Z) so only two planes are in memory
+def Correct_Plane(Read_Plane, Z, Nb_Slices, Shift, Affine_Model):
+	# Axial correction by linear interpolation between the two closest planes
+	Z_Source = min(max(Z + Shift[2], 0), Nb_Slices - 1)
+	Z_Low = int(Z_Source)
+	Weight = Z_Source - Z_Low
+	Processor = Read_Plane(Z_Low)
+	Bit_Depth = Processor.getBitDepth()
+	if Weight > 0 and Z_Low + 1 < Nb_Slices:
+		Processor = Processor.convertToFloat().duplicate()
+		Processor.multiply(1 - Weight)
+		Processor_High = Read_Plane(Z_Low + 1).convertToFloat().duplicate()
+		Processor_High.multiply(Weight)
+		Processor.copyBits(Processor_High, 0, 0, Blitter.ADD)
+	# Lateral correction. The corrected pixel P takes the value of the original pixel at P + Shift
+	Processor.setInterpolationMethod(ImageProcessor.BILINEAR)
+	if Affine_Model is not None:
+		Corrected = Processor.createProcessor(Processor.getWidth(), Processor.getHeight())
+		InverseTransformMapping(Affine_Model.createInverse()).mapInterpolated(Processor, Corrected) # The mapping applies the inverse of its model to each target pixel
+		Processor = Corrected
+	elif Shift[0] != 0 or Shift[1] != 0:
+		Processor.translate(-Shift[0], -Shift[1])
+	if Processor.getBitDepth() != Bit_Depth: # Back to the original type after the axial interpolation
+		if Bit_Depth == 8:
+			Processor = Processor.convertToByteProcessor(False)
+		elif Bit_Depth == 16:
+			Processor = Processor.convertToShortProcessor(False)
+	return Processor
+
+# Return the bytes of a Processor as written by Bio-Formats
+def Get_Plane_Bytes(Processor, Little_Endian):
+	Pixels = Processor.getPixels()
+	if Processor.getBitDepth() == 8:
+		return Pixels
+	elif Processor.getBitDepth() == 16:
+		return DataTools.shortsToBytes(Pixels, Little_Endian)
+	return DataTools.floatsToBytes(Pixels, Little_Endian)
+
+# Correct one file plane by plane and write it as OME-TIFF. Only the planes being corrected are held in memory
+# Return the Output_Path of the corrected file or None
+def Register_File(File_Path, Output_Path, Corrections, Reference_Channel):
+	Prolix_Message("Registering {}...".format(File_Path))
+	Reader = ImageProcessorReader()
+	Metadata = MetadataTools.createOMEXMLMetadata()
+	Reader.setMetadataStore(Metadata)
+	Writer = None
+	try:
+		Reader.setId(File_Path)
+		Reader.setSeries(0)
+		if Reader.getRGBChannelCount() > 1 or Reader.getPixelType() not in [FormatTools.UINT8, FormatTools.UINT16, FormatTools.FLOAT]: # Same types as ImageJ
+			IJ.log("Registration of {} skipped. Unsupported pixel type.".format(File_Path))
+			return None
+		Nb_Channels = Reader.getSizeC()
+		Nb_Slices = Reader.getSizeZ()
+		Little_Endian = Reader.isLittleEndian()
+		Pixel_Sizes = Get_Pixel_Sizes(Metadata)
+		if Reader.getSeriesCount() > 1: # Only the first series is registered and written
+			IJ.log("{} has {} series. Only the first series is registered.".format(File_Path, Reader.getSeriesCount()))
+			Metadata_Root = Metadata.getRoot()
+			for Series in range(Reader.getSeriesCount() - 1, 0, -1):
+				Metadata_Root.removeImage(Metadata_Root.getImage(Series))
+			Metadata.setRoot(Metadata_Root)
+		Pixel_Corrections = {}
+		for Channel in range(1, Nb_Channels + 1):
+			if Channel in Corrections and Channel != Reference_Channel:
+				Correction = Corrections[Channel]
+				if Correction["Unit"] == "pixels" and Correction["Pixel_Sizes"] is not None and not Same_Pixel_Sizes(Correction["Pixel_Sizes"], Pixel_Sizes, 3 if Nb_Slices > 1 else 2):
+					IJ.log("Registration of {} skipped. Its pixel size {} differs from the pixel size {} of the shifts in pixels.".format(File_Path, Pixel_Sizes, Correction["Pixel_Sizes"]))
+					return None
+				Pixel_Corrections[Channel] = Get_Pixel_Correction(Correction, Pixel_Sizes)
+				if Pixel_Corrections[Channel] is None:
+					IJ.log("Registration of {} skipped. Unknown unit {} for the correction of Channel {}.".format(File_Path, Correction["Unit"], Channel))
+					return None
+			else:
+				Pixel_Corrections[Channel] = ([0.0, 0.0, 0.0], None)
+		Writer = OMETiffWriter()
+		Writer.setMetadataRetrieve(Metadata)
+		Writer.setBigTiff(Reader.getImageCount() * Reader.getSizeX() * Reader.getSizeY() * FormatTools.getBytesPerPixel(Reader.getPixelType()) > Big_Tiff_Size_Limit)
+		Writer.setWriteSequentially(True)
+		Writer.setInterleaved(False)
+		Writer.setId(Output_Path)
+		# Planes are written in the order of the file
+		for Plane_Index in range(Reader.getImageCount()):
+			Z, C, T = Reader.getZCTCoords(Plane_Index)
+			Shift, Affine_Model = Pixel_Corrections[C + 1]
+			def Read_Plane(Plane_Z, C = C, T = T):
+				return Reader.openProcessors(Reader.getIndex(Plane_Z, C, T))[0]
+			if Shift == [0.0, 0.0, 0.0] and Affine_Model is None:
+				Processor = Read_Plane(Z)
+			else:
+				Processor = Correct_Plane(Read_Plane, Z, Nb_Slices, Shift, Affine_Model)
+			Writer.saveBytes(Plane_Index, Get_Plane_Bytes(Processor, Little_Endian))
+		IJ.log("Success registering {}.".format(File_Path))
+		return Output_Path
+	except Exception, Error:
+		IJ.log("Failed registering {}: {}".format(File_Path, Error))
+		return None
+	finally:
+		Reader.close()
+		if Writer is not None:
+			Writer.close()
+		if os.path.exists(Output_Path) and os.path.getsize(Output_Path) == 0: # Reserved by Reserve_Output_Paths but nothing written
+			os.remove(Output_Path)
+
+# Return the list of the Output_Path of each file of the Image_List
+# Paths are picked one after the other before the workers start and an empty file is created so two files with the same name do not get the same Output_Path
+def Reserve_Output_Paths(Image_List):
+	Output_Paths = []
+	for File_Path in Image_List:
+		Basename = os.path.basename(File_Path)
+		for Extension in Image_Valid_Extensions:
+			if Basename.lower().endswith(Extension):
+				Basename = Basename[:-len(Extension)]
+				break
+		Output_Path = Generate_Unique_Filepath(Output_Dir, Basename, "Registered", ".ome.tif")
+		open(Output_Path, "w").close()
+		Output_Paths.append(Output_Path)
+	return Output_Paths
+
+# Register one file in a worker of the pool
+class Registration_Task(Callable):
+	def __init__(self, File_Path, Output_Path, Corrections, Reference_Channel):
+		self.File_Path = File_Path
+		self.Output_Path = Output_Path
+		self.Corrections = Corrections
+		self.Reference_Channel = Reference_Channel
+	def call(self):
+		return Register_File(self.File_Path, self.Output_Path, self.Corrections, self.Reference_Channel)
+
+# Display the Registration Dialog. Return the Settings_User or exit if canceled
+def Display_Registration_Dialog():
+	Settings_Stored = Read_Preferences(Settings_Template)
+	Registration_Dialog = JDialog(None, "{} {}".format(Plugin_Name, Function_Name), True)
+	Registration_Panel = JPanel()
+	Registration_Panel.setLayout(GridBagLayout())
+	Constraints = GridBagConstraints()
+	Constraints.insets = Insets(2, 2, 2, 2)
+	Pos_X = 0
+	Pos_Y = 0
+
+	# Alignment File
+	Constraints.gridx = Pos_X
+	Constraints.gridy = Pos_Y
+	Constraints.anchor = GridBagConstraints.EAST
+	J_Label = JLabel("Alignment Result")
+	J_Label.setFont(Font("Arial", Font.BOLD, 12))
+	Registration_Panel.add(J_Label, Constraints)
+	Constraints.gridx = Pos_X + 1
+	Constraints.gridwidth = 2
+	Constraints.anchor = GridBagConstraints.CENTER
+	Alignment_File_User = JTextField(Settings_Stored[Function_Name + ".Alignment_File"], 40)
+	Alignment_File_User.setFont(Font("Arial", Font.PLAIN, 12))
+	Registration_Panel.add(Alignment_File_User, Constraints)
+	Constraints.gridx = Pos_X + 3
+	Constraints.gridwidth = 1
+	Browse_Button = JButton("Browse")
+	def On_Browse(Event):
+		Alignment_File_Path = Select_Alignment_File(Output_Dir)
+		if Alignment_File_Path is not None:
+			Alignment_File_User.setText(Alignment_File_Path)
+	Browse_Button.addActionListener(On_Browse)
+	Registration_Panel.add(Browse_Button, Constraints)
+
+	Pos_Y += 1
+
+	# Objective. Required when the alignment result has several objectives
+	Constraints.gridx = Pos_X
+	Constraints.gridy = Pos_Y
+	Constraints.anchor = GridBagConstraints.EAST
+	J_Label = JLabel("Objective")
+	J_Label.setFont(Font("Arial", Font.BOLD, 12))
+	Registration_Panel.add(J_Label, Constraints)
+	Constraints.gridx = Pos_X + 1
+	Constraints.anchor = GridBagConstraints.CENTER
+	Objective_Mag_User = JTextField(Settings_Stored[Function_Name + ".Objective_Mag"], 6)
+	Objective_Mag_User.setHorizontalAlignment(JTextField.CENTER)
+	Registration_Panel.add(Objective_Mag_User, Constraints)
+
+	Pos_Y += 1
+
+	# Correction Mode
+	Constraints.gridx = Pos_X
+	Constraints.gridy = Pos_Y
+	Constraints.anchor = GridBagConstraints.EAST
+	J_Label = JLabel("Correction")
+	J_Label.setFont(Font("Arial", Font.BOLD, 12))
+	Registration_Panel.add(J_Label, Constraints)
+	Correction_Group = ButtonGroup()
+	for i, Mode in enumerate(["Translation", "Affine"]):
+		Constraints.gridx = Pos_X + 1 + i
+		Constraints.anchor = GridBagConstraints.CENTER
+		Mode_Button = JRadioButton(Mode)
+		Mode_Button.setFont(Font("Arial", Font.PLAIN, 12))
+		Mode_Button.setSelected(Mode == Settings_Stored[Function_Name + ".Correction_Mode"])
+		Correction_Group.add(Mode_Button)
+		Registration_Panel.add(Mode_Button, Constraints)
+
+	Pos_Y += 1
+
+	# Reference Channel and Nb of Workers
+	Constraints.gridx = Pos_X
+	Constraints.gridy = Pos_Y
+	Constraints.anchor = GridBagConstraints.EAST
+	J_Label = JLabel("Reference Channel")
+	J_Label.setFont(Font("Arial", Font.BOLD, 12))
+	Registration_Panel.add(J_Label, Constraints)
+	Constraints.gridx = Pos_X + 1
+	Constraints.anchor = GridBagConstraints.CENTER
+	Reference_Channel_User = JTextField(str(Settings_Stored[Function_Name + ".Reference_Channel"]), 6)
+	Reference_Channel_User.setHorizontalAlignment(JTextField.CENTER)
+	Registration_Panel.add(Reference_Channel_User, Constraints)
+	Constraints.gridx = Pos_X + 2
+	Constraints.anchor = GridBagConstraints.EAST
+	J_Label = JLabel("Nb Workers")
+	J_Label.setFont(Font("Arial", Font.BOLD, 12))
+	Registration_Panel.add(J_Label, Constraints)
+	Constraints.gridx = Pos_X + 3
+	Constraints.anchor = GridBagConstraints.CENTER
+	Nb_Workers_User = JTextField(str(Settings_Stored[Function_Name + ".Nb_Workers"]), 6)
+	Nb_Workers_User.setHorizontalAlignment(JTextField.CENTER)
+	Registration_Panel.add(Nb_Workers_User, Constraints)
+
+	Pos_Y += 1
+
+	# Prolix Mode, Cancel and OK
+	Constraints.gridx = Pos_X
+	Constraints.gridy = Pos_Y
+	Constraints.anchor = GridBagConstraints.WEST
+	Prolix_Mode_User = JCheckBox("Prolix Mode")
+	Prolix_Mode_User.setFont(Font("Arial", Font.PLAIN, 12))
+	Prolix_Mode_User.setSelected(Settings_Stored[Function_Name + ".Prolix_Mode"])
+	Registration_Panel.add(Prolix_Mode_User, Constraints)
+	User_Click = []
+	def On_Click(Event):
+		User_Click.append(Event.getActionCommand())
+		Registration_Dialog.dispose()
+	Constraints.anchor = GridBagConstraints.CENTER
+	Constraints.gridx = Pos_X + 2
+	Cancel_Button = JButton("Cancel")
+	Cancel_Button.addActionListener(On_Click)
+	Registration_Panel.add(Cancel_Button, Constraints)
+	Constraints.gridx = Pos_X + 3
+	OK_Button = JButton("OK")
+	OK_Button.addActionListener(On_Click)
+	Registration_Panel.add(OK_Button, Constraints)
+	Registration_Dialog.getRootPane().setDefaultButton(OK_Button) # Preselect OK button
+
+	Registration_Dialog.add(Registration_Panel)
+	Registration_Dialog.pack()
+	Screen_Size = Toolkit.getDefaultToolkit().getScreenSize()
+	Registration_Dialog.setLocation(Screen_Size.width/2, 0)
+	Registration_Dialog.setVisible(True) # Modal. Returns when the Dialog is disposed
+
+	if User_Click != ["OK"]:
+		Message = "User canceled {}.".format(Function_Name)
+		IJ.log(Message)
+		sys.exit(Message)
+	Settings_User = {}
+	Settings_User[Function_Name + ".Alignment_File"] = str(Alignment_File_User.getText()).strip()
+	Settings_User[Function_Name + ".Objective_Mag"] = str(Objective_Mag_User.getText()).strip()
+	for Button in Correction_Group.getElements():
+		if Button.isSelected():
+			Settings_User[Function_Name + ".Correction_Mode"] = str(Button.getText())
+	try:
+		Settings_User[Function_Name + ".Reference_Channel"] = max(1, int(Reference_Channel_User.getText()))
+		Settings_User[Function_Name + ".Nb_Workers"] = max(1, int(Nb_Workers_User.getText()))
+	except ValueError:
+		Settings_User[Function_Name + ".Reference_Channel"] = Settings_Stored[Function_Name + ".Reference_Channel"]
+		Settings_User[Function_Name + ".Nb_Workers"] = Settings_Stored[Function_Name + ".Nb_Workers"]
+		IJ.log("Reference Channel and Nb Workers must be integers. Using {} and {}.".format(Settings_User[Function_Name + ".Reference_Channel"], Settings_User[Function_Name + ".Nb_Workers"]))
+	Settings_User[Function_Name + ".Prolix_Mode"] = Prolix_Mode_User.isSelected()
+	Save_Preferences(Settings_User)
+	return Settings_User
+
+# Write the Corrections applied per Channel
+def Save_Corrections(Corrections, Settings_Stored):
+	Output_Path = Generate_Unique_Filepath(Output_Dir, "{}_Corrections".format(Function_Name), "Applied", ".csv")
+	CSV_File = open(Output_Path, "w")
+	CSV_Writer = csv.writer(CSV_File, delimiter = ",", lineterminator = "\n")
+	CSV_Writer.writerow(["Alignment File", "Objective", "Reference Channel", "Channel", "Correction", "Unit", "X Shift", "Y Shift", "Z Shift"])
+	for Channel, Correction in sorted(Corrections.items()):
+		CSV_Writer.writerow([
+			Settings_Stored[Function_Name + ".Alignment_File"], Correction["Objective_Mag"], Settings_Stored[Function_Name + ".Reference_Channel"], Channel,
+			"Affine" if "Coefficients" in Correction else "Translation", Correction["Unit"],
+			round(Correction["Shift"][0], 4), round(Correction["Shift"][1], 4), round(Correction["Shift"][2], 4),
+			])
+	CSV_File.close()
+	return
+
+# We are done with functions... Getting to work now...
+Initialize_Preferences(Settings_Template, Reset_Preferences)
+Settings_Stored = Display_Registration_Dialog()
+Corrections = None
+if os.path.isfile(Settings_Stored[Function_Name + ".Alignment_File"]):
+	Corrections = Read_Corrections(Settings_Stored[Function_Name + ".Alignment_File"], Settings_Stored[Function_Name + ".Reference_Channel"], Settings_Stored[Function_Name + ".Correction_Mode"], Settings_Stored[Function_Name + ".Objective_Mag"])
+if not Corrections:
+	Message = "No correction found for Reference Channel {} in {}.".format(Settings_Stored[Function_Name + ".Reference_Channel"], Settings_Stored[Function_Name + ".Alignment_File"])
+	IJ.log(Message)
+	JOptionPane.showMessageDialog(None, Message, "{} {}".format(Plugin_Name, Function_Name), JOptionPane.INFORMATION_MESSAGE)
+	sys.exit(Message)
+Image_List = Scan_Folder(Select_Folder(Default_Path = User_Desktop_Path))
+if not os.path.exists(Output_Dir): os.makedirs(Output_Dir)
+Save_Corrections(Corrections, Settings_Stored)
+Output_Paths = Reserve_Output_Paths(Image_List)
+
+# Files are corrected in parallel. Each worker holds at most two planes so the memory does not depend on the file size
+Nb_Workers = min(Settings_Stored[Function_Name + ".Nb_Workers"], Runtime.getRuntime().availableProcessors())
+Worker_Pool = Executors.newFixedThreadPool(Nb_Workers)
+try:
+	Futures = Worker_Pool.invokeAll([Registration_Task(File_Path, Output_Path, Corrections, Settings_Stored[Function_Name + ".Reference_Channel"]) for File_Path, Output_Path in zip(Image_List, Output_Paths)])
+	Registered_Files = [Future.get() for Future in Futures]
+finally:
+	Worker_Pool.shutdown()
+Nb_Registered_Files = len([Output_Path for Output_Path in Registered_Files if Output_Path is not None])
+
+Message = "{} {} successful.\n{}/{} images have been registered.\n Files are saved in {}".format(Plugin_Name, Function_Name, Nb_Registered_Files, len(Image_List), Output_Dir)
+IJ.log(Message)
+JOptionPane.showMessageDialog(None, Message, "{} {}".format(Plugin_Name, Function_Name), JOptionPane.INFORMATION_MESSAGE)
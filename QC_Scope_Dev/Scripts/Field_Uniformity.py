@@ -4,32 +4,37 @@
 import os
 import sys
 import csv
+import json
 from math import sqrt, floor
 
 
 # Import ImageJ Features
-from ij import IJ, ImagePlus, Prefs, WindowManager
+from ij import IJ, ImagePlus, ImageStack, CompositeImage, Prefs, WindowManager
+from ij.io import TiffDecoder, FileInfo
 from ij.gui import Overlay, TextRoi
 from ij.plugin import Duplicator, Zoom
 from ij.measure import Measurements, ResultsTable
 from ij.plugin.frame import RoiManager
 from ij.plugin.filter import GaussianBlur
-from ij.process import ImageProcessor, FloatProcessor, ByteProcessor, ImageStatistics, ImageConverter
+from ij.process import ImageProcessor, FloatProcessor, ByteProcessor, ShortProcessor, ImageStatistics, ImageConverter
 
 
 # Import Bioformat Features
-from loci.plugins import BF
-from loci.plugins.in import ImporterOptions
+from loci.plugins.in import ImporterOptions, ImportProcess, ImagePlusReader
 from loci.formats import MetadataTools, ImageReader
+from ome.units import UNITS
 
 
 # Import Java Features
-from java.io import File
+from java.io import File, RandomAccessFile
+from java.nio import ByteOrder
+from java.nio.channels import FileChannel
+from jarray import zeros
 from java.awt import Font, Color, GridLayout, GridBagLayout, GridBagConstraints, Insets, Frame, Panel, Button, Label, Toolkit
 from javax.swing import JOptionPane, JFileChooser, JTextField, JLabel, JSeparator, JRadioButton, ButtonGroup, JSlider,JButton, JCheckBox, JPanel, JFrame, SwingUtilities, JDialog
 from java.awt.event import ActionListener
 from javax.swing.event import ChangeListener, DocumentListener
-import java.lang.System
+from java.util.concurrent import Callable, Executors
 
 # -*- coding: utf-8 -*-
 reload(sys)
@@ -44,9 +49,20 @@ Unicode_Micron_Symbol = "u" #chr(0xB5)
 Reset_Preferences = False # useful to reset Preferences with the template
 User_Desktop_Path = os.path.join(os.path.expanduser("~"), "Desktop") # Used for Saving the Output DIrectory and as a default for selecting an input directory
 Output_Dir = os.path.join(User_Desktop_Path, "Output") # Where all files are saved
+Bioformats_Sessions = {} # imp ID -> {"Reader": Reader kept open for virtual stacks or None, "Metadata": OME Metadata}
+Resource_Scope = {"Images": [], "Memory_Start": 0} # Temporary images of the image being processed. Released by Close_Resource_Scope
+Metadata_Index_Path = os.path.join(Output_Dir, "{}_Metadata-Index.jsonl".format(Plugin_Name)) # Metadata of the input files shared by the QC Scope scripts
+Folder_Index_Path = os.path.join(Output_Dir, "{}_Folder-Index.json".format(Plugin_Name)) # Directory listings of the scanned folders shared by the QC Scope scripts
+Metadata_Index = None # File Path -> Index entry. Loaded by Get_Metadata_Index
+Resolution_Levels = {} # File Path -> Resolution levels of each series. Filled by Get_Resolution_Levels
 
 # Tuple (List) of supported image file extensions. When an input folder is selected only images with these extensions are selected
 Image_Valid_Extensions = (".tif", ".tiff", ".jpg", ".jpeg", ".png", ".czi", ".nd2", ".lif", ".lsm", ".ome.tif", ".ome.tiff")
+Image_Container_Extensions = (".czi", ".nd2", ".lif", ".ome.tif", ".ome.tiff") # Files that can store several series
+Prefetch_Heap_Factor = 3.0 # An image is prefetched if the free memory holds this many times its file size
+Image_Valid_Extension_Set = frozenset([Extension for Extension in Image_Valid_Extensions if Extension.count(".") == 1]) # .ome.tif files end with .tif
+Scan_Threads = 8 # Directories listed in parallel by Scan_Folder
+Image_Tiff_Extensions = (".tif", ".tiff") # Files tried with Open_Image_Tiff before Bioformats
 
 # Dictionary providing Space units and conversion to a standard
 Space_Unit_Conversion_Dictionary = {
@@ -85,6 +101,9 @@ Settings_Template = {
 	Function_Name + ".Binning_Method": "Iso-Density",
 	Function_Name + ".Batch_Mode": True,
 	Function_Name + ".Save_Individual_Files": False,
+	Function_Name + ".Low_Memory_Import": False,
+	Function_Name + ".Prefetch_Depth": 1,
+	Function_Name + ".Min_Pixel_Count": 4000000,
 	Function_Name + ".Prolix_Mode": False,
 	Function_Name + ".Objective_Mag": "5x",
 	Function_Name + ".Objective_NA": 1.0,
@@ -169,13 +188,9 @@ def Get_Images():
 		while not Image_List:
 			Input_Dir_Path = Select_Folder(Default_Path = User_Desktop_Path)
 			Prolix_Message("Selected Folder {}.".format(Input_Dir_Path))
-			for Root, Dirs, Files in os.walk(Input_Dir_Path): # Get Files Recursively
-			# Files = os.listdir(Input_Dir_Path): # Comment the line above and uncomment this line if you don"t want to get files recurcively
-				for File in Files:
-					if File.lower().endswith(tuple(Image_Valid_Extensions)): # Select only files ending with a Image_Valid_extensions
-						Image_List.append(str(os.path.join(Root, File)))
-						Prolix_Message("Success adding {}.".format(os.path.join(Root, File)))
-			Image_List.sort()
+			Image_List = Scan_Folder(Input_Dir_Path) # Get Files Recursively
+			Prolix_Message("Success adding {} files.".format(len(Image_List)))
+			Image_List = Expand_Series(Image_List)
 			if not Image_List:
 				Message = "Failed No valid image files found in the selected folder."
 				Advice = "Valid image file extensions are: " + ", ".join(Image_Valid_Extensions)
@@ -201,23 +216,458 @@ def Select_Folder(Default_Path):
 		sys.exit(Message)
 	return InputDir_Path
 
-# Open an image using Bioformat
-def Open_Image_Bioformats(File_Path):
+# Return the sorted list of the image files in Input_Dir_Path and its subdirectories
+# Directories are listed in parallel one depth at a time. Listings are kept in the Folder Index and a directory is only listed again when its mtime changed
+def Scan_Folder(Input_Dir_Path):
+	Folder_Index = Read_Folder_Index()
+	Scanned_Index = {}
+	Image_List = []
+	Executor = Executors.newFixedThreadPool(Scan_Threads)
+	try:
+		Directories = [Input_Dir_Path]
+		while Directories:
+			Futures = [Executor.submit(Directory_Lister(Directory, Folder_Index.get(Directory))) for Directory in Directories]
+			Directories = []
+			for Future in Futures:
+				Listing = Future.get()
+				if Listing is None:
+					continue
+				Scanned_Index[Listing["Path"]] = Listing
+				Image_List.extend([str(os.path.join(Listing["Path"], Name)) for Name in Listing["Files"]])
+				Directories.extend([os.path.join(Listing["Path"], Directory) for Directory in Listing["Dirs"]])
+	finally:
+		Executor.shutdown()
+	# Directories removed from the scanned folder are dropped from the Folder Index
+	for Directory in Folder_Index.keys():
+		if (Directory == Input_Dir_Path or Directory.startswith(os.path.join(Input_Dir_Path, ""))) and Directory not in Scanned_Index:
+			del Folder_Index[Directory]
+	Folder_Index.update(Scanned_Index)
+	Write_Folder_Index(Folder_Index)
+	Image_List.sort()
+	return Image_List
+
+# List a Directory on the Scan_Folder threads
+class Directory_Lister(Callable):
+	def __init__(self, Directory, Cached_Listing):
+		self.Directory = Directory
+		self.Cached_Listing = Cached_Listing
+	def call(self):
+		return List_Directory(self.Directory, self.Cached_Listing)
+
+# Return the Listing {"Path", "Mtime", "Files", "Dirs"} of the image files and subdirectories of Directory. None if it cannot be read
+# The Cached_Listing is returned if the Directory did not change. Only entries without an image extension are checked for being a directory
+def List_Directory(Directory, Cached_Listing):
+	try:
+		Mtime = os.path.getmtime(Directory)
+		if Cached_Listing is not None and Cached_Listing["Mtime"] == Mtime:
+			return Cached_Listing
+		Files = []
+		Dirs = []
+		for Name in os.listdir(Directory):
+			if os.path.splitext(Name)[1].lower() in Image_Valid_Extension_Set:
+				Files.append(Name)
+			else:
+				Path = os.path.join(Directory, Name)
+				if os.path.isdir(Path) and not os.path.islink(Path): # Links are not followed
+					Dirs.append(Name)
+		return {"Path": Directory, "Mtime": Mtime, "Files": Files, "Dirs": Dirs}
+	except Exception, Error:
+		IJ.log("Failed listing {}: {}".format(Directory, Error))
+		return None
+
+# Return the Folder Index a dictionnary Directory -> Listing (see List_Directory)
+def Read_Folder_Index():
+	if not os.path.exists(Folder_Index_Path):
+		return {}
+	Index_File = open(Folder_Index_Path, "r")
+	try:
+		return json.load(Index_File)
+	except ValueError: # File partially written by an interrupted run
+		return {}
+	finally:
+		Index_File.close()
+
+def Write_Folder_Index(Folder_Index):
+	if not os.path.exists(Output_Dir):
+		os.makedirs(Output_Dir)
+	Index_File = open(Folder_Index_Path, "w")
+	json.dump(Folder_Index, Index_File)
+	Index_File.close()
+	return
+
+# Return the Image_List where each container file with several series is replaced by one File_Path#Series per series
+# Series are counted from the metadata of the file. No pixels are read. Resolution levels of a series are not counted as series
+def Expand_Series(Image_List):
+	Series_List = []
+	for File_Path in Image_List:
+		Nb_Series = 1
+		if File_Path.lower().endswith(Image_Container_Extensions):
+			Nb_Series = len(Get_Resolution_Levels(File_Path))
+		if Nb_Series == 1:
+			Series_List.append(File_Path)
+		else:
+			Prolix_Message("Found {} series in {}.".format(Nb_Series, File_Path))
+			for Series in range(Nb_Series):
+				Series_List.append(Join_Series_Path(File_Path, Series))
+	return Series_List
+
+# Return the resolution levels of each series of File_Path as a list of {"Levels", "Pixel_Width", "Pixel_Height"}
+# Levels are {"Index", "Width", "Height"} from the full resolution to the smallest. Index is the series index of the level for the importer
+# Pyramidal files store downsampled levels that the importer lists as series of their own. Pixel sizes are the ones of the full resolution in micron
+# Levels of unchanged files are read from the Metadata Index without parsing the file
+def Get_Resolution_Levels(File_Path):
+	if File_Path not in Resolution_Levels:
+		File_Size = os.path.getsize(File_Path)
+		File_Mtime = os.path.getmtime(File_Path)
+		Index_Entry = Get_Metadata_Index().get(File_Path)
+		if Index_Entry is not None and Index_Entry["Size"] == File_Size and Index_Entry["Mtime"] == File_Mtime and "Resolution_Levels" in Index_Entry:
+			Resolution_Levels[File_Path] = Index_Entry["Resolution_Levels"]
+			return Resolution_Levels[File_Path]
+		Series_Levels = []
+		Metadata = MetadataTools.createOMEXMLMetadata()
+		Reader = ImageReader()
+		Reader.setFlattenedResolutions(False)
+		Reader.setMetadataStore(Metadata)
+		try:
+			Reader.setId(File_Path)
+			for Series in range(Reader.getSeriesCount()):
+				Reader.setSeries(Series)
+				Levels = []
+				for Resolution in range(Reader.getResolutionCount()):
+					Reader.setResolution(Resolution)
+					Levels.append({"Index": Reader.getCoreIndex(), "Width": Reader.getSizeX(), "Height": Reader.getSizeY()})
+				Pixel_Width = Metadata.getPixelsPhysicalSizeX(Series)
+				Pixel_Height = Metadata.getPixelsPhysicalSizeY(Series)
+				Series_Levels.append({
+					"Levels": Levels,
+					"Pixel_Width": float(Pixel_Width.value(UNITS.MICROMETER)) if Pixel_Width is not None else None,
+					"Pixel_Height": float(Pixel_Height.value(UNITS.MICROMETER)) if Pixel_Height is not None else None,
+					})
+		except Exception, Error:
+			IJ.log("Failed reading the series of {}: {}. Proceeding with the first series only.".format(File_Path, Error))
+			Series_Levels = []
+		finally:
+			Reader.close()
+		if Series_Levels:
+			Add_Metadata_Index_Entry({"Path": File_Path, "Size": File_Size, "Mtime": File_Mtime, "Resolution_Levels": Series_Levels})
+		else:
+			Series_Levels = [{"Levels": [{"Index": 0, "Width": None, "Height": None}], "Pixel_Width": None, "Pixel_Height": None}]
+		Resolution_Levels[File_Path] = Series_Levels
+	return Resolution_Levels[File_Path]
+
+# Series are numbered from 1 in the File_Path#Series names and from 0 in Bioformats
+def Join_Series_Path(File_Path, Series):
+	return "{}#{}".format(File_Path, Series + 1)
+
+# Return File_Path and Series (0 based) of File_Path#Series. Series is None for a plain File_Path
+def Split_Series_Path(Image_File):
+	if "#" in Image_File:
+		File_Path, Series_Label = Image_File.rsplit("#", 1)
+		if Series_Label.isdigit() and os.path.isfile(File_Path):
+			return File_Path, int(Series_Label) - 1
+	return Image_File, None
+
+# Open an image using Bioformat. Series (0 based) selects one series of a container file. Otherwise the first series is opened
+# Plane (Z, T) (0 based) reads only this plane of each channel. Otherwise the whole hyperstack is read
+# Min_Pixel_Count reads the smallest resolution level of a pyramidal file with at least this many pixels per plane. Otherwise the full resolution is read
+def Open_Image_Bioformats(File_Path, Virtual = False, Series = None, Plane = None, Min_Pixel_Count = None):
 	Prolix_Message("Importing {} with Bioformats...".format(File_Path))
 	Bioformat_Options = ImporterOptions()
 	Bioformat_Options.setId(File_Path)
+	Image_Index = 0
+	Series_Levels = None
+	Level = None
+	if Series is not None or (Min_Pixel_Count and File_Path.lower().endswith(Image_Container_Extensions)):
+		Series_Levels = Get_Resolution_Levels(File_Path)[Series if Series is not None else 0]
+		Level = Select_Resolution_Level(Series_Levels["Levels"], Min_Pixel_Count)
+		Image_Index = Level["Index"]
+	if Image_Index != 0 or Series is not None: # Only the pixels of this series and level are read
+		Bioformat_Options.clearSeries()
+		Bioformat_Options.setSeriesOn(Image_Index, True)
+	if Plane is not None: # Only the planes at these indices are read from the file
+		Z, T = Plane
+		Bioformat_Options.setSpecifyRanges(True)
+		Bioformat_Options.setZBegin(Image_Index, Z)
+		Bioformat_Options.setZEnd(Image_Index, Z)
+		Bioformat_Options.setTBegin(Image_Index, T)
+		Bioformat_Options.setTEnd(Image_Index, T)
+	Bioformat_Options.setVirtual(Virtual) # Planes are read on demand
 	try:
-		imps = BF.openImagePlus(Bioformat_Options)
+		# The file is parsed once. The session keeps its OME metadata for Get_Image_Metadata
+		Import_Process = ImportProcess(Bioformat_Options)
+		if not Import_Process.execute():
+			IJ.log("Failed importation with Bioformats: Import canceled for {}".format(File_Path))
+			return
+		imps = ImagePlusReader(Import_Process).openImagePlus()
+		Reader = Import_Process.getReader()
+		if not Virtual: # Virtual stacks read their planes from the Reader until the image is closed
+			Reader.close()
+			Reader = None
 		if imps and len(imps) > 0:
+			if Level is not None and Level is not Series_Levels["Levels"][0]:
+				Scale_Calibration(imps[0], Series_Levels, Level)
+			# The metadata of the series is read from its full resolution
+			Bioformats_Sessions[imps[0].getID()] = {"Reader": Reader, "Metadata": Import_Process.getOMEMetadata(), "Series": Series, "Image_Index": Series_Levels["Levels"][0]["Index"] if Series_Levels is not None else 0}
 			Prolix_Message("Success Importing {} with Bioformats.".format(File_Path))
 			return imps[0]
 		else:
+			if Reader is not None:
+				Reader.close()
 			IJ.log("Failed importation with Bioformats: No Images found in {}".format(File_Path))
 			return
 	except Exception, Error:
 		IJ.log("Failed Importation with Bioformats: Error opening {}".format(Error))
 		return
 
+# Return the smallest of the Levels with at least Min_Pixel_Count pixels. The full resolution if no Min_Pixel_Count
+def Select_Resolution_Level(Levels, Min_Pixel_Count):
+	Selected_Level = Levels[0]
+	if Min_Pixel_Count:
+		for Level in Levels[1:]:
+			if Level["Width"] * Level["Height"] >= Min_Pixel_Count and Level["Width"] * Level["Height"] < Selected_Level["Width"] * Selected_Level["Height"]:
+				Selected_Level = Level
+	return Selected_Level
+
+# Set the calibration of an image read at a lower resolution Level from the pixel size of the full resolution
+def Scale_Calibration(imp, Series_Levels, Level):
+	Full_Level = Series_Levels["Levels"][0]
+	Prolix_Message("Reading {} at {}x{} instead of {}x{}.".format(imp.getTitle(), Level["Width"], Level["Height"], Full_Level["Width"], Full_Level["Height"]))
+	if Series_Levels["Pixel_Width"] is None or Series_Levels["Pixel_Height"] is None:
+		IJ.log("{} has no pixel size in its metadata. The calibration is not scaled to the resolution level.".format(imp.getTitle()))
+		return
+	Calibration = imp.getCalibration()
+	Calibration.pixelWidth = Series_Levels["Pixel_Width"] * Full_Level["Width"] / float(Level["Width"])
+	Calibration.pixelHeight = Series_Levels["Pixel_Height"] * Full_Level["Height"] / float(Level["Height"])
+	Calibration.setUnit("micron")
+	return
+
+# Open an uncompressed 16-bit TIFF written by ImageJ or the camera software by mapping its planes in memory
+# Plane (Z, T) (0 based) reads only this plane of each channel. Otherwise the whole hyperstack is read
+# Each plane is copied once from the mapped file into its ShortProcessor. Return None if the file must be read with Bioformats
+def Open_Image_Tiff(File_Path, Plane = None):
+	if ".ome." in os.path.basename(File_Path).lower(): # The OME-XML sets the dimensions of OME-TIFF files
+		return None
+	try:
+		File_Infos = TiffDecoder(os.path.dirname(File_Path), os.path.basename(File_Path)).getTiffInfo()
+	except Exception, Error:
+		Prolix_Message("Failed reading the TIFF header of {}: {}".format(File_Path, Error))
+		return None
+	if not File_Infos:
+		return None
+	First_Info = File_Infos[0]
+	for File_Info in File_Infos:
+		if File_Info.compression != FileInfo.COMPRESSION_NONE or File_Info.fileType != FileInfo.GRAY16_UNSIGNED:
+			return None
+		if File_Info.width != First_Info.width or File_Info.height != First_Info.height or not Is_Contiguous_Plane(File_Info):
+			return None
+	Width = First_Info.width
+	Height = First_Info.height
+	Plane_Size = Width * Height * 2
+	# ImageJ stacks have one header followed by all the planes. Other files have one header per plane
+	if len(File_Infos) == 1:
+		Plane_Offsets = [First_Info.getOffset() + Plane_Index * (Plane_Size + First_Info.gapBetweenImages) for Plane_Index in range(max(1, First_Info.nImages))]
+	else:
+		Plane_Offsets = [File_Info.getOffset() for File_Info in File_Infos]
+	Description = Parse_Tiff_Description(First_Info.description)
+	Nb_Channels = int(Description.get("channels", 1))
+	Nb_Slices = int(Description.get("slices", 1))
+	Nb_Frames = int(Description.get("frames", 1))
+	if Nb_Channels * Nb_Slices * Nb_Frames != len(Plane_Offsets):
+		if "channels" in Description or "slices" in Description or "frames" in Description:
+			return None
+		Nb_Slices = len(Plane_Offsets)
+	if Plane is not None:
+		Z, T = Plane
+		if Z >= Nb_Slices or T >= Nb_Frames:
+			return None
+		Plane_Offsets = Plane_Offsets[(T * Nb_Slices + Z) * Nb_Channels:(T * Nb_Slices + Z + 1) * Nb_Channels] # Planes are stored in the CZT order
+		Nb_Slices = 1
+		Nb_Frames = 1
+	Prolix_Message("Mapping {} planes of {}...".format(len(Plane_Offsets), File_Path))
+	Stack = ImageStack(Width, Height)
+	Access_File = RandomAccessFile(File_Path, "r")
+	try:
+		File_Channel = Access_File.getChannel()
+		if Plane_Offsets[-1] + Plane_Size > File_Channel.size():
+			return None
+		for Plane_Offset in Plane_Offsets:
+			Buffer = File_Channel.map(FileChannel.MapMode.READ_ONLY, Plane_Offset, Plane_Size)
+			Buffer.order(ByteOrder.LITTLE_ENDIAN if First_Info.intelByteOrder else ByteOrder.BIG_ENDIAN)
+			Pixels = zeros(Width * Height, "h")
+			Buffer.asShortBuffer().get(Pixels)
+			Stack.addSlice(ShortProcessor(Width, Height, Pixels, None))
+	except Exception, Error:
+		IJ.log("Failed mapping {}: {}. Proceeding with Bioformats.".format(File_Path, Error))
+		return None
+	finally:
+		Access_File.close()
+	imp = ImagePlus(os.path.basename(File_Path), Stack)
+	imp.setDimensions(Nb_Channels, Nb_Slices, Nb_Frames)
+	imp.setOpenAsHyperStack(True)
+	if Nb_Channels > 1:
+		imp = CompositeImage(imp, IJ.COLOR)
+	Calibration = imp.getCalibration()
+	if First_Info.unit:
+		Calibration.setUnit(First_Info.unit)
+		Calibration.pixelWidth = First_Info.pixelWidth
+		Calibration.pixelHeight = First_Info.pixelHeight
+	if "unit" in Description:
+		Calibration.setUnit(Description["unit"].replace("\\u00B5", u"\u00B5"))
+	if "spacing" in Description:
+		Calibration.pixelDepth = float(Description["spacing"])
+	if "finterval" in Description:
+		Calibration.frameInterval = float(Description["finterval"])
+	imp.setFileInfo(First_Info) # Get_Image_Info gets the path of the file from it
+	Prolix_Message("Success opening {} from the mapped file.".format(File_Path))
+	return imp
+
+# Return True if the strips of the plane follow each other in the file
+def Is_Contiguous_Plane(File_Info):
+	if File_Info.stripOffsets is None or len(File_Info.stripOffsets) < 2:
+		return True
+	for Strip in range(1, len(File_Info.stripOffsets)):
+		if File_Info.stripOffsets[Strip] != File_Info.stripOffsets[Strip - 1] + File_Info.stripLengths[Strip - 1]:
+			return False
+	return True
+
+# Return the key=value pairs of the description ImageJ writes in its TIFF files
+def Parse_Tiff_Description(Description):
+	Properties = {}
+	if Description and Description.startswith("ImageJ"):
+		for Line in Description.split("\n"):
+			if "=" in Line:
+				Key, Value = Line.split("=", 1)
+				Properties[Key.strip()] = Value.strip()
+	return Properties
+
+# Return the OME metadata of the image. Imported images reuse their session. Other images are parsed once and cached
+def Get_OME_Metadata(imp, File_Path):
+	Session = Bioformats_Sessions.get(imp.getID())
+	if Session is None:
+		Metadata = MetadataTools.createOMEXMLMetadata()
+		Reader = ImageReader()
+		Reader.setMetadataStore(Metadata)
+		try:
+			Reader.setId(File_Path)
+		finally:
+			Reader.close()
+		Session = {"Reader": None, "Metadata": Metadata, "Series": None, "Image_Index": 0}
+		Bioformats_Sessions[imp.getID()] = Session
+	return Session["Metadata"]
+
+# Close the Bio-Formats session of the image once it is done
+def Close_Bioformats_Session(imp):
+	Session = Bioformats_Sessions.pop(imp.getID(), None)
+	if Session is not None and Session["Reader"] is not None:
+		Session["Reader"].close()
+	return
+
+# Open Image_File (File_Path or File_Path#Series) with Bioformats and the import settings
+def Open_Image_File(Image_File):
+	Settings_Stored = Read_Preferences(Settings_Template)
+	File_Path, Series = Split_Series_Path(Image_File) # Each series of a container file is opened on its own
+	# Low Memory Import keeps only the plane being measured resident
+	# The uniformity is measured on the first plane of each channel so the other slices and frames are not read
+	# It is a low frequency measurement so pyramidal files are read at the smallest level with Min_Pixel_Count pixels
+	if Series is None and not Settings_Stored[Function_Name+".Low_Memory_Import"] and File_Path.lower().endswith(Image_Tiff_Extensions):
+		imp = Open_Image_Tiff(File_Path, Plane = (0, 0))
+		if imp is not None:
+			return imp
+	return Open_Image_Bioformats(File_Path, Virtual = Settings_Stored[Function_Name+".Low_Memory_Import"], Series = Series, Plane = (0, 0), Min_Pixel_Count = Settings_Stored[Function_Name+".Min_Pixel_Count"])
+
+# Open an Image_File on the Prefetch thread
+class Image_Loader(Callable):
+	def __init__(self, Image_File):
+		self.Image_File = Image_File
+	def call(self):
+		return Open_Image_File(self.Image_File)
+
+# Open the images following Image in the background while Image is processed
+# Up to Prefetch_Depth images are opened ahead and only if the free memory can hold them
+def Prefetch_Images(Prefetch, Image_List, Image):
+	Prefetch_Depth = int(Read_Preferences(Settings_Template)[Function_Name+".Prefetch_Depth"])
+	Reserved_Memory = sum([Prefetched["Size"] for Prefetched in Prefetch["Images"].values() if not Prefetched["Future"].isDone()])
+	for Next_Image in range(Image + 1, min(Image + 1 + Prefetch_Depth, len(Image_List))):
+		if Next_Image in Prefetch["Images"]:
+			continue
+		Image_File = Image_List[Next_Image]
+		File_Path, Series = Split_Series_Path(Image_File)
+		if not os.path.isfile(File_Path): # Opened images are not prefetched
+			return
+		Size = os.path.getsize(File_Path) * Prefetch_Heap_Factor
+		if Reserved_Memory + Size > IJ.maxMemory() - IJ.currentMemory():
+			Prolix_Message("Not enough free memory to prefetch {}. It is opened when processed.".format(Image_File))
+			return
+		if Prefetch["Executor"] is None:
+			Prefetch["Executor"] = Executors.newSingleThreadExecutor()
+		Prolix_Message("Prefetching {}...".format(Image_File))
+		Prefetch["Images"][Next_Image] = {"Future": Prefetch["Executor"].submit(Image_Loader(Image_File)), "Size": Size}
+		Reserved_Memory += Size
+	return
+
+# Return the image Image. Wait for it if it is prefetched. Otherwise open it now
+def Get_Prefetched_Image(Prefetch, Image, Image_File):
+	Prefetched = Prefetch["Images"].pop(Image, None)
+	if Prefetched is None:
+		return Open_Image_File(Image_File)
+	Prolix_Message("Getting prefetched {}...".format(Image_File))
+	return Prefetched["Future"].get()
+
+# Stop the Prefetch thread and close the images opened ahead that were not processed
+def Stop_Prefetch(Prefetch):
+	for Prefetched in Prefetch["Images"].values():
+		if Prefetched["Future"].cancel(False):
+			continue
+		try:
+			imp = Prefetched["Future"].get()
+		except Exception, Error:
+			IJ.log("Failed prefetching an image: {}".format(Error))
+			continue
+		if imp is not None:
+			imp.close()
+			Close_Bioformats_Session(imp)
+	Prefetch["Images"].clear()
+	if Prefetch["Executor"] is not None:
+		Prefetch["Executor"].shutdown()
+		Prefetch["Executor"] = None
+	return
+
+# Start tracking the temporary images created while processing imp
+def Open_Resource_Scope(imp):
+	Resource_Scope["Images"] = []
+	Resource_Scope["Memory_Start"] = IJ.currentMemory()
+	return
+
+# Register a temporary image so it is released at the end of the image being processed. Return the image
+def Track_Image(Temporary_imp):
+	Resource_Scope["Images"].append(Temporary_imp)
+	return Temporary_imp
+
+# Close a temporary image as soon as it is not needed and stop tracking it
+def Release_Image(Temporary_imp):
+	Temporary_imp.changes = False
+	Temporary_imp.close()
+	Temporary_imp.flush() # Release the pixels even if the image is still referenced
+	if Temporary_imp in Resource_Scope["Images"]:
+		Resource_Scope["Images"].remove(Temporary_imp)
+	return
+
+# Release the temporary images left and the Bio-Formats session of imp. Close imp if it was opened from a folder
+# Log the memory used before and after the image so a leak shows up at the image that causes it
+def Close_Resource_Scope(imp, Close_Image):
+	Image_Name = imp.getTitle()
+	Nb_Images = len(Resource_Scope["Images"])
+	for Temporary_imp in list(Resource_Scope["Images"]):
+		Release_Image(Temporary_imp)
+	if Close_Image:
+		Prolix_Message("Closing {}".format(Image_Name))
+		imp.changes = False
+		imp.close()
+		imp.flush()
+	Close_Bioformats_Session(imp)
+	IJ.log("Memory for {}: {} MB before, {} MB after. {} temporary images were left open.".format(Image_Name, Resource_Scope["Memory_Start"] / 1048576, IJ.currentMemory() / 1048576, Nb_Images))
+	return
+
 # Generate a Unique filepath Directory\Basename_Suffix-001.Extension
 def Generate_Unique_Filepath(Directory, Basename, Suffix, Extension):
 	Prolix_Message("Generating Unique Filepath {}...".format(Basename))
@@ -267,6 +717,13 @@ def Get_Image_Info(imp):
 			Input_File_Path = os.path.join(Input_Dir, Filename)
 			Prolix_Message("Filename: {}, Input Dir: {}, Path: {}".format(Filename, Input_Dir, Input_File_Path))
 	Basename, Extension = os.path.splitext(Filename)
+	# Series of container files are named File#Series
+	Session = Bioformats_Sessions.get(imp.getID())
+	Series = Session.get("Series") if Session is not None else None
+	Image_Index = Session.get("Image_Index", 0) if Session is not None else 0 # Index of the series in the file metadata
+	if Series is not None:
+		Filename = Join_Series_Path(Filename, Series)
+		Basename = Join_Series_Path(Basename, Series)
 	Width = imp.getWidth()
 	Height = imp.getHeight()
 	Nb_Channels = imp.getNChannels()
@@ -290,6 +747,8 @@ def Get_Image_Info(imp):
 	# Dictionnary storing all image information
 	Image_Info = {
 		"Input_File_Path": str(Input_File_Path),
+		"Series": Series,
+		"Image_Index": Image_Index,
 		"Input_Dir": str(Input_Dir),
 		"Filename": str(Filename),
 		"Basename": str(Basename),
@@ -333,27 +792,36 @@ def Get_Image_Metadata(imp):
 	if Image_Info["Input_File_Path"] == "N/A":
 		IJ.log("{} {} can only get metadata from images written on the disk. {} is virtual. Proceeding with information from Preferences...". format(Plugin_Name, Function_Name, Image_Name))
 		return None
-	Bioformat_Options = ImporterOptions()
-	Bioformat_Options.setId(Image_Info["Input_File_Path"])
-	Metadata = MetadataTools.createOMEXMLMetadata()
-	Reader = ImageReader()
-	Reader.setMetadataStore(Metadata)
-	Reader.setId(Image_Info["Input_File_Path"])
-	if Metadata.getImageCount() == 0:
+	# Unchanged files are read from the Metadata Index without parsing the file
+	File_Path = Image_Info["Input_File_Path"]
+	File_Size = os.path.getsize(File_Path)
+	File_Mtime = os.path.getmtime(File_Path)
+	Image_Index = Image_Info["Image_Index"]
+	Index_Path = File_Path if Image_Info["Series"] is None else Join_Series_Path(File_Path, Image_Info["Series"])
+	Index_Entry = Get_Metadata_Index().get(Index_Path)
+	if Index_Entry is not None and Index_Entry["Size"] == File_Size and Index_Entry["Mtime"] == File_Mtime and "Image_Metadata" in Index_Entry:
+		Prolix_Message("Metadata for {} found in the Metadata Index.".format(Image_Name))
+		Image_Metadata = Load_Indexed_Metadata(Index_Entry["Image_Metadata"])
+		if Image_Metadata is None:
+			IJ.log("{} does not contain metadata. Proceeding with information from Preferences...".format(Image_Name))
+		return Image_Metadata
+	Metadata = Get_OME_Metadata(imp, File_Path)
+	if Metadata.getImageCount() <= Image_Index:
 		IJ.log("{} does not contain metadata. Proceeding with information from Preferences...".format(Image_Name))
+		Add_Metadata_Index_Entry({"Path": Index_Path, "Size": File_Size, "Mtime": File_Mtime, "Image_Metadata": None})
 		return None
 	else:
 		Channel_Names_Metadata = []
-		for i in range(Metadata.getChannelCount(0)):
-			Channel_Name = Metadata.getChannelName(0, i) # Channel_Name are Unicode
+		for i in range(Metadata.getChannelCount(Image_Index)):
+			Channel_Name = Metadata.getChannelName(Image_Index, i) # Channel_Name are Unicode
 			if Channel_Name is not None:
 				Channel_Name = str(Channel_Name) # Convert Unicode to regular string
 			Channel_Names_Metadata.append(Channel_Name)
 		if any(Channel_Name is None for Channel_Name in Channel_Names_Metadata):
 			Channel_Names_Metadata = None
 		Channel_WavelengthsEM_Metadata = []
-		for i in range(Metadata.getChannelCount(0)):
-			WavelengthEM = Metadata.getChannelEmissionWavelength(0, i)
+		for i in range(Metadata.getChannelCount(Image_Index)):
+			WavelengthEM = Metadata.getChannelEmissionWavelength(Image_Index, i)
 			if WavelengthEM is not None:
 				# Extract numeric value from the wavelength metadata
 				Value_Str = str(WavelengthEM)
@@ -370,10 +838,12 @@ def Get_Image_Metadata(imp):
 			Channel_WavelengthsEM_Metadata = None
 
 		# Check if metadata contains objective and instrument information
-		if Metadata.getInstrumentCount() > 0 and Metadata.getObjectiveCount(0) > 0:
-			Objective_Mag_Metadata = str(int(Metadata.getObjectiveNominalMagnification(0,0)))+"x"
-			Objective_NA_Metadata = float(Metadata.getObjectiveLensNA(0, 0))
-			Objective_Immersion_Metadata = str(Metadata.getObjectiveImmersion(0, 0))
+		Objective_Indices = Get_Objective_Indices(Metadata, Image_Index)
+		if Objective_Indices is not None:
+			Instrument_Index, Objective_Index = Objective_Indices
+			Objective_Mag_Metadata = str(int(Metadata.getObjectiveNominalMagnification(Instrument_Index, Objective_Index)))+"x"
+			Objective_NA_Metadata = float(Metadata.getObjectiveLensNA(Instrument_Index, Objective_Index))
+			Objective_Immersion_Metadata = str(Metadata.getObjectiveImmersion(Instrument_Index, Objective_Index))
 		else:
 			Objective_Mag_Metadata = None
 			Objective_NA_Metadata = None
@@ -389,6 +859,83 @@ def Get_Image_Metadata(imp):
 		Image_Metadata["Objective_Immersion_Metadata"] = Objective_Immersion_Metadata
 		Image_Metadata["Channel_Names_Metadata"] = Channel_Names_Metadata
 		Image_Metadata["Channel_WavelengthsEM_Metadata"] = Channel_WavelengthsEM_Metadata
+		Add_Metadata_Index_Entry({"Path": Index_Path, "Size": File_Size, "Mtime": File_Mtime, "Image_Metadata": Image_Metadata})
+	return Image_Metadata
+
+# Return the Instrument_Index and Objective_Index of the objective used to acquire Image_Index. None if the metadata has no objective
+# Each series of a container file can reference its own instrument and objective. The first ones are used when the image has no reference
+def Get_Objective_Indices(Metadata, Image_Index):
+	if Metadata.getInstrumentCount() == 0:
+		return None
+	Instrument_Index = 0
+	Instrument_Ref = Metadata.getImageInstrumentRef(Image_Index)
+	if Instrument_Ref is not None:
+		for i in range(Metadata.getInstrumentCount()):
+			if Metadata.getInstrumentID(i) == Instrument_Ref:
+				Instrument_Index = i
+				break
+	if Metadata.getObjectiveCount(Instrument_Index) == 0:
+		return None
+	Objective_Index = 0
+	Objective_ID = Metadata.getObjectiveSettingsID(Image_Index)
+	if Objective_ID is not None:
+		for i in range(Metadata.getObjectiveCount(Instrument_Index)):
+			if Metadata.getObjectiveID(Instrument_Index, i) == Objective_ID:
+				Objective_Index = i
+				break
+	return Instrument_Index, Objective_Index
+
+# Return the Metadata Index a dictionnary File Path -> {"Path", "Size", "Mtime", "Image_Metadata", "Resolution_Levels"}
+# The index is a JSON lines file. Lines are appended when a file is parsed so later lines replace earlier lines of the same path
+def Get_Metadata_Index():
+	global Metadata_Index
+	if Metadata_Index is None:
+		Metadata_Index = {}
+		Nb_Index_Lines = 0
+		if os.path.exists(Metadata_Index_Path):
+			Index_File = open(Metadata_Index_Path, "r")
+			for Index_Line in Index_File:
+				try:
+					Index_Entry = json.loads(Index_Line)
+				except ValueError: # Line partially written by an interrupted run
+					continue
+				Metadata_Index[Index_Entry["Path"]] = Index_Entry
+				Nb_Index_Lines += 1
+			Index_File.close()
+		# Compact the index when most lines are outdated
+		if Nb_Index_Lines > 2 * len(Metadata_Index):
+			Index_File = open(Metadata_Index_Path, "w")
+			for Index_Entry in Metadata_Index.values():
+				Index_File.write(json.dumps(Index_Entry) + "\n")
+			Index_File.close()
+	return Metadata_Index
+
+# Fields of an unchanged file written by another function are kept in the new entry
+def Add_Metadata_Index_Entry(Index_Entry):
+	Indexed_Entry = Get_Metadata_Index().get(Index_Entry["Path"])
+	if Indexed_Entry is not None and Indexed_Entry["Size"] == Index_Entry["Size"] and Indexed_Entry["Mtime"] == Index_Entry["Mtime"]:
+		Merged_Entry = dict(Indexed_Entry)
+		Merged_Entry.update(Index_Entry)
+		Index_Entry = Merged_Entry
+	Index_Line = json.dumps(Index_Entry)
+	Get_Metadata_Index()[Index_Entry["Path"]] = json.loads(Index_Line) # Stored as written so the caller can modify its Image_Metadata
+	if not os.path.exists(Output_Dir):
+		os.makedirs(Output_Dir)
+	Index_File = open(Metadata_Index_Path, "a")
+	Index_File.write(Index_Line + "\n")
+	Index_File.close()
+	return
+
+# Return a copy of the Image_Metadata of an index entry with the strings converted from unicode
+def Load_Indexed_Metadata(Indexed_Metadata):
+	if Indexed_Metadata is None:
+		return None
+	Image_Metadata = {}
+	for Key in ["Objective_Mag_Metadata", "Objective_Immersion_Metadata"]:
+		Image_Metadata[Key] = str(Indexed_Metadata[Key]) if Indexed_Metadata[Key] is not None else None
+	Image_Metadata["Objective_NA_Metadata"] = Indexed_Metadata["Objective_NA_Metadata"]
+	Image_Metadata["Channel_Names_Metadata"] = [str(Channel_Name) for Channel_Name in Indexed_Metadata["Channel_Names_Metadata"]] if Indexed_Metadata["Channel_Names_Metadata"] is not None else None
+	Image_Metadata["Channel_WavelengthsEM_Metadata"] = list(Indexed_Metadata["Channel_WavelengthsEM_Metadata"]) if Indexed_Metadata["Channel_WavelengthsEM_Metadata"] is not None else None
 	return Image_Metadata
 
 def Get_Refractive_Index(Objective_Immersion): # Get the refractive Index (float) from the Immersion media (String). Return Refracive_Index
@@ -441,36 +988,43 @@ def Process_Image_List(Image_List):
 	Processed_Images_List = []
 	Data_All_Files = []
 	global Image
-	for Image, Image_File in enumerate(Image_List):
-		# Checking Image_File is an opened image
-		if isinstance(Image_File, str) and not ("/" in Image_File or "\\" in Image_File):
-			imp = WindowManager.getImage(Image_File)
-			Image_Window = WindowManager.getFrame(imp.getTitle())
-			Image_Window.toFront()
-			File_Source="Opened"
-		else: # Else Image_File is a path, import it with Bioformat
-			imp = Open_Image_Bioformats(Image_File)
-			File_Source="Folder"
-		#Zoom.set(imp, 0.5);
-		imp.show()
-		Image_Name = imp.getTitle()
-		Prolix_Message("Success opening {} from {}.".format(Image_Name, File_Source))
-		# Process the first image with Process_Image function showing a Dialog
-		if Image == 0:
-			Prolix_Message("Processing initial Image {}.".format(Image_Name))
-			Data_All_Files, Processed_Images_List = Process_Image(imp, Data_All_Files, Processed_Images_List, Batch_Message="")
-		# For subsequent images, check if batch mode is enabled
-		else:
-			Settings_Stored = Read_Preferences(Settings_Template)
-			if Settings_Stored[Function_Name+".Batch_Mode"]:
-				Prolix_Message("Processing in batch {}.".format(Image_Name))
-				Data_All_Files, Processed_Images_List = Process_Image_Batch(imp, Data_All_Files, Processed_Images_List)
-			else:
-			 	IJ.log("Failed Batch processing {}. Falling back to dialog processing.".format(Image_Name))
-				Data_All_Files, Processed_Images_List = Process_Image(imp, Data_All_Files, Processed_Images_List, Batch_Message = "")
-		if File_Source == "Folder":
-			Prolix_Message("Closing {}".format(Image_Name))
-			imp.close()
+	Prefetch = {"Executor": None, "Images": {}} # Image index -> {"Future", "Size"} of the images opened ahead
+	try:
+		for Image, Image_File in enumerate(Image_List):
+			# Checking Image_File is an opened image
+			if isinstance(Image_File, str) and not ("/" in Image_File or "\\" in Image_File):
+				imp = WindowManager.getImage(Image_File)
+				Image_Window = WindowManager.getFrame(imp.getTitle())
+				Image_Window.toFront()
+				File_Source="Opened"
+			else: # Else Image_File is a path, import it with Bioformat
+				imp = Get_Prefetched_Image(Prefetch, Image, Image_File)
+				File_Source="Folder"
+			Open_Resource_Scope(imp)
+			try:
+				#Zoom.set(imp, 0.5);
+				imp.show()
+				Image_Name = imp.getTitle()
+				Prolix_Message("Success opening {} from {}.".format(Image_Name, File_Source))
+				# Process the first image with Process_Image function showing a Dialog
+				if Image == 0:
+					Prolix_Message("Processing initial Image {}.".format(Image_Name))
+					Data_All_Files, Processed_Images_List = Process_Image(imp, Data_All_Files, Processed_Images_List, Batch_Message="")
+					Prefetch_Images(Prefetch, Image_List, Image) # The import settings are set by the first dialog
+				# For subsequent images, check if batch mode is enabled
+				else:
+					Prefetch_Images(Prefetch, Image_List, Image) # The next images are opened while this one is processed
+					Settings_Stored = Read_Preferences(Settings_Template)
+					if Settings_Stored[Function_Name+".Batch_Mode"]:
+						Prolix_Message("Processing in batch {}.".format(Image_Name))
+						Data_All_Files, Processed_Images_List = Process_Image_Batch(imp, Data_All_Files, Processed_Images_List)
+					else:
+					 	IJ.log("Failed Batch processing {}. Falling back to dialog processing.".format(Image_Name))
+						Data_All_Files, Processed_Images_List = Process_Image(imp, Data_All_Files, Processed_Images_List, Batch_Message = "")
+			finally: # The image and its resources are released even if the processing stops
+				Close_Resource_Scope(imp, Close_Image = File_Source == "Folder")
+	finally:
+		Stop_Prefetch(Prefetch)
 	return Data_All_Files, Processed_Images_List
 
 
@@ -1109,6 +1663,20 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 	Batch_Mode_User.setSelected(Settings_Stored[Function_Name+".Batch_Mode"])
 	Processing_Panel.add(Batch_Mode_User, Constraints)
 
+	# Low Memory Import
+	Constraints.gridx = Pos_X + 3
+	Constraints.gridy = Pos_Y
+	Constraints.gridwidth = 1
+	Constraints.gridheight = 1
+	Constraints.anchor = GridBagConstraints.WEST
+	Constraints.insets = Insets(2, 2, 2, 2)
+	Label = "Low Memory Import"
+	Low_Memory_Import_User = JCheckBox(Label)
+	Low_Memory_Import_User.setFont(Font("Arial", Font.PLAIN, 12))
+	Low_Memory_Import_User.setToolTipText("Import the next images as virtual stacks. Only the channel being measured is kept in memory.")
+	Low_Memory_Import_User.setSelected(Settings_Stored[Function_Name+".Low_Memory_Import"])
+	Processing_Panel.add(Low_Memory_Import_User, Constraints)
+
 	Pos_Y += 1
 
 
@@ -1327,8 +1895,7 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 	while Processing_Dialog.isVisible():
 		pass
 
-	Duplicated_Ch_imp.changes = False
-	Duplicated_Ch_imp.close()
+	Release_Image(Duplicated_Ch_imp)
 
 
 
@@ -1370,6 +1937,7 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 	Test_Channel_User = int(Channel_Slider.getValue())
 	Batch_Mode_User = Batch_Mode_User.isSelected()
 	Save_Individual_Files_User = Save_Individual_Files_User.isSelected()
+	Low_Memory_Import_User = Low_Memory_Import_User.isSelected()
 	Prolix_Mode_User = Prolix_Mode_User.isSelected()
 	Test_Processing_User = Test_Processing_User.isSelected()
 
@@ -1389,6 +1957,7 @@ def Display_Processing_Dialog(imp, Dialog_Counter, Test_Processing, Batch_Messag
 		Settings_User[Function_Name+".Channel_WavelengthsEM"] = Channel_WavelengthsEM_User
 		Settings_User[Function_Name+".Batch_Mode"] = Batch_Mode_User
 		Settings_User[Function_Name+".Save_Individual_Files"] = Save_Individual_Files_User
+		Settings_User[Function_Name+".Low_Memory_Import"] = Low_Memory_Import_User
 		Settings_User[Function_Name+".Prolix_Mode"] = Prolix_Mode_User
 		Test_Processing = Test_Processing_User
 		Selected_Channel = Test_Channel_User
@@ -1638,8 +2207,7 @@ def Measure_Uniformity_Single_Channel(imp, Channel, Save_File, Display):
 		#Zoom.set(Duplicated_Ch_imp, 0.5);
 		Duplicated_Ch_imp.show()
 	if not Display:
-		Duplicated_Ch_imp.changes = False
-		Duplicated_Ch_imp.close()
+		Release_Image(Duplicated_Ch_imp)
 	return Data_Ch, Duplicated_Ch_imp
 
 
@@ -1727,7 +2295,7 @@ def Image_Ch_Duplicator(imp, Channel, Display):
 	Original_Title = Image_Info["Basename"]
 	Prolix_Message("Duplicating Channel {} for {}...".format(Channel, Original_Title))
 	New_Title = "{}_Channel-0{}".format(Original_Title, Channel)
-	Duplicated_imp = Duplicator().run(imp, Channel, Channel, 1, 1, 1, 1);
+	Duplicated_imp = Track_Image(Duplicator().run(imp, Channel, Channel, 1, 1, 1, 1))
 	Duplicated_imp.setTitle(New_Title)
 	if Display:
 		#Zoom.set(Duplicated_imp, 0.5);
@@ -1821,7 +2389,7 @@ def Bin_Image_Iso_Intensity(imp, Channel, Display, Nb_Bins=10, Final_Bin_Size=25
 
 	# Duplicate the image processor to threshold on the last bin
 	Duplicated_Ch_imp.setRoi(None)
-	Thresholded_Ch_imp = Duplicated_Ch_imp.duplicate()
+	Thresholded_Ch_imp = Track_Image(Duplicated_Ch_imp.duplicate())
 	IJ.setThreshold(Thresholded_Ch_imp, Threshold_Value_Lower, Threshold_Value_Upper)
 	IJ.run(Thresholded_Ch_imp, "Convert to Mask", "")
 	IJ.run(Thresholded_Ch_imp, "Analyze Particles...", "size=0-Infinity clear add")
@@ -1876,8 +2444,7 @@ def Bin_Image_Iso_Intensity(imp, Channel, Display, Nb_Bins=10, Final_Bin_Size=25
 	Label = TextRoi(int(X_Ref_Pix+OffsetX), int(Y_Ref_Pix+OffsetY), Label_Text, Font_Settings)
 	Label.setColor(Color.BLACK) # Set the font color to black
 	Duplicated_Ch_imp_Overlay.add(Label)
-	Thresholded_Ch_imp.changes = False
-	Thresholded_Ch_imp.close()
+	Release_Image(Thresholded_Ch_imp)
 	Duplicated_Ch_imp.setOverlay(Duplicated_Ch_imp_Overlay)
 	if Display:
 		#Zoom.set(Duplicated_Ch_imp, 0.5);
@@ -1988,7 +2555,7 @@ def Bin_Image_Iso_Density(imp, Channel, Display, Nb_Bins=10, Final_Bin_Size=25):
 
 	# Duplicate the image processor to threshold on the last bin
 	Duplicated_Ch_imp.setRoi(None)
-	Thresholded_Ch_imp = Duplicated_Ch_imp.duplicate()
+	Thresholded_Ch_imp = Track_Image(Duplicated_Ch_imp.duplicate())
 	IJ.setThreshold(Thresholded_Ch_imp, Threshold_Value_Lower, Threshold_Value_Upper)
 	IJ.run(Thresholded_Ch_imp, "Convert to Mask", "")
 	IJ.run(Thresholded_Ch_imp, "Analyze Particles...", "size=0-Infinity clear add")
@@ -2041,8 +2608,7 @@ def Bin_Image_Iso_Density(imp, Channel, Display, Nb_Bins=10, Final_Bin_Size=25):
 	Label = TextRoi(int(X_Ref_Pix+OffsetX), int(Y_Ref_Pix+OffsetY), Label_Text, Font_Settings)
 	Label.setColor(Color.BLACK) # Set the font color to black
 	Duplicated_Ch_imp_Overlay.add(Label)
-	Thresholded_Ch_imp.changes = False
-	Thresholded_Ch_imp.close()
+	Release_Image(Thresholded_Ch_imp)
 	Duplicated_Ch_imp.setOverlay(Duplicated_Ch_imp_Overlay)
 	if Display:
 		#Zoom.set(Duplicated_Ch_imp, 0.5);
@@ -2190,4 +2756,3 @@ Input_File.close()
 Message = "{} {} successful.\n{} images have been processed.\nFiles are saved in {}".format(Plugin_Name, Function_Name, len(Processed_Images_List), Output_Dir)
 IJ.log(Message)
 JOptionPane.showMessageDialog(None, Message, "{} {}".format(Plugin_Name, Function_Name), JOptionPane.INFORMATION_MESSAGE)
-java.lang.System.gc() # Cleaning up my mess ;-)
@@ -73,6 +73,16 @@ def start_toolbar():
         pos_y=0
     )
 
+    # Add "Ch Registration" button
+    add_button(
+        toolbar_panel,
+        "Ch Registration",
+        constraints,
+        lambda event: MacroRunner().run('run("Ch Registration");'),
+        pos_x=2,
+        pos_y=0
+    )
+
     # Add "Autostart" button
     add_button(
         toolbar_panel,